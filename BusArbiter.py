@@ -0,0 +1,168 @@
+"""Keeps the tasks (and the setups, see MeasurementSetups) of this process from getting in each other's way on the bus.
+There are two kinds of locks:
+    - one per resource (eg GPIB0::17::INSTR): held for a whole operation of a device, eg the 4980A's ":FUNC:IMP",
+      trigger and "FETC?". A Trigger polling the Temp_336 can't read in the middle of a ParameterController writing SETP
+    - one per physical interface (eg GPIB0): held only for a single VISA call, so a device waiting for its SRQ doesn't
+      block the others on the same GPIB card. Only GPIB boards are shared by several devices, for USB, TCPIP or a
+      serial port every resource is an interface of its own
+Both are handed over in the order the threads asked for them, so a busy poller can't starve a sweep. How long the
+threads waited is recorded per lock, see BusArbiter.report."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition, Lock, get_ident
+import time
+
+from StreamingStatistics import RunningStatistics
+
+
+class FairLock:
+    """A reentrant lock that is handed over first come, first served"""
+
+    def __init__(self):
+        self._condition = Condition(Lock())
+        self._waiting = deque()
+        self._owner = None
+        self._depth = 0
+
+    def acquire(self):
+        """
+        :return: how many seconds the thread waited for the lock
+        :rtype: float
+        """
+        thread = get_ident()
+        with self._condition:
+            if self._owner == thread:
+                self._depth += 1
+                return 0.0
+            if self._owner is None and not self._waiting:
+                self._owner = thread
+                self._depth = 1
+                return 0.0
+            started_waiting = time.perf_counter()
+            self._waiting.append(thread)
+            while self._owner is not None or self._waiting[0] != thread:
+                self._condition.wait()
+            self._waiting.popleft()
+            self._owner = thread
+            self._depth = 1
+            return time.perf_counter() - started_waiting
+
+    def release(self):
+        with self._condition:
+            if self._owner != get_ident():
+                raise RuntimeError("Released a FairLock that isn't held by this thread")
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._condition.notify_all()
+
+
+class BusArbiter:
+
+    def __init__(self):
+        self._locks = {}  # type: {str: FairLock}
+        self.wait_statistics = {}  # type: {str: RunningStatistics} # in seconds, every acquisition counts
+        self.contended = {}  # type: {str: int} # how many acquisitions had to wait at all
+        self._lock = Lock()
+
+    @staticmethod
+    def interface_of(resource_name: str):
+        """eg GPIB0 for GPIB0::17::INSTR. Devices on other interfaces don't share the line with anybody"""
+        interface = resource_name.split("::")[0]
+        if interface.upper().startswith("GPIB"):
+            return interface.upper()
+        return resource_name
+
+    def _get_lock(self, key: str):
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = FairLock()
+                self.wait_statistics[key] = RunningStatistics([0.95])
+                self.contended[key] = 0
+            return self._locks[key]
+
+    def _acquire(self, key: str):
+        lock = self._get_lock(key)
+        waited = lock.acquire()
+        with self._lock:
+            self.wait_statistics[key].add(waited)
+            if waited > 0:
+                self.contended[key] += 1
+        return lock
+
+    @contextmanager
+    def transaction(self, resource_name: str):
+        """Nobody else talks to the resource until the transaction is over. Other devices on the same interface still
+        can, between the single calls of the transaction"""
+        lock = self._acquire(resource_name)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    @contextmanager
+    def bus_access(self, resource_name: str):
+        """For one VISA call. The resource lock is always taken before the interface lock, so they can't deadlock"""
+        resource_lock = self._acquire(resource_name)
+        try:
+            interface_lock = self._acquire(self.interface_of(resource_name))
+            try:
+                yield
+            finally:
+                interface_lock.release()
+        finally:
+            resource_lock.release()
+
+    def report(self):
+        """
+        :return: a line for every lock somebody had to wait for, the longest total wait first
+        :rtype: [str]
+        """
+        with self._lock:
+            contended = [(key, statistics, self.contended[key]) for key, statistics in self.wait_statistics.items()
+                         if self.contended[key] > 0]
+        contended.sort(key=lambda entry: entry[1].mean * entry[1].count, reverse=True)
+        lines = []
+        for key, statistics, contended_count in contended:
+            lines.append("{0}: waited {1} of {2} times, {3:.1f} s in total, mean {4:.3f} s, 95% below {5:.3f} s, "
+                         "longest {6:.3f} s".format(key, contended_count, statistics.count,
+                                                   statistics.mean * statistics.count, statistics.mean,
+                                                   statistics.quantiles[0].value, statistics.maximum))
+        return lines
+
+
+class ArbitratedResource:
+    """Stands in for a pyvisa resource. Every call that talks to the device goes through the BusArbiter, everything
+    else (eg wait_for_srq or the timeout) is passed on as it is"""
+
+    io_methods = ["write", "read", "query", "query_ascii_values", "query_binary_values", "write_raw", "read_raw",
+                  "read_bytes", "write_ascii_values", "write_binary_values", "assert_trigger", "clear"]
+
+    def __init__(self, resource, arbiter: BusArbiter):
+        # __setattr__ is passed on to the resource, so these have to go around it
+        object.__setattr__(self, "_resource", resource)
+        object.__setattr__(self, "_arbiter", arbiter)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._resource, name)
+        if name not in self.io_methods:
+            return attribute
+
+        def arbitrated(*args, **kwargs):
+            with self._arbiter.bus_access(self._resource.resource_name):
+                return attribute(*args, **kwargs)
+
+        return arbitrated
+
+    def __setattr__(self, name, value):
+        setattr(self._resource, name, value)
+
+    def transaction(self):
+        return self._arbiter.transaction(self._resource.resource_name)
+
+
+# one for the whole process, setups measuring at the same time share the interfaces
+bus_arbiter = BusArbiter()
@@ -0,0 +1,242 @@
+"""Checkpoints make an interrupted measurement resumable. While measuring, two files live next to the autosaves in the
+run directory:
+    - NAME_checkpoint.json: the execution cursor. Every task writes its position (eg the index into its specific values,
+      the ramp position or the next fire time of a Trigger) whenever it reached a point from which it could continue,
+      together with the amount of datapoints it and its sub_tasks had at that moment.
+    - NAME_points.journal: every datapoint is appended here the moment it's added to the database, so points measured
+      after the last autosave aren't lost.
+When resuming, the newest autosave is loaded, the journal is replayed on top of it and all points that were measured
+after the last cursor of their task are dropped as they will be measured again. Then the tasks continue from their
+cursors, so no finished point is measured twice."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import json
+import os
+import pickle
+from threading import Lock
+
+import UserInput
+
+
+class CheckpointError(Exception):
+    """class to indicate that a run can't be resumed from what is on disk
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+
+    def __str__(self):
+        return str(self.problem)
+
+
+class PointJournal:
+    """Append-only file of all datapoints of a run. The first record holds the amount of points every identifier
+    already had when the journal was started, all following records are (identifier, datapoint) tuples."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = Lock()
+
+    def start(self, base_counts: dict):
+        """Starts a new journal, overwriting an old one
+
+        :param base_counts: {identifier tuple: amount of points} of the database at the moment the journal starts
+        """
+        self._file = open(self.path, "wb")
+        self._write(base_counts)
+
+    def append(self, identifier: [], datapoint):
+        with self._lock:
+            if self._file is not None:
+                self._write((tuple(identifier), datapoint))
+
+    def _write(self, record):
+        pickle.dump(record, self._file, -1)
+        self._file.flush()
+        # after a power cut, the journal should contain everything the cursor knows about
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def read(self):
+        """Reads back a journal
+
+        :return: base_counts, list of (identifier tuple, datapoint)
+        """
+        base_counts = {}
+        records = []
+        if not os.path.isfile(self.path):
+            return base_counts, records
+        with open(self.path, "rb") as journal_file:
+            try:
+                base_counts = pickle.load(journal_file)
+                while True:
+                    records.append(pickle.load(journal_file))
+            except EOFError:
+                pass
+            except (pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                # the last record was only written halfway when the program died. Everything before is fine
+                UserInput.post_status("The point journal ends with an incomplete record, ignoring it.")
+        return base_counts, records
+
+
+class Checkpoint:
+    """Keeps the execution cursor of a run up to date on disk and restores a run from it.
+
+    Cursors are stored per task. When a task saves its cursor, the cursors of its (sub-)sub_tasks are dropped: they just
+    finished everything they had to do for the current step of the task and start from scratch in its next step. That
+    way, the deepest cursor that exists for an identifier is always the newest one.
+    """
+
+    def __init__(self, run_directory: str, name: str, database):
+        """
+        :param run_directory: the directory the database is pickled to
+        :param name: name of the run, same as the name of the database
+        :param database: the DataStorage.Database that gets the points of the run
+        """
+        self.database = database
+        self.task_tree = None
+        self.cursor_path = os.path.join(run_directory, "{0}_checkpoint.json".format(name))
+        self.journal = PointJournal(os.path.join(run_directory, "{0}_points.journal".format(name)))
+        self._lock = Lock()
+        # {identifier tuple: {"state": dict, "point_counts": {identifier tuple: int}}}
+        self._cursors = {}
+        # the cursors of the interrupted run, every task takes its own out once when it starts again
+        self._resume_states = {}
+
+    @staticmethod
+    def exists(run_directory: str, name: str):
+        return os.path.isfile(os.path.join(run_directory, "{0}_checkpoint.json".format(name)))
+
+    def start(self, task_tree):
+        """Starts recording the run. Called by the Measurement right before the tasks are started
+
+        :param task_tree: the MeasurementComponents.TaskTree of the measurement
+        """
+        self.task_tree = task_tree
+        directory = os.path.dirname(self.cursor_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        base_counts = {}
+        for task in task_tree:
+            base_counts[tuple(task.identifier)] = self.database.amount_of_points(task.identifier)
+        self.journal.start(base_counts)
+        self.database.point_journal = self.journal
+        with self._lock:
+            self._write_cursors()
+
+    def close(self):
+        """Stops recording, called by the Measurement once all tasks are done"""
+        self.database.point_journal = None
+        self.journal.close()
+
+    def delete_files(self):
+        """Once a run is finished and pickled, the cursor and journal aren't needed anymore"""
+        for path in (self.cursor_path, self.journal.path):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def save(self, identifier: [], state: dict):
+        """Stores the cursor of a task. Only call this when the task could continue from exactly this state, eg after
+        all sub_tasks of a step are finished.
+
+        :param identifier: identifier of the task
+        :param state: json serializable dictionary with whatever the task needs to continue
+        """
+        key = tuple(identifier)
+        if self.task_tree.get(identifier) is None:
+            # the task was removed via the ControlChannel while it was still running
+            return
+        point_counts = {}
+        for task in self.task_tree.sub_tree_of(identifier):
+            point_counts[tuple(task.identifier)] = self.database.amount_of_points(task.identifier)
+        with self._lock:
+            for cursor_key in list(self._cursors.keys()):
+                if len(cursor_key) > len(key) and cursor_key[:len(key)] == key:
+                    del self._cursors[cursor_key]
+            self._cursors[key] = {"state": state, "point_counts": point_counts}
+            self._write_cursors()
+
+    def take_resume_state(self, identifier: []):
+        """
+        :return: the cursor an interrupted run saved for the task or None. Every cursor is only handed out once
+        :rtype: dict
+        """
+        with self._lock:
+            return self._resume_states.pop(tuple(identifier), None)
+
+    def _write_cursors(self):
+        cursors = []
+        for key, cursor in sorted(self._cursors.items()):
+            point_counts = [[list(identifier), amount] for identifier, amount in sorted(cursor["point_counts"].items())]
+            cursors.append({"identifier": list(key), "state": cursor["state"], "point_counts": point_counts})
+        # write to a temporary file first and then replace the old one, so there always is a complete cursor file
+        temporary_path = self.cursor_path + ".tmp"
+        with open(temporary_path, "w") as cursor_file:
+            json.dump({"cursors": cursors}, cursor_file)
+            cursor_file.flush()
+            os.fsync(cursor_file.fileno())
+        os.replace(temporary_path, self.cursor_path)
+
+    def _read_cursors(self):
+        try:
+            with open(self.cursor_path, "r") as cursor_file:
+                content = json.load(cursor_file)
+        except (OSError, ValueError) as error:
+            raise CheckpointError("Couldn't read the checkpoint at {0}: {1}".format(self.cursor_path, error))
+        cursors = {}
+        for cursor in content["cursors"]:
+            point_counts = {}
+            for identifier, amount in cursor["point_counts"]:
+                point_counts[tuple(identifier)] = amount
+            cursors[tuple(cursor["identifier"])] = {"state": cursor["state"], "point_counts": point_counts}
+        return cursors
+
+    def restore(self, task_tree):
+        """Brings the database back to the state of the cursors of the interrupted run. The database has to be loaded
+        from the newest autosave and all tasks have to be recreated before.
+
+        :param task_tree: the MeasurementComponents.TaskTree with the recreated tasks
+        """
+        self._cursors = self._read_cursors()
+        for key, cursor in self._cursors.items():
+            self._resume_states[key] = cursor["state"]
+
+        # First append everything from the journal that didn't make it into the autosave
+        base_counts, records = self.journal.read()
+        already_in_database = {}
+        for task in task_tree:
+            key = tuple(task.identifier)
+            already_in_database[key] = max(0, self.database.amount_of_points(task.identifier) -
+                                           base_counts.get(key, 0))
+        replayed = 0
+        for identifier, datapoint in records:
+            if identifier not in already_in_database:
+                continue
+            if already_in_database[identifier] > 0:
+                already_in_database[identifier] -= 1
+            else:
+                self.database.add_point(list(identifier), datapoint)
+                replayed += 1
+
+        # Then drop what was measured after the last cursor, it will be measured again
+        dropped = 0
+        for task in task_tree:
+            key = tuple(task.identifier)
+            amount_to_keep = 0
+            # the deepest cursor that covers the task is the newest one
+            for depth in range(len(key), 0, -1):
+                cursor = self._cursors.get(key[:depth])
+                if cursor is not None:
+                    amount_to_keep = cursor["point_counts"].get(key, 0)
+                    break
+            dropped += self.database.truncate_points(task.identifier, amount_to_keep)
+
+        UserInput.post_status("Restored the interrupted run: {0} points came from the journal, {1} unfinished ones "
+                              "will be measured again.".format(replayed, dropped))
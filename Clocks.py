@@ -0,0 +1,145 @@
+"""Tasks never call time.sleep or time.perf_counter directly but ask the clock of their engine. Usually that's the real
+clock, for a dry run (see DryRun) it's a virtual clock that jumps ahead whenever everybody is waiting, so a task list
+that would take weeks is run through in seconds."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import heapq
+from threading import Condition
+import time
+
+
+class RealClock:
+    """The wall clock, simply forwarding to the time module"""
+
+    @staticmethod
+    def perf_counter():
+        return time.perf_counter()
+
+    @staticmethod
+    def sleep(seconds: float):
+        time.sleep(seconds)
+
+    @staticmethod
+    def strftime(format_string: str):
+        return time.strftime(format_string)
+
+    @staticmethod
+    def time():
+        return time.time()
+
+
+class VirtualClock:
+    """A discrete event clock for simulations. Every thread that takes part in the simulation is a runner (see
+    add_runner). Runners that sleep or wait for something don't count as running anymore. Once no runner is running,
+    the clock jumps to the earliest time one of them wants to be woken up at. Only runners may use the clock."""
+
+    def __init__(self, resolution=1.0, start_epoch: float = None):
+        """
+        :param resolution: shortest sleep in seconds. Loops that sleep for a few milliseconds in reality would take
+        ages to simulate, so they are slowed down to this resolution
+        :param start_epoch: the seconds since the epoch the virtual time starts at, now by default
+        """
+        self.resolution = resolution
+        self._start_epoch = start_epoch
+        if start_epoch is None:
+            self._start_epoch = time.time()
+        self._condition = Condition()
+        self._now = 0.0
+        self._running = 0
+        self._wake_times = []
+        self._waiting_predicates = []
+
+    def perf_counter(self):
+        return self._now
+
+    def time(self):
+        return self._start_epoch + self._now
+
+    def strftime(self, format_string: str):
+        return time.strftime(format_string, time.localtime(self.time()))
+
+    def add_runner(self):
+        """Registers a new runner. Call it before the thread is started, so the clock can't jump ahead in between"""
+        with self._condition:
+            self._running += 1
+
+    def remove_runner(self):
+        with self._condition:
+            self._running -= 1
+            self._advance_if_everybody_waits()
+
+    def notify(self):
+        """Has to be called (eg by the engine) whenever something a runner might wait for has changed"""
+        with self._condition:
+            self._advance_if_everybody_waits()
+            self._condition.notify_all()
+
+    def sleep(self, seconds: float):
+        self.wait_until(lambda: False, max(seconds, self.resolution))
+
+    def pass_time(self, seconds: float):
+        """Like sleep, but without the resolution. For simulated devices, whose latencies are often shorter than it"""
+        self.wait_until(lambda: False, seconds)
+
+    def wait_until(self, predicate, timeout: float = None):
+        """Blocks the calling runner until predicate() is true or the timeout passed in virtual time
+
+        :param predicate: function without arguments
+        :param timeout: virtual seconds, None waits as long as it takes
+        :return: the last result of predicate()
+        :rtype: bool
+        """
+        with self._condition:
+            deadline = None
+            if timeout is not None:
+                deadline = self._now + max(0.0, timeout)
+                heapq.heappush(self._wake_times, deadline)
+            self._waiting_predicates.append(predicate)
+            self._running -= 1
+            try:
+                while True:
+                    if predicate():
+                        return True
+                    if deadline is not None and self._now >= deadline:
+                        return False
+                    self._advance_if_everybody_waits()
+                    if predicate() or (deadline is not None and self._now >= deadline):
+                        continue
+                    self._condition.wait()
+            finally:
+                self._running += 1
+                self._waiting_predicates.remove(predicate)
+                if deadline is not None:
+                    self._wake_times.remove(deadline)
+                    heapq.heapify(self._wake_times)
+
+    def _advance_if_everybody_waits(self):
+        """Has to be called with the condition held"""
+        if self._running > 0:
+            return
+        # A runner that can continue right now is about to wake up, the time must not pass before it did
+        for predicate in self._waiting_predicates:
+            if predicate():
+                self._condition.notify_all()
+                return
+        if self._wake_times:
+            next_wake_time = self._wake_times[0]
+            if next_wake_time > self._now:
+                self._now = next_wake_time
+            self._condition.notify_all()
+
+
+def format_duration(seconds: float):
+    """
+    :return: eg "2 d 03:12:40"
+    :rtype: str
+    """
+    seconds = int(round(seconds))
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    duration = "{0:02d}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
+    if days:
+        duration = "{0} d {1}".format(days, duration)
+    return duration
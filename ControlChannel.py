@@ -0,0 +1,222 @@
+"""Lets the user intervene in a running measurement without killing the program. The channel is a plain text file in
+the run directory (NAME_control.txt). Whatever is written into it is read once a second, executed and the file is
+deleted again. One command per line:
+    - pause: every task stops at its next safe point (between two steps, eg before setting the next frequency)
+    - resume: continue after a pause
+    - skip [0, 0, 1]: the task stops its current run at the next safe point, eg to skip the rest of a frequency sweep.
+      Without an identifier, the deepest ParameterController that is running right now is skipped
+    - append {task definition}: adds a task to the running task list. The definition is the json of Task.to_definition,
+      eg {"type": "DataAcq", "identifier": [0, 0, 1], "measurable": {"name": "RX", "dev": "ALPHA"},
+      "average_through_sub_task": false}
+    - remove [0, 1]: removes the task and its sub_tasks. If they are running, they are skipped first
+    - status: shows whether the run is paused and which tasks are running
+Changes to the task list take effect the next time the parent of a task starts its sub_tasks."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import json
+import os
+from threading import Thread, Condition, Event
+import traceback
+
+import UserInput
+
+
+class ControlCommandError(Exception):
+    """class to indicate that a command of the control channel couldn't be executed
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+
+    def __str__(self):
+        return str(self.problem)
+
+
+class ControlChannel(Thread):
+    """Watches the control file while the measurement is running. The tasks ask it at their safe points whether they
+    have to wait (pause) or stop their current run (skip), see Task._safe_point in MeasurementComponents."""
+
+    poll_interval = 1.0
+
+    def __init__(self, path: str):
+        """
+        :param path: the control file, usually NAME_control.txt in the run directory
+        """
+        super().__init__(name="JUMP-control", daemon=True)
+        self.path = path
+        self.measurement = None
+        self.committer = None
+        self.paused = False
+        self._condition = Condition()
+        self._skip_requests = set()
+        self._stop_event = Event()
+
+    def attach(self, measurement, committer):
+        """Called by the Measurement right before the tasks are started
+
+        :param measurement: the MeasurementComponents.Measurement that is measuring
+        :param committer: its DataStorage.Committer, changes to the task list are done through it so they don't
+        interfere with an autosave
+        """
+        self.measurement = measurement
+        self.committer = committer
+        # a command that was left over from an earlier run must not be executed in this one
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        UserInput.post_status("The run can be controlled by writing commands (pause, resume, skip [identifier], "
+                              "append {{task definition}}, remove [identifier], status) into {0}".format(self.path))
+
+    def run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            for command in self._take_commands():
+                try:
+                    self.execute(command)
+                except ControlCommandError as error:
+                    UserInput.post_status("Control: {0}".format(error))
+                except Exception:
+                    UserInput.post_status("Control: '{0}' failed:\n{1}".format(command, traceback.format_exc()))
+
+    def stop(self):
+        """Ends watching the file. A pause is lifted so no task stays blocked"""
+        self._stop_event.set()
+        self.resume()
+        if self.is_alive():
+            self.join()
+
+    def _take_commands(self):
+        """Reads and deletes the control file
+
+        :return: the non-empty lines
+        :rtype: [str]
+        """
+        if not os.path.isfile(self.path):
+            return []
+        # move it out of the way first, so nothing the user writes in the meantime gets lost
+        taken_path = self.path + ".taken"
+        try:
+            os.replace(self.path, taken_path)
+            with open(taken_path, "r") as control_file:
+                lines = control_file.read().splitlines()
+            os.remove(taken_path)
+        except OSError as error:
+            UserInput.post_status("Control: couldn't read {0}: {1}".format(self.path, error))
+            return []
+        return [line.strip() for line in lines if line.strip()]
+
+    def execute(self, command: str):
+        """Executes one line of the control file"""
+        keyword, _, argument = command.partition(" ")
+        keyword = keyword.lower()
+        argument = argument.strip()
+        if keyword == "pause":
+            self.pause()
+        elif keyword == "resume":
+            self.resume()
+        elif keyword == "skip":
+            self.skip(self._parse_identifier(argument) if argument else None)
+        elif keyword == "append":
+            try:
+                definition = json.loads(argument)
+            except ValueError as error:
+                raise ControlCommandError("The task definition isn't valid json: {0}".format(error))
+            self.committer.call(self._change_task_list, self.measurement.append_task_while_measuring, definition)
+        elif keyword == "remove":
+            identifier = self._parse_identifier(argument)
+            self.skip_sub_tree(identifier)
+            self.committer.call(self._change_task_list, self.measurement.remove_task_while_measuring, identifier)
+        elif keyword == "status":
+            self.post_state()
+        else:
+            raise ControlCommandError("Unknown command '{0}'".format(command))
+
+    @staticmethod
+    def _change_task_list(change, argument):
+        """Runs on the committer thread, so a mistake in the command only shows up as a message"""
+        try:
+            change(argument)
+        except ControlCommandError as error:
+            UserInput.post_status("Control: {0}".format(error))
+
+    @staticmethod
+    def _parse_identifier(argument: str):
+        try:
+            identifier = json.loads(argument)
+        except ValueError:
+            identifier = None
+        if not isinstance(identifier, list) or not all([isinstance(index, int) for index in identifier]) or \
+                len(identifier) == 0:
+            raise ControlCommandError("'{0}' isn't an identifier like [0, 1]".format(argument))
+        return identifier
+
+    def pause(self):
+        with self._condition:
+            self.paused = True
+        UserInput.post_status("Control: pausing, the tasks stop at their next safe point.")
+
+    def resume(self):
+        with self._condition:
+            was_paused = self.paused
+            self.paused = False
+            self._condition.notify_all()
+        if was_paused:
+            UserInput.post_status("Control: resuming.")
+
+    def skip(self, identifier: [] = None):
+        """Asks a running task to stop its current run at its next safe point
+
+        :param identifier: the task, None for the deepest ParameterController that is running
+        """
+        # MeasurementComponents imports this module, so it is imported here and not at the top
+        import MeasurementComponents
+        tasks = self.measurement.tasks
+        if identifier is None:
+            running = [task for task in tasks
+                       if task.is_doing and isinstance(task, MeasurementComponents.ParameterController)]
+            if not running:
+                raise ControlCommandError("No sweep is running right now, nothing to skip.")
+            identifier = max(running, key=lambda task: len(task.identifier)).identifier
+        if tasks.get(identifier) is None:
+            raise ControlCommandError("There is no task {0}".format(str(identifier)))
+        if not tasks.get(identifier).is_doing:
+            raise ControlCommandError("Task {0} isn't running right now".format(str(identifier)))
+        with self._condition:
+            self._skip_requests.add(tuple(identifier))
+            # a paused task has to notice it too
+            self._condition.notify_all()
+        UserInput.post_status("Control: task {0} stops at its next safe point.".format(str(identifier)))
+
+    def skip_sub_tree(self, identifier: []):
+        if self.measurement.tasks.get(identifier) is None:
+            raise ControlCommandError("There is no task {0}".format(str(identifier)))
+        with self._condition:
+            for task in self.measurement.tasks.sub_tree_of(identifier):
+                if task.is_doing:
+                    self._skip_requests.add(tuple(task.identifier))
+            self._condition.notify_all()
+
+    def wait_at_safe_point(self, identifier: [] = None):
+        """Blocks while the run is paused
+
+        :param identifier: of the task that waits, None for the Measurement between two top level tasks
+        :return: True if the task should stop its current run
+        :rtype: bool
+        """
+        key = tuple(identifier) if identifier is not None else None
+        with self._condition:
+            while self.paused and key not in self._skip_requests:
+                self._condition.wait()
+            if key in self._skip_requests:
+                self._skip_requests.discard(key)
+                return True
+        return False
+
+    def task_finished(self, identifier: []):
+        """A skip that arrives after the task passed its last safe point must not hit its next run"""
+        with self._condition:
+            self._skip_requests.discard(tuple(identifier))
+
+    def post_state(self):
+        running = [str(task.identifier) for task in self.measurement.tasks if task.is_doing]
+        state = "paused" if self.paused else "running"
+        UserInput.post_status("Control: the run is {0}, tasks at work: {1}".format(state, ", ".join(running) or "none"))
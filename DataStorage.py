@@ -8,9 +8,10 @@ import pickle
 import copy
 import time
 import queue
-from threading import Thread
+from threading import Thread, Event, Lock
 import os
 import math
+import traceback
 
 import UserInput
 import _version
@@ -21,6 +22,8 @@ class Database:
                  comment="I fight for the User!", creation_time=time.strftime("%d.%m.%Y %H:%M:%S")):
         self.db = {}  # {p1:[point1, point2], c1:[point1, point2]}
         self.tasks_of_a_run = []  # this is where we store the task list for a run
+        # where the time of the run went, one dict per task, see Measurement._collect_task_timings
+        self.task_timings = []
         self.name = name
         self.experimenter = experimenter
         self.room = room
@@ -29,6 +32,17 @@ class Database:
         self.creation_time = creation_time
         self.version = _version.__version__
         self.task_input=[]#Helps with setting up a template
+        self.task_definitions = []  # everything needed to recreate the tasks of a run, eg to resume it
+        self.measurement_setup_name = None  # type: str
+        self.point_journal = None  # type: Checkpoints.PointJournal # not pickled, see __getstate__
+        # goes up with every change of the data, an autosave is only needed if it did since the last one (see Autosaver)
+        self.modifications = 0
+
+    def __getstate__(self):
+        # an open journal file can't be pickled and doesn't belong into a saved database anyway
+        state = self.__dict__.copy()
+        state["point_journal"] = None
+        return state
 
     def change_to_passed_db(self, unpickled_db):
         """
@@ -38,6 +52,11 @@ class Database:
         self.db = unpickled_db.db
         self.tasks_of_a_run = unpickled_db.tasks_of_a_run
 
+        try:
+            self.task_timings = unpickled_db.task_timings
+        except AttributeError:
+            self.task_timings = []
+
         try:
             self.name = unpickled_db.name
         except AttributeError:
@@ -68,6 +87,16 @@ class Database:
         except AttributeError:
             self.comment = "I fight for the User!"
 
+        try:
+            self.task_definitions = unpickled_db.task_definitions
+        except AttributeError:
+            self.task_definitions = []
+
+        try:
+            self.measurement_setup_name = unpickled_db.measurement_setup_name
+        except AttributeError:
+            self.measurement_setup_name = None
+
     def start_fresh(self, name="Run1", pickle_path=".{0}".format(os.sep), experimenter="Tron", room="Dream World",
                  comment="I fight for the User!", creation_time=time.strftime("%d.%m.%Y %H:%M:%S")):
         """ You may want to make multiple measurement runs. This means though that the database should be cleared. This
@@ -78,6 +107,7 @@ class Database:
         """
         self.db = {}
         self.tasks_of_a_run = []
+        self.task_timings = []
         self.name = name
         self.pickle_path = pickle_path
         self.version = _version.__version__
@@ -85,6 +115,9 @@ class Database:
         self.room = room
         self.comment = comment
         self.creation_time = creation_time
+        self.task_definitions = []
+        self.measurement_setup_name = None
+        self.modifications = 0
 
     def measurement_finished(self):
         # Database should be pickled NOW
@@ -918,6 +951,48 @@ class Database:
         for sub_part in identifier:
             recursive_db = recursive_db[sub_part]
         recursive_db["Datapoints"].append(Datapoint)
+        self.modifications += 1
+        if self.point_journal is not None:
+            self.point_journal.append(identifier, Datapoint)
+
+    def add_skipped_values(self, identifier: [], values: list, reason: str):
+        """Notes values a task didn't measure in one of its runs, eg because its time budget was used up. They are kept
+        next to the datapoints of the task under "Skipped values", one entry per run
+
+        :param values: the values of the controlable that weren't set
+        :param reason: human readable, eg "time budget of 30 minutes used up"
+        """
+        recursive_db = self.db
+        for sub_part in identifier:
+            recursive_db = recursive_db[sub_part]
+        recursive_db.setdefault("Skipped values", []).append({"time": time.strftime("%d.%m.%Y %H:%M:%S"),
+                                                              "values": list(values), "reason": reason})
+        self.modifications += 1
+
+    def amount_of_points(self, identifier: []):
+        """
+        :return: how many datapoints the task with the identifier has stored so far, 0 if it has no storage yet
+        :rtype: int
+        """
+        try:
+            return len(self._get_datapoint_list_at_identifier(identifier))
+        except (IndexError, KeyError):
+            return 0
+
+    def truncate_points(self, identifier: [], amount_to_keep: int):
+        """Drops all datapoints of the identifier after the first amount_to_keep ones
+
+        :return: how many points were dropped
+        :rtype: int
+        """
+        try:
+            datapoints = self._get_datapoint_list_at_identifier(identifier)
+        except (IndexError, KeyError):
+            return 0
+        amount_to_drop = max(0, len(datapoints) - amount_to_keep)
+        del datapoints[amount_to_keep:]
+        self.modifications += 1
+        return amount_to_drop
 
     def make_storage(self, identifier: [], data_source, human_readable_taskname: str):  # identifier:[0,1,3,2]
         data_level_dict = {"type": data_source, "Datapoints": [], "human_readable_task": human_readable_taskname}
@@ -934,6 +1009,7 @@ class Database:
                     recursive_db_level = recursive_db_level[temp_id]
             else:
                 recursive_db_level = recursive_db_level[temp_id]
+        self.modifications += 1
 
     def calculate_all_values(self, geometry=None):
         """Traverses the database and calculates all calculatable values as implemented in DataManipulator
@@ -1437,4 +1513,153 @@ class OutputFile(Thread):
         self.file.close()
 
 
+class Committer(Thread):
+    """Does the bookkeeping of a running measurement in the background: adding the datapoints to the database, saving
+    the checkpoint cursors, pickling the autosaves and posting status messages. The tasks only put these jobs into a
+    queue and go on talking to their devices, so the time between two instrument commands only depends on the
+    instruments and not on the disk or the console.
+    The jobs are done strictly in the order they came in. That's why a cursor always counts exactly the points that
+    were queued before it and why an autosave never sees the database halfway through adding a point.
+    """
+
+    def __init__(self):
+        super().__init__(name="JUMP-committer", daemon=True)
+        self.queue = queue.Queue()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                function, arguments = job
+                function(*arguments)
+            except Exception:
+                # Bookkeeping must not stop the measurement, but the user has to know
+                UserInput.post_status("Committer job failed:\n" + traceback.format_exc())
+            finally:
+                self.queue.task_done()
+
+    def add_point(self, database: Database, identifier: [], datapoint: dict):
+        self.queue.put((database.add_point, (identifier, datapoint)))
+
+    def save_cursor(self, checkpoint, identifier: [], state: dict):
+        """
+        :param checkpoint: the Checkpoints.Checkpoint of the run
+        """
+        self.queue.put((checkpoint.save, (identifier, state)))
+
+    def pickle_database(self, database: Database, suffix=""):
+        self.queue.put((database.pickle_database, (suffix,)))
+
+    def call(self, function, *arguments):
+        """Queues any other job, eg a change of the task list that must not happen in the middle of an autosave"""
+        self.queue.put((function, arguments))
+
+    def post_status(self, timestamp: float, template: str, *arguments):
+        """Queues a status message. It's only put together on the committer thread.
+
+        :param timestamp: seconds since the epoch when it happened, shown in front of the message
+        :param template: str.format template for the arguments, eg "Halting {0}"
+        """
+        self.queue.put((Committer._post_status, (timestamp, template, arguments)))
+
+    @staticmethod
+    def _post_status(timestamp: float, template: str, arguments: tuple):
+        UserInput.post_status(time.strftime("%c", time.localtime(timestamp)) + ": " + template.format(*arguments))
+
+    def flush(self):
+        """Blocks until every job that was queued so far is done"""
+        self.queue.join()
+
+    def stop(self):
+        """Finishes all queued jobs and ends the thread"""
+        self.flush()
+        self.queue.put(None)
+        self.join()
+
+
+class Autosaver(Thread):
+    """Pickles the database of a running measurement into its autosaves, alternating between _autosave1 and
+    _autosave2 so one of them is always complete. It saves once every_points changes came together or every_seconds
+    passed, but only if the data changed since the last autosave: a run that waits for hours at a temperature doesn't
+    pickle the same database over and over. The pickling itself is queued on the Committer, so it never sees the
+    database halfway through adding a point and the tasks don't wait for the disk.
+    """
+
+    # how often it's checked whether an autosave is due
+    check_interval = 1.0
+
+    def __init__(self, database: Database, committer: Committer, every_points=500, every_seconds=300.0):
+        """
+        :param every_points: changes (mostly new datapoints) after which an autosave is due
+        :param every_seconds: time after which an autosave is due if anything changed at all
+        """
+        super().__init__(name="JUMP-autosave", daemon=True)
+        self.database = database
+        self.committer = committer
+        self.every_points = every_points
+        self.every_seconds = every_seconds
+        self.amount_of_autosaves = 0
+        # time the committer spent pickling
+        self.seconds_spent = 0.0
+        self._saved_modifications = None  # type: int # None until the first autosave is written
+        self._last_save = time.perf_counter()
+        self._next_suffix = "_autosave1"
+        self._save_pending = False
+        self._lock = Lock()
+        self._stop_event = Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.check_interval):
+            unsaved = self.unsaved_modifications()
+            if unsaved == 0:
+                continue
+            if unsaved >= self.every_points or time.perf_counter() - self._last_save >= self.every_seconds:
+                self.save()
+
+    def unsaved_modifications(self):
+        """
+        :return: how many changes aren't in an autosave yet. Before the first autosave, the database counts as changed
+        :rtype: int
+        """
+        if self._saved_modifications is None:
+            return self.database.modifications + 1
+        return self.database.modifications - self._saved_modifications
+
+    def save(self):
+        """Queues an autosave, unless one is queued already"""
+        with self._lock:
+            if self._save_pending:
+                return
+            self._save_pending = True
+            suffix = self._next_suffix
+            self._next_suffix = "_autosave2" if suffix == "_autosave1" else "_autosave1"
+            self._last_save = time.perf_counter()
+        self.committer.call(self._pickle, suffix)
+
+    def save_if_changed(self):
+        if self.unsaved_modifications() > 0:
+            self.save()
+
+    def _pickle(self, suffix: str):
+        # runs on the committer thread, nothing changes the database in the meantime
+        modifications = self.database.modifications
+        started = time.perf_counter()
+        try:
+            self.database.pickle_database(suffix)
+        finally:
+            self.seconds_spent += time.perf_counter() - started
+            with self._lock:
+                self._save_pending = False
+        self._saved_modifications = modifications
+        self.amount_of_autosaves += 1
+
+    def stop(self):
+        """Ends checking. Autosaves that were queued already are still written by the Committer"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
 main_db = Database()
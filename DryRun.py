@@ -0,0 +1,286 @@
+"""A dry run executes a task list without touching any device and without waiting: the tasks run in virtual time (see
+Clocks.VirtualClock) against a SimulatedMeasurementSetup that only pretends how long the devices take. The tasks are
+the very same classes as in a real measurement, so ramps, Triggers and averaging DataAcqs behave exactly as they will
+later. This way one knows before the start whether the sweep planned for the weekend is done on Monday morning or on
+Wednesday."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import math
+from threading import Thread
+import traceback
+
+from Clocks import VirtualClock, format_duration
+from DataStorage import Database
+from MeasurementComponents import TaskTree, Helper, ParameterController
+from MeasurementSetups import MeasurementSetup
+from TaskEngines import TaskRun, TaskEngine
+import UserInput
+
+
+class SimulatedMeasurementSetup(MeasurementSetup):
+    """Stands in for a real, already initialized measurement setup. It offers the same controlables and measurables,
+    but instead of talking to the devices it lets the virtual clock pass as much time as the device would need.
+
+    The latencies are estimates per device class (the class name of the device behind the MeasurementDeviceController)
+    and can be tuned via the dicts below:
+        - ALPHA and Agilent4980A: a frequency point takes max(minimum measurement time, periods / frequency) plus some
+          overhead, so low frequencies dominate a sweep just like in reality
+        - Temp_336 and Quatro: reading is quick, but the temperature only follows the setpoint with settle_rate (K/min)
+    Everything else takes default_latency. The simulated sample is a parallel RC circuit (sample_resistance and
+    sample_capacitance), so an adaptive sweep finds the same kind of relaxation to refine on as in a real sample.
+    """
+
+    # the same estimates a spec_values sweep with a time budget plans with
+    frequency_devices = ParameterController.frequency_point_costs
+    temperature_devices = {"Temp_336": {"settle_rate": 2.0, "latency": 0.05},
+                           "Quatro": {"settle_rate": 2.0, "latency": 0.1}}
+    default_latency = 0.1
+    sample_resistance = 1e6
+    sample_capacitance = 1e-10
+    # Setting a value is a single write in most cases
+    set_latency = 0.05
+
+    def __init__(self, real_setup: MeasurementSetup, clock: VirtualClock):
+        # No super().__init__(), that would open a VISA resource manager which is exactly what we don't want here
+        self.real_setup = real_setup
+        self.clock = clock
+        self.list_of_setups = []
+        self.setup = None
+        self.controlables = real_setup.get_controlables()
+        self.measurables = real_setup.get_measurables()
+        self._latest_readings = {}
+        # {id of the mdc: {"expected_freq": 1000.0}} for frequency devices
+        self._frequencies = {}
+        # {id of the mdc: {"temperature": float, "setpoint": float, "since": virtual seconds}}
+        self._temperatures = {}
+
+    @staticmethod
+    def _device_type(mdc):
+        return type(getattr(mdc, "mes_device", None)).__name__
+
+    def _current_temperature(self, mdc):
+        """Moves the simulated temperature towards the setpoint for the time that passed since it was last looked at"""
+        state = self._temperatures.get(id(mdc))
+        if state is None:
+            return None
+        now = self.clock.perf_counter()
+        settle_rate = self.temperature_devices[self._device_type(mdc)]["settle_rate"]
+        max_change = (now - state["since"]) * settle_rate / 60
+        difference = state["setpoint"] - state["temperature"]
+        if abs(difference) <= max_change:
+            state["temperature"] = state["setpoint"]
+        else:
+            state["temperature"] += max_change if difference > 0 else -max_change
+        state["since"] = now
+        return state["temperature"]
+
+    def change_value_of_controlable_to(self, controlable, new_value):
+        mdc = controlable["dev"]
+        device_type = self._device_type(mdc)
+        if device_type in self.temperature_devices and controlable["name"] == "Setpoint":
+            if id(mdc) not in self._temperatures:
+                # we don't know where the cryostat is before the run, so we assume it already sits at the first setpoint
+                self._temperatures[id(mdc)] = {"temperature": new_value, "setpoint": new_value,
+                                               "since": self.clock.perf_counter()}
+            else:
+                self._current_temperature(mdc)
+                self._temperatures[id(mdc)]["setpoint"] = new_value
+        elif device_type in self.frequency_devices:
+            self._frequencies.setdefault(id(mdc), {})[controlable["name"]] = new_value
+        self.clock.pass_time(self.set_latency)
+        return {controlable["name"]: new_value}
+
+    def measure_measurable(self, measurable: dict):
+        mdc = measurable["dev"]
+        device_type = self._device_type(mdc)
+        name = measurable["name"]
+        if device_type in self.frequency_devices:
+            latencies = self.frequency_devices[device_type]
+            frequency = self._frequencies.get(id(mdc), {}).get("expected_freq", 1000.0)
+            minimum_measurement_time = getattr(mdc.mes_device, "minimum_measurement_time",
+                                               latencies["minimum_measurement_time"])
+            if type(minimum_measurement_time) not in (int, float):
+                minimum_measurement_time = latencies["minimum_measurement_time"]
+            measurement_time = max(minimum_measurement_time, latencies["periods"] / max(frequency, 1e-9))
+            self.clock.pass_time(measurement_time + latencies["overhead"])
+            omega_tau = 2 * math.pi * frequency * self.sample_resistance * self.sample_capacitance
+            resistance = self.sample_resistance / (1 + omega_tau ** 2)
+            reactance = -self.sample_resistance * omega_tau / (1 + omega_tau ** 2)
+            return {"R": resistance, "X": reactance, "freq": frequency,
+                    "time_" + name: self.clock.strftime("%d.%m.%Y %H:%M:%S")}
+        elif device_type in self.temperature_devices:
+            self.clock.pass_time(self.temperature_devices[device_type]["latency"])
+            temperature = self._current_temperature(mdc)
+            if temperature is None:
+                temperature = 0.0
+            return {name: temperature, "K": temperature, "time_" + name: self.clock.strftime("%d.%m.%Y %H:%M:%S")}
+        self.clock.pass_time(self.default_latency)
+        return {name: 0.0}
+
+    def read_measurable(self, measurable: dict, max_age=0.0, clock=None):
+        # Same as for a real setup, but without the per measurable lock: a task blocking on it in real time would
+        # freeze the virtual clock. The clock is always the virtual one
+        key = (id(measurable["dev"]), measurable["name"])
+        reading = self._latest_readings.get(key)
+        if max_age > 0 and reading is not None and self.clock.perf_counter() - reading["time"] <= max_age:
+            return reading["datapoint"].copy()
+        datapoint = self.measure_measurable(measurable)
+        self._latest_readings[key] = {"time": self.clock.perf_counter(), "datapoint": datapoint.copy()}
+        return datapoint
+
+    def sweep_points(self, controlable: dict, measurable: dict):
+        # A device sweep (see MeasurementSetup.sweep_measurable) would go straight to the real device. Value by value,
+        # the estimate is a bit on the long side for a list sweep of the 4980A, but nothing is touched
+        return 0
+
+    def get_measurables(self):
+        return self.measurables
+
+    def get_controlables(self):
+        return self.controlables
+
+    def get_limits(self):
+        return self.real_setup.get_limits()
+
+    def list_available_setups(self):
+        return
+
+    def select_setup(self, to_be_selected_setups_name: str):
+        return
+
+    def _add_measurement_device_controllers(self):
+        return
+
+    def init_after_creation(self):
+        return
+
+    def measurement_done(self):
+        return
+
+
+class VirtualTaskRun(TaskRun):
+    """TaskRun whose wait() passes virtual instead of real time"""
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self._done = False
+
+    @property
+    def done(self):
+        return self._done
+
+    def set_done(self):
+        self._done = True
+        self.clock.notify()
+
+    def wait(self, timeout=None):
+        return self.clock.wait_until(lambda: self._done, timeout)
+
+
+class SimulationTaskEngine(TaskEngine):
+    """Runs the tasks on a virtual clock. Concurrently started tasks get their own Thread like in the classic engine,
+    the clock makes sure virtual time only passes while all of them are waiting. Besides that, the engine keeps track
+    of how much virtual time each task took."""
+
+    name = "dry run in virtual time"
+
+    def __init__(self, clock: VirtualClock, parallel_sub_tasks=False):
+        super().__init__(parallel_sub_tasks)
+        self.clock = clock
+        # {identifier tuple: {"runs": int, "duration": virtual seconds}}
+        self.task_times = {}
+        # tracebacks of tasks that crashed, they are shown with the report as status messages are muted meanwhile
+        self.crashes = []
+
+    def prepare(self, tasks: []):
+        self.tasks = tasks
+
+    def _do(self, task):
+        start_time = self.clock.perf_counter()
+        try:
+            task.run_do()
+        finally:
+            times = self.task_times.setdefault(tuple(task.identifier), {"runs": 0, "duration": 0.0})
+            times["runs"] += 1
+            times["duration"] += self.clock.perf_counter() - start_time
+
+    def start(self, task):
+        task_run = VirtualTaskRun(self.clock)
+        # register the runner before the thread exists, otherwise the clock could jump ahead in between
+        self.clock.add_runner()
+
+        def execute():
+            try:
+                self._do(task)
+            except Exception:
+                self.crashes.append("Task {0} crashed:\n{1}".format(str(task.identifier), traceback.format_exc()))
+            finally:
+                task_run.set_done()
+                self.clock.remove_runner()
+
+        Thread(target=execute, name="JUMP-dry-run", daemon=True).start()
+        return task_run
+
+    def run_and_wait(self, task):
+        self._do(task)
+
+    def shutdown(self):
+        return
+
+
+def dry_run(measurement, parallel_sub_tasks=False, resolution=1.0):
+    """Runs the task list of a measurement in virtual time and reports how long it would take
+
+    :param measurement: MeasurementComponents.Measurement with an initialized setup and its tasks
+    :param parallel_sub_tasks: like for the real engines
+    :param resolution: shortest sleep of the tasks in virtual seconds, see Clocks.VirtualClock
+    :return: {"duration": virtual seconds for the whole list, "tasks": [{"identifier", "summary", "runs",
+    "duration", "points"}, ...], "crashes": [tracebacks of crashed tasks]}
+    :rtype: dict
+    """
+    clock = VirtualClock(resolution)
+    setup = SimulatedMeasurementSetup(measurement.meas_setup, clock)
+    # a scratch database and fresh tasks, so the real ones are untouched by the simulation
+    database = Database()
+    task_tree = TaskTree()
+    for task in measurement.tasks:
+        task_tree.add(Helper.task_from_definition(task.to_definition(), setup, task_tree, database))
+
+    engine = SimulationTaskEngine(clock, parallel_sub_tasks)
+    for task in task_tree:
+        task.engine = engine
+    engine.prepare(task_tree)
+
+    # The tasks would report every step they take, that's thousands of lines for a long ramp
+    UserInput.status_muted = True
+    clock.add_runner()
+    try:
+        for task in task_tree.top_level_tasks():
+            engine.run_and_wait(task)
+    finally:
+        clock.remove_runner()
+        UserInput.status_muted = False
+    engine.shutdown()
+
+    report = {"duration": clock.perf_counter(), "tasks": [], "crashes": engine.crashes}
+    for task in task_tree:
+        times = engine.task_times.get(tuple(task.identifier), {"runs": 0, "duration": 0.0})
+        report["tasks"].append({"identifier": task.identifier, "summary": task.generate_one_line_summary(),
+                                "runs": times["runs"], "duration": times["duration"],
+                                "points": database.amount_of_points(task.identifier)})
+    return report
+
+
+def post_report(report: dict):
+    """Shows the result of dry_run to the user"""
+    lines = ["Dry run: the task list would take about {0}.".format(format_duration(report["duration"]))]
+    for task in report["tasks"]:
+        indentation = "    " * (len(task["identifier"]) - 1)
+        lines.append("{0}{1} {2}: {3} in {4} run(s), {5} point(s)".format(
+            indentation, str(task["identifier"]), task["summary"], format_duration(task["duration"]), task["runs"],
+            task["points"]))
+    UserInput.post_status("\n".join(lines))
+    for crash in report["crashes"]:
+        UserInput.confirm_warning("A task crashed during the dry run, the real measurement would fail the same "
+                                  "way:\n" + crash)
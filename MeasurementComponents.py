@@ -4,18 +4,322 @@ __copyright__ = "Copyright 2015 - 2017, Justin Scholz"
 __author__ = "Justin Scholz"
 
 import queue
-from threading import Thread
+from threading import Thread, Event
 from abc import ABCMeta, abstractmethod
+import bisect
+from contextlib import contextmanager
 import math
-import time
 
+from BusArbiter import bus_arbiter
+from Clocks import format_duration
+from MeasurementHardware import InstrumentError, SweepInterrupted, reserve_devices, release_devices
 from MeasurementSetups import MeasurementSetup
 import MeasurementSetups
 import UserInput
-from DataStorage import main_db
+from DataStorage import main_db, Database, Committer, Autosaver
+from TaskEngines import TaskRun, TaskEngine, ThreadedTaskEngine, CancellationToken, TaskEngineError, wait_for_all
+from Checkpoints import Checkpoint
+from ControlChannel import ControlChannel, ControlCommandError
+from StreamingStatistics import DatapointStatistics
 
 
 class Task(metaclass=ABCMeta):
+    """With the classic engine, every task runs in its own Thread and sleeps until its parent (or the Measurement for
+    top level tasks) asks it to do something. The handshake between parent and child is done with two Events instead of
+    polling a flag, so an idle task doesn't use any CPU time and a child wakes up right after it was signalled.
+    Tasks never start their sub_tasks themselves but ask their engine to do it, see TaskEngines.
+    """
+
+    # What a task does when a device call fails (see MeasurementHardware.InstrumentError). Can be set per task via
+    # configure_error_handling:
+    #   - "skip": the step is left out, eg the point isn't stored or the value of a sweep is passed over
+    #   - "retry": the call is repeated up to retries times, if it still fails the step is skipped
+    #   - "abort_subtree": the current run of the task and of all its sub_tasks is stopped, the parent continues
+    error_policies = ["skip", "retry", "abort_subtree"]
+    default_error_policy = "retry"
+
+    # Where the wall time of a task goes, see _timed. Whatever isn't in one of them (eg Python overhead) is "other" in
+    # the timing report of the Measurement:
+    #   - "set_controlable", "measure_measurable": calls to the measurement setup, including retries and the bus
+    #   - "waiting": sleeping, eg for the next trigger time or for a setpoint to settle
+    #   - "sub_tasks": waiting for the sub_tasks to finish
+    #   - "bookkeeping": handing points, cursors and messages over to the committer
+    #   - "paused": held at a safe point by the ControlChannel
+    timing_phases = ["set_controlable", "measure_measurable", "waiting", "sub_tasks", "bookkeeping", "paused"]
+
+    def _init_task_signalling(self):
+        """Has to be called in the __init__ of every task. Thread.__init__ doesn't call the __init__ of Task, that's why
+        it isn't done automatically"""
+        self.should_be_running = True
+        self.engine = None  # type: TaskEngine
+        self.checkpoint = None  # type: Checkpoint
+        # does the bookkeeping in the background while measuring, see DataStorage.Committer
+        self.committer = None  # type: Committer
+        self._one_line_summary = None
+        # the datapoint this task added last, eg for an adaptive ParameterController that looks at its sub_tasks
+        self.latest_datapoint = None
+        # lets the user pause or skip the task while measuring, see ControlChannel
+        self.control = None  # type: ControlChannel
+        self.is_doing = False
+        # how long the task was held at its last safe point, see _safe_point
+        self.paused_seconds = 0.0
+        # see configure_error_handling
+        self.error_policy = self.default_error_policy
+        self.retries = 2
+        self.run_timeout = 0
+        # the CancellationToken of the current run, a child of the one of the parent's run
+        self.cancellation = None  # type: CancellationToken
+        # seconds per timing phase and "total", summed up over all runs. Only the task's own thread writes them
+        self.timings = {}
+        self.timed_runs = 0
+        # a task stuck in a device call mustn't keep the program from ending
+        self.daemon = True
+        self._do_now_event = Event()
+        self._done_event = Event()
+        # A task that was never started is "done"
+        self._done_event.set()
+
+    @property
+    def should_do_now(self):
+        """True as long as the task was asked to do something and didn't finish it yet"""
+        return not self._done_event.is_set()
+
+    def request_do_now(self):
+        """Tells the task thread to run do() once. Returns immediately, use the returned TaskRun to wait for it
+
+        :rtype: TaskRun
+        """
+        self._done_event.clear()
+        self._do_now_event.set()
+        return TaskRun(self._done_event)
+
+    def wait_until_done(self, timeout=None):
+        """Blocks until the task has finished its current do().
+
+        :param timeout: seconds to wait at most. None means wait as long as it takes
+        :return: True if the task is done, False if the timeout was reached first
+        :rtype: bool
+        """
+        return self._done_event.wait(timeout)
+
+    def stop(self):
+        """Makes the task thread leave its run loop. It also wakes the thread up in case it's sleeping right now"""
+        self.should_be_running = False
+        self._do_now_event.set()
+
+    def _serve_do_requests(self):
+        """The run loop of every task Thread: sleep until there is something to do, do it, tell the parent we're done"""
+        while True:
+            self._do_now_event.wait()
+            self._do_now_event.clear()
+            if not self.should_be_running:
+                break
+            try:
+                self.run_do()
+            finally:
+                self._done_event.set()
+        # nobody should ever wait on a stopped task
+        self._done_event.set()
+
+    def run_do(self):
+        """Runs do() once. Engines call this instead of do() so it's known which tasks are at work right now"""
+        self.is_doing = True
+        parent = self.task_tree.parent_of(self.identifier)
+        self.cancellation = CancellationToken(self.clock, parent.cancellation if parent is not None else None,
+                                              self.run_timeout * 60)
+        started = self.clock.perf_counter()
+        try:
+            self.do()
+        except TaskAborted as aborted:
+            # sub_tasks that are still running notice it at their next safe point
+            self.cancellation.cancel(str(aborted))
+            self._post_status("Aborted the current run of {0} and its sub_tasks: {1}", self.identifier, aborted)
+        finally:
+            self._add_time("total", self.clock.perf_counter() - started)
+            self.timed_runs += 1
+            self.is_doing = False
+            if self.control is not None:
+                self.control.task_finished(self.identifier)
+
+    def _safe_point(self):
+        """Has to be called by the tasks between two steps, where they could stop without leaving anything half done.
+        While the run is paused via the ControlChannel, it blocks here. Afterwards, paused_seconds tells how long, so
+        tasks that go by the clock (ramps, time Triggers) can leave the pause out.
+
+        Its run also ends here once its CancellationToken is cancelled, eg because the timeout of the task or of one of
+        its parents passed.
+
+        :return: True if the task was asked to skip the rest of its current run
+        :rtype: bool
+        """
+        self.paused_seconds = 0.0
+        if self.control is not None:
+            paused_at = self.clock.perf_counter()
+            if self.control.wait_at_safe_point(self.identifier):
+                return True
+            self.paused_seconds = self.clock.perf_counter() - paused_at
+            self._add_time("paused", self.paused_seconds)
+        if self.cancellation is not None:
+            # a pause doesn't count towards the timeout
+            self.cancellation.postpone(self.paused_seconds)
+            if self.cancellation.cancelled:
+                # only the task where it happened says so, not every single one of its sub_tasks
+                if self.cancellation.parent is None or not self.cancellation.parent.cancelled:
+                    self._post_status("{0} stops its current run as {1}.", self.identifier, self.cancellation.reason)
+                return True
+        return False
+
+    def configure_error_handling(self, error_policy: str = None, retries: int = None, run_timeout: float = None):
+        """
+        :param error_policy: one of error_policies, what to do when a device call fails
+        :param retries: how often a failed device call is repeated with the "retry" policy
+        :param run_timeout: minutes one run of the task may take at most, 0 for no limit. Once it passed, the task and its
+        sub_tasks stop at their next safe point, the parent continues
+        """
+        if error_policy is not None:
+            if error_policy not in self.error_policies:
+                raise TaskDefinitionError("Unknown error policy '{0}' for task {1}, valid are {2}".format(
+                    error_policy, str(self.identifier), self.error_policies))
+            self.error_policy = error_policy
+        if retries is not None:
+            self.retries = max(0, int(retries))
+        if run_timeout is not None:
+            self.run_timeout = max(0.0, float(run_timeout))
+
+    def _error_handling_definition(self):
+        """The part of to_definition that every task has
+
+        :rtype: dict
+        """
+        return {"error_policy": self.error_policy, "retries": self.retries, "run_timeout": self.run_timeout}
+
+    def _call_instrument(self, function, *arguments, **keyword_arguments):
+        """Calls the measurement setup (which talks to the devices) under the error policy of the task
+
+        :param function: eg self.measurement_setup.read_measurable
+        :return: what the function returned, None if it failed and the step has to be skipped
+        :raises TaskAborted: if it failed and the policy is "abort_subtree"
+        """
+        attempts = 1
+        if self.error_policy == "retry":
+            attempts += self.retries
+        phase = "set_controlable" if function.__name__ == "change_value_of_controlable_to" else "measure_measurable"
+        for attempt in range(attempts):
+            try:
+                with self._timed(phase):
+                    return function(*arguments, **keyword_arguments)
+            except InstrumentError as error:
+                if self.error_policy == "abort_subtree":
+                    raise TaskAborted(error)
+                self._post_status("{0}: {1} (attempt {2} of {3})", self.identifier, error, attempt + 1, attempts)
+        self._post_status("{0} skips this step.", self.identifier)
+        return None
+
+    @property
+    def clock(self):
+        """The clock of the engine, tasks must use it instead of the time module. See Clocks"""
+        return self.engine.clock
+
+    @contextmanager
+    def _timed(self, phase: str):
+        """Adds the time spent in the with block to the phase, see timing_phases"""
+        started = self.clock.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_time(phase, self.clock.perf_counter() - started)
+
+    def _add_time(self, phase: str, seconds: float):
+        self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def _sleep(self, seconds: float):
+        with self._timed("waiting"):
+            self.clock.sleep(seconds)
+
+    def used_devices(self):
+        """The MeasurementDeviceControllers this task talks to itself, not counting its sub_tasks
+
+        :rtype: list
+        """
+        return []
+
+    def _sub_task_batches(self, sub_tasks: []):
+        """Splits the sub_tasks into batches that are run one after another. Usually every batch is a single sub_task,
+        but if the engine runs sub_tasks in parallel, neighbouring sub_tasks that don't share a device end up in the
+        same batch
+
+        :rtype: [[Task]]
+        """
+        if self.engine.parallel_sub_tasks:
+            return Helper.group_sub_tasks_by_devices(sub_tasks, self.task_tree)
+        return [[task] for task in sub_tasks]
+
+    def _run_sub_tasks(self, sub_tasks: []):
+        """Runs the passed sub_tasks and returns once all of them are finished"""
+        with self._timed("sub_tasks"):
+            for batch in self._sub_task_batches(sub_tasks):
+                if len(batch) == 1:
+                    self.engine.run_and_wait(batch[0])
+                else:
+                    wait_for_all([self.engine.start(task) for task in batch])
+
+    def _take_resume_state(self):
+        """
+        :return: the cursor an interrupted run saved for this task, None when the task starts from scratch
+        :rtype: dict
+        """
+        if self.checkpoint is None:
+            return None
+        return self.checkpoint.take_resume_state(self.identifier)
+
+    def _save_cursor(self, state: dict):
+        """Remembers where the task is, so an interrupted run can continue from here. See Checkpoints"""
+        if self.checkpoint is None:
+            return
+        with self._timed("bookkeeping"):
+            if self.committer is not None:
+                self.committer.save_cursor(self.checkpoint, self.identifier, state)
+            else:
+                self.checkpoint.save(self.identifier, state)
+
+    def _add_point(self, datapoint: dict, task=None):
+        """Stores a datapoint of this task. While measuring, the committer does it in the background
+
+        :param task: the sub_task the datapoint belongs to if this task measured it in its place (see
+        ParameterController._list_sweep), None for this task
+        """
+        if task is None:
+            task = self
+        task.latest_datapoint = datapoint
+        with self._timed("bookkeeping"):
+            if self.committer is not None:
+                self.committer.add_point(task.database, task.identifier, datapoint)
+            else:
+                task.database.add_point(task.identifier, datapoint)
+
+    def _post_status(self, template: str, *arguments):
+        """Posts a status message with the current time in front. The message is only put together from the template
+        and the arguments when the committer gets to it, so it doesn't cost the task any time
+
+        :param template: str.format template, eg "Started {0}"
+        """
+        if self.committer is not None:
+            self.committer.post_status(self.clock.time(), template, *arguments)
+        else:
+            UserInput.post_status(self.clock.strftime("%c") + ": " + template.format(*arguments))
+
+    @property
+    def one_line_summary(self):
+        """generate_one_line_summary, but only built once as a task doesn't change while measuring"""
+        if self._one_line_summary is None:
+            self._one_line_summary = self.generate_one_line_summary()
+        return self._one_line_summary
+
+    @staticmethod
+    def _was_finished_before(resume_state: dict):
+        """True if the task already did everything before the run got interrupted"""
+        return resume_state is not None and resume_state.get("finished", False)
+
     @abstractmethod
     def do(self):
         pass
@@ -24,23 +328,157 @@ class Task(metaclass=ABCMeta):
     def generate_one_line_summary(self):
         pass
 
+    @abstractmethod
+    def to_definition(self):
+        """Describes the task with plain values only, so it can be stored in the database and recreated with
+        Measurement.add_task_from_definition
+
+        :rtype: dict
+        """
+        pass
+
+
+class TaskTree:
+    """Holds all tasks of a measurement. Every task can be looked up by its identifier and the direct sub_tasks of a
+    task are stored with their parent, so finding them doesn't need a scan through all tasks anymore. Iterating over the
+    tree yields the tasks sorted by identifier, the same order the plain task list had:
+    [0], [0, 0], [0, 0, 0], [0, 1], [1], ...
+    """
+
+    def __init__(self):
+        self._tasks_by_id = {}  # type: {tuple: Task}
+        # the direct sub_tasks of every task, sorted by identifier. () is the invisible root of all top level tasks
+        self._sub_tasks_by_id = {(): []}  # type: {tuple: [Task]}
+        # the sorted list is only built again when it is needed after the tree was changed
+        self._sorted_tasks = []
+        self._sorted_tasks_outdated = False
+
+    def add(self, task: Task):
+        """Inserts the task at the place its identifier points to
+
+        :param task: task with a not yet used identifier
+        """
+        key = tuple(task.identifier)
+        if key in self._tasks_by_id:
+            raise ValueError("There already is a task with identifier " + str(task.identifier))
+        siblings = self._sub_tasks_by_id.setdefault(key[:-1], [])
+        sibling_identifiers = [sibling.identifier for sibling in siblings]
+        siblings.insert(bisect.bisect(sibling_identifiers, task.identifier), task)
+        self._tasks_by_id[key] = task
+        self._sub_tasks_by_id.setdefault(key, [])
+        self._sorted_tasks_outdated = True
+
+    def remove(self, identifier: []):
+        """Removes the task together with all of its (sub-)sub_tasks
+
+        :return: the removed tasks, sorted by identifier
+        :rtype: [Task]
+        """
+        removed_tasks = self._walk(tuple(identifier))
+        siblings = self._sub_tasks_by_id[tuple(identifier[:-1])]
+        siblings.remove(self._tasks_by_id[tuple(identifier)])
+        for task in removed_tasks:
+            key = tuple(task.identifier)
+            del self._tasks_by_id[key]
+            del self._sub_tasks_by_id[key]
+        self._sorted_tasks_outdated = True
+        return removed_tasks
+
+    def get(self, identifier: []):
+        """
+        :return: the task with the identifier or None if there is none
+        :rtype: Task
+        """
+        return self._tasks_by_id.get(tuple(identifier))
+
+    def sub_tasks_of(self, identifier: []):
+        """
+        :param identifier: identifier of the parent, [] for the top level tasks
+        :return: the direct sub_tasks, sorted by identifier
+        :rtype: [Task]
+        """
+        return list(self._sub_tasks_by_id.get(tuple(identifier), []))
+
+    def top_level_tasks(self):
+        return self.sub_tasks_of([])
+
+    def parent_of(self, identifier: []):
+        """
+        :return: the parent task or None for top level tasks
+        :rtype: Task
+        """
+        return self._tasks_by_id.get(tuple(identifier[:-1]))
+
+    def sub_tree_of(self, identifier: []):
+        """
+        :return: the task with the identifier followed by all of its (sub-)sub_tasks, sorted by identifier
+        :rtype: [Task]
+        """
+        return self._walk(tuple(identifier))
+
+    def is_last_sub_task(self, identifier: []):
+        """True if no sibling with a higher identifier exists"""
+        siblings = self._sub_tasks_by_id[tuple(identifier[:-1])]
+        return siblings[-1].identifier == identifier
+
+    def _walk(self, key: tuple):
+        """Collects the task with the key and all of its (sub-)sub_tasks in sorted order. () walks the whole tree"""
+        walked = []
+        if key:
+            to_visit = [self._tasks_by_id[key]]
+        else:
+            to_visit = list(reversed(self._sub_tasks_by_id[()]))
+        while to_visit:
+            task = to_visit.pop()
+            walked.append(task)
+            # reversed, so the sub_task with the lowest identifier is popped first
+            to_visit.extend(reversed(self._sub_tasks_by_id[tuple(task.identifier)]))
+        return walked
+
+    def _sorted(self):
+        if self._sorted_tasks_outdated:
+            self._sorted_tasks = self._walk(())
+            self._sorted_tasks_outdated = False
+        return self._sorted_tasks
+
+    def __iter__(self):
+        return iter(self._sorted())
+
+    def __len__(self):
+        return len(self._tasks_by_id)
+
+    def __getitem__(self, index):
+        return self._sorted()[index]
+
+    def __contains__(self, task):
+        return self._tasks_by_id.get(tuple(task.identifier)) is task
+
 
 class Trigger(Thread, Task):
     """Class that provides functionality for triggering a sub task on a time or measurable base
     """
 
-    def __init__(self, identifier: [], measurement_setup: MeasurementSetup, trigger: dict, global_task_list: []):
+    # a failed reading of the watched measurable is simply followed by the next one a poll interval later
+    default_error_policy = "skip"
+
+    def __init__(self, identifier: [], measurement_setup: MeasurementSetup, trigger: dict, task_tree: TaskTree,
+                 database: Database = None):
         """
         :param identifier:
         :param measurement_setup:
         :param trigger: {"total_time_span": 300, "trigger_separation": 3} or
-        {"acquis_triggering_measurable": measurable_dict, "acquis_triggering_value": 200}
-        :param global_task_list:
+        {"acquis_triggering_measurable": measurable_dict, "acquis_triggering_value": 200, "trigger_when_below": True,
+        "datapoint_key": "Sample Sensor", "poll_interval": 2, "hysteresis": 0.5, "debounce": 3, "timeout": 60,
+        "max_firings": 1}
+        Poll interval is in seconds, the timeout in minutes (0 means no timeout). Everything after
+        "trigger_when_below" is optional.
+        :param task_tree: the TaskTree of the measurement this task belongs to
+        :param database: where the datapoints go, main_db if None
         """
         super().__init__()
-        self.should_do_now = False
-        self.should_be_running = True
-        self.global_task_list = global_task_list
+        self._init_task_signalling()
+        self.database = database or main_db
+        self.task_tree = task_tree
         self.trigger = trigger
         self.measurement_setup = measurement_setup
         self.identifier = identifier
@@ -49,6 +487,13 @@ class Trigger(Thread, Task):
         self.trigger_separation = None
         self.acquis_triggering_measurable = None
         self.acquis_triggering_value = None
+        self.trigger_when_below = None
+        self.datapoint_key = None
+        self.poll_interval = None
+        self.hysteresis = None
+        self.debounce = None
+        self.timeout = None
+        self.max_firings = None
         if "total_time_span" in trigger:
             self.total_time_span = float(trigger["total_time_span"])
             self.trigger_separation = trigger["trigger_separation"]
@@ -57,56 +502,154 @@ class Trigger(Thread, Task):
             self.acquis_triggering_measurable = trigger["acquis_triggering_measurable"]
             self.acquis_triggering_value = trigger["acquis_triggering_value"]
             self.trigger_when_below = trigger["trigger_when_below"]
+            self.datapoint_key = trigger.get("datapoint_key", self.acquis_triggering_measurable["name"])
+            self.poll_interval = float(trigger.get("poll_interval", 2.0))
+            self.hysteresis = abs(float(trigger.get("hysteresis", 0.0)))
+            # how many readings in a row have to be beyond the value before we fire
+            self.debounce = max(1, int(trigger.get("debounce", 1)))
+            self.timeout = float(trigger.get("timeout", 0.0))
+            self.max_firings = max(1, int(trigger.get("max_firings", 1)))
             self.mode = "measurable"
-        main_db.make_storage(identifier, "Trigger", self.generate_one_line_summary())
+        self.database.make_storage(identifier, "Trigger", self.generate_one_line_summary())
 
     def run(self):
-        while self.should_be_running:
-            if self.should_do_now:
-                self.do()
-                self.should_do_now = False
-            time.sleep(0.05)
+        self._serve_do_requests()
 
     def do(self):
+        resume_state = self._take_resume_state()
+        if self._was_finished_before(resume_state):
+            return
         if self.mode == "time":
-            self._time_based_triggering()
+            self._time_based_triggering(resume_state)
         elif self.mode == "measurable":
-            self._measurable_value_based_triggering()
+            self._measurable_value_based_triggering(resume_state)
+        self._save_cursor({"finished": True})
 
-    def _time_based_triggering(self):
-        sub_tasks = Helper.check_for_sub_tasks(self.identifier, self.global_task_list)
+    def _time_based_triggering(self, resume_state: dict = None):
+        start_time = self.clock.perf_counter()
+        next_trigger_time = start_time
+        if resume_state is not None:
+            # The time the program was down doesn't count, we continue where the last firing ended
+            start_time -= resume_state["elapsed"]
+            next_trigger_time = start_time + resume_state["next_trigger_offset"]
 
-        start_time = time.perf_counter()
         end_time = start_time + (self.total_time_span * 60.0)
 
-        next_trigger_time = start_time
-
-        UserInput.post_status("{0}: Started Trigger task '{1}'.".format(time.strftime("%c"), str(self.name)))
+        self._post_status("Started Trigger task '{0}'.", self.name)
 
         # Only while the end time isn't reached
-        while end_time > time.perf_counter():
+        while end_time > self.clock.perf_counter():
+            if self._safe_point():
+                break
+            # a pause doesn't count as time of the Trigger
+            start_time += self.paused_seconds
+            end_time += self.paused_seconds
+            next_trigger_time += self.paused_seconds
             # check for next trigger time. If it is time to trigger, then run all direct_sub_tasks after each other
-            if time.perf_counter() > next_trigger_time:
-                datapackage_start_time = time.strftime("%H %M %S")
-                for task in sub_tasks:
-                    task.should_do_now = True
-                    while task.should_do_now:
-                        pass
-                    UserInput.post_status(time.strftime("%c") + ": Waiting for new trigger time to be reached.")
-                datapackage_end_time = time.strftime("%H %M %S")
+            if self.clock.perf_counter() > next_trigger_time:
+                datapackage_start_time = self.clock.strftime("%H %M %S")
+                # sub_tasks may have been added or removed while measuring
+                sub_tasks = Helper.check_for_sub_tasks(self.identifier, self.task_tree)
+                self._run_sub_tasks(sub_tasks)
+                self._post_status("Waiting for new trigger time to be reached.")
+                datapackage_end_time = self.clock.strftime("%H %M %S")
                 datapoint = {"start_time": datapackage_start_time, "end_time": datapackage_end_time}
-                main_db.add_point(self.identifier, datapoint)
+                self._add_point(datapoint)
 
                 # we only calculate the time of when to trigger next if we reached the previous one!
-                next_trigger_time = time.perf_counter() + self.trigger_separation * 60
+                next_trigger_time = self.clock.perf_counter() + self.trigger_separation * 60
+                self._save_cursor({"elapsed": self.clock.perf_counter() - start_time,
+                                   "next_trigger_offset": next_trigger_time - start_time})
+
+            # Sleep until either the next trigger time or the end time is reached instead of checking the clock
+            # over and over again
+            time_to_sleep = min(next_trigger_time, end_time) - self.clock.perf_counter()
+            if time_to_sleep > 0:
+                self._sleep(time_to_sleep)
 
         return
 
-    def _measurable_value_based_triggering(self):  # TODO: One could think of optionally implementing a time out
-        # TODO: Implement measurable triggered code path. Problem to solve is: how does the user select which one of the
-        # potentially many values inside a datapoint (look at ALPHA - it's R,X and freq) to use for comparison
-        UserInput.confirm_warning("Not implemented yet!!")
-        pass
+    def _is_beyond_triggering_value(self, value: float):
+        if self.trigger_when_below:
+            return value < self.acquis_triggering_value
+        return value > self.acquis_triggering_value
+
+    def _is_back_beyond_hysteresis(self, value: float):
+        """After firing, the value has to leave the triggering region by more than the hysteresis before we fire
+        again, otherwise noise around the triggering value would fire the sub_tasks over and over again"""
+        if self.trigger_when_below:
+            return value >= self.acquis_triggering_value + self.hysteresis
+        return value <= self.acquis_triggering_value - self.hysteresis
+
+    def _measurable_value_based_triggering(self, resume_state: dict = None):
+        """Polls the measurable and runs the sub_tasks once the value is beyond the triggering value for debounce
+        readings in a row. If the value already is beyond it when we start, we fire right away. After max_firings
+        firings or when the timeout is reached, the Trigger is done.
+        """
+        start_time = self.clock.perf_counter()
+        firings = 0
+        armed = True
+        if resume_state is not None:
+            start_time -= resume_state["elapsed"]
+            firings = resume_state["firings"]
+            armed = resume_state["armed"]
+        end_time = None
+        if self.timeout > 0:
+            end_time = start_time + self.timeout * 60.0
+        readings_beyond = 0
+
+        self._post_status("Started Trigger task '{0}'.", self.one_line_summary)
+
+        while firings < self.max_firings:
+            if self._safe_point():
+                break
+            start_time += self.paused_seconds
+            if end_time is not None:
+                end_time += self.paused_seconds
+            if end_time is not None and self.clock.perf_counter() > end_time:
+                self._post_status("Trigger {0} timed out after {1} of {2} firings.", self.identifier, firings,
+                                  self.max_firings)
+                break
+
+            # A reading that another task took during the last poll interval is just as good as a new one
+            datapoint = self._call_instrument(self.measurement_setup.read_measurable, self.acquis_triggering_measurable,
+                                              max_age=self.poll_interval, clock=self.clock)
+            if datapoint is None:
+                self._sleep(self.poll_interval)
+                continue
+            if self.datapoint_key not in datapoint:
+                self._post_status("Trigger {0} can't find '{1}' in the datapoint, available are: {2}. Stopping the "
+                                  "Trigger.", self.identifier, self.datapoint_key, list(datapoint.keys()))
+                break
+            value = datapoint[self.datapoint_key]
+
+            if not armed:
+                if self._is_back_beyond_hysteresis(value):
+                    armed = True
+            elif self._is_beyond_triggering_value(value):
+                readings_beyond += 1
+            else:
+                readings_beyond = 0
+
+            if armed and readings_beyond >= self.debounce:
+                datapackage_start_time = self.clock.strftime("%H %M %S")
+                sub_tasks = Helper.check_for_sub_tasks(self.identifier, self.task_tree)
+                self._run_sub_tasks(sub_tasks)
+                datapackage_end_time = self.clock.strftime("%H %M %S")
+                self._add_point({"start_time": datapackage_start_time,
+                                 "end_time": datapackage_end_time,
+                                 self.datapoint_key: value})
+                firings += 1
+                armed = False
+                readings_beyond = 0
+                self._save_cursor({"elapsed": self.clock.perf_counter() - start_time, "firings": firings, "armed": armed})
+            else:
+                self._sleep(self.poll_interval)
+
+    def used_devices(self):
+        if self.mode == "measurable" and isinstance(self.acquis_triggering_measurable, dict):
+            return [self.acquis_triggering_measurable["dev"]]
+        return []
 
     def generate_one_line_summary(self):
         if self.mode == "time":
@@ -114,16 +657,37 @@ class Trigger(Thread, Task):
                 str(self.total_time_span), str(self.trigger_separation))
 
         else:
-            summary = "meh, doesn't work with measurables yet!"
+            if self.trigger_when_below:
+                direction = "below"
+            else:
+                direction = "above"
+            summary = "Firing off sub_tasks when {0} of {1} at {2} is {3} {4} ({5} readings in a row, polling every " \
+                      "{6} s, hysteresis {7}, at most {8} times".format(
+                        self.datapoint_key, self.acquis_triggering_measurable["name"],
+                        self.acquis_triggering_measurable["dev"].name, direction, str(self.acquis_triggering_value),
+                        str(self.debounce), str(self.poll_interval), str(self.hysteresis), str(self.max_firings))
+            if self.timeout > 0:
+                summary += ", timeout after {0} minutes).".format(str(self.timeout))
+            else:
+                summary += ")."
         return summary
 
+    def to_definition(self):
+        trigger = self.trigger.copy()
+        if isinstance(trigger.get("acquis_triggering_measurable"), dict):
+            trigger["acquis_triggering_measurable"] = Helper.reference_to(trigger["acquis_triggering_measurable"])
+        definition = {"type": "Trigger", "identifier": list(self.identifier), "trigger": trigger}
+        definition.update(self._error_handling_definition())
+        return definition
+
 
 class DataAcquisition(Thread, Task):
     """This class is for an individual _acquire_point, so multiple frequencies are measured"""
 
     def __init__(self, identifier: [],
                  measurement_setup: MeasurementSetup, measurable: dict,
-                 average_through_sub_controlable: bool, global_task_list: []):
+                 average_through_sub_controlable: bool, task_tree: TaskTree, sample_interval=5.0,
+                 percentiles: [] = None, database: Database = None):
         """initializes the measurement object with a frequency list (remember, this is essentially a single _acquire_point!)
         and the measurementDeviceController so it can actually start the measurement on device. Should later be
         initialized with a temp device controller optionally
@@ -131,21 +695,42 @@ class DataAcquisition(Thread, Task):
         :type measurable: dict
         :param measurable: A dictionary created by a measurement setup
         :param measurement_setup:
+        :param sample_interval: seconds between two samples while averaging through the sub_tasks
+        :param percentiles: percentiles (eg [5, 50, 95]) that are estimated while averaging, None for none
+        :param database: where the datapoints go, main_db if None
         :return: """
 
         super().__init__()
-        self.should_do_now = False
-        self.should_be_running = True
-        self.global_task_list = global_task_list
+        self._init_task_signalling()
+        self.database = database or main_db
+        self.task_tree = task_tree
         self.identifier = identifier
         self.average_through_sub_task = average_through_sub_controlable
+        self.sample_interval = float(sample_interval)
+        self.percentiles = list(percentiles or [])
         self.measurable = measurable
         self.measurement_setup = measurement_setup
         self.sub_tasks = []
-        main_db.make_storage(identifier, "DataAcq", self.generate_one_line_summary())
+        self.database.make_storage(identifier, "DataAcq", self.generate_one_line_summary())
 
         return
 
+    @property
+    def starts_sub_tasks_concurrently(self):
+        """When averaging, we keep measuring while the sub_tasks are running"""
+        return self.average_through_sub_task
+
+    def used_devices(self):
+        return [self.measurable["dev"]]
+
+    def to_definition(self):
+        definition = {"type": "DataAcq", "identifier": list(self.identifier),
+                      "measurable": Helper.reference_to(self.measurable),
+                      "average_through_sub_task": self.average_through_sub_task,
+                      "sample_interval": self.sample_interval, "percentiles": self.percentiles}
+        definition.update(self._error_handling_definition())
+        return definition
+
     def generate_one_line_summary(self):
         """
         :returns One-line summary
@@ -160,15 +745,16 @@ class DataAcquisition(Thread, Task):
             average = "no "
 
         summary = text + average + "averaging datapoints while sub_tasks are run."
+        if self.average_through_sub_task:
+            summary += " Sampling every {0} s".format(str(self.sample_interval))
+            if self.percentiles:
+                summary += " with percentiles " + ", ".join([str(percentile) for percentile in self.percentiles])
+            summary += "."
 
         return summary
 
     def run(self):
-        while self.should_be_running:
-            if self.should_do_now:
-                self.do()
-                self.should_do_now = False
-        time.sleep(0.01)
+        self._serve_do_requests()
 
     def acquire_point(self):
         """This method performs a sweep with the measurables stored in the DataAcquisition objects frequ_list variable (set
@@ -178,105 +764,74 @@ class DataAcquisition(Thread, Task):
         if not self.has_sub_tasks:  # This means we can eg just pass a measuring command to a device and
             # acquire data instead of having to make sure that a specific condition eg a temperature is reached
 
-            datapoint = self.measurement_setup.measure_measurable(self.measurable)
-            main_db.add_point(self.identifier, datapoint)
+            datapoint = self._call_instrument(self.measurement_setup.read_measurable, self.measurable,
+                                              clock=self.clock)
+            if datapoint is not None:
+                self._add_point(datapoint)
 
         elif self.has_sub_tasks:  # if we have a task
-            start_datapackage = self.measurement_setup.measure_measurable(self.measurable)  # type: dict
-
-            # initialize the averaging logic if needed
+            start_datapackage = self._call_instrument(self.measurement_setup.read_measurable,
+                                                      self.measurable, clock=self.clock)  # type: dict
+            if start_datapackage is None:
+                # without the starting point, the points of the sub_tasks would have nothing to belong to
+                return
+
+            # initialize the averaging logic if needed. The statistics are updated with every sample and don't keep
+            # the samples, so a multi-day sweep doesn't fill up the memory
+            statistics = None
             if self.average_through_sub_task:
-                max_negative_deviation_datapackage = start_datapackage.copy()
-                max_positive_deviation_datapackage = start_datapackage.copy()
-                average_datapackage = start_datapackage.copy()
-                averager = 1  # the variable used to calculate the true average
+                statistics = DatapointStatistics([percentile / 100 for percentile in self.percentiles])
+                statistics.add_datapoint(start_datapackage)
 
-            for task in self.sub_tasks:  # execute every sub_task
-                task.should_do_now = True
+            for batch in self._sub_task_batches(self.sub_tasks):  # execute every sub_task
+                if self._safe_point():
+                    break
+                sub_task_runs = [self.engine.start(task) for task in batch]
                 if self.average_through_sub_task:
-                    while task.should_do_now:
-                        # we need the current datapackage
-                        current_datapoint = self.measurement_setup.measure_measurable(self.measurable)  # type: dict
-
-                        # if needed refresh the max_negative deviation
-                        for key in max_negative_deviation_datapackage.keys():
-                            # if it's the time key, it's a str, we can't really calculate with strings
-                            if type(max_negative_deviation_datapackage[key]) == float:
-
-                                # If the currently maximum negative deviation is bigger than the current value, it's
-                                # not the maximum so it's rewritten
-                                if max_negative_deviation_datapackage[key] > current_datapoint[key]:
-                                    max_negative_deviation_datapackage[key] = current_datapoint[key]
-
-                        # if needed refresh the max_positive deviation
-                        for key in max_positive_deviation_datapackage.keys():
-                            if type(max_negative_deviation_datapackage[key]) == float:
-                                # If the currently maximum positive deviation is bigger than the current value, it's
-                                # not the maximum so it's rewritten
-                                if max_positive_deviation_datapackage[key] < current_datapoint[key]:
-                                    max_positive_deviation_datapackage[key] = current_datapoint[key]
-
-                        # calculate the current average throughout the whole thingy
-                        for key in average_datapackage.keys():
-                            if type(average_datapackage[key]) == float:
-                                current_average = average_datapackage[key]
-                                expanded_average = current_average * averager
-                                expanded_average += current_datapoint[key]
-                                new_average = expanded_average / (averager + 1)
-                                average_datapackage[key] = new_average
-                                averager += 1
-
-                        # Make points every 1 seconds. If you want that to be a setting, include in the
-                        # acquisition Class as a parameter, eg "averaging point frequency
-                        time.sleep(5)
-
-                while task.should_do_now:
-                    pass
+                    try:
+                        while not all([sub_task_run.done for sub_task_run in sub_task_runs]):
+                            # we need the current datapackage
+                            current_datapoint = self._call_instrument(self.measurement_setup.read_measurable,
+                                                                      self.measurable,
+                                                                      clock=self.clock)  # type: dict
+                            if current_datapoint is not None:
+                                statistics.add_datapoint(current_datapoint)
+
+                            # Take the next sample after sample_interval seconds. Waiting on the sub_tasks means we
+                            # stop sampling right when they are finished
+                            with self._timed("sub_tasks"):
+                                wait_for_all(sub_task_runs, self.sample_interval)
+                    except TaskAborted as aborted:
+                        # the sub_tasks run on their own, they have to be stopped before we give up
+                        self.cancellation.cancel(str(aborted))
+                        wait_for_all(sub_task_runs)
+                        raise
+
+                with self._timed("sub_tasks"):
+                    wait_for_all(sub_task_runs)
 
             if self.average_through_sub_task:
-                final_max_negative_deviation_datapackage = {}
-                # now append all the relevant postfixes:
-                for key in max_negative_deviation_datapackage.keys():
-                    if type(max_negative_deviation_datapackage[key]) == float:
-                        new_key = key + "_max_-"
-                        # we set the new suffixed key to the then removed item at place key. Essentially renaming the
-                        # key
-                        final_max_negative_deviation_datapackage[new_key] = max_negative_deviation_datapackage[key]
-
-                final_max_positive_deviation_datapackage = {}
-                for key in max_positive_deviation_datapackage.keys():
-                    if type(max_positive_deviation_datapackage[key]) == float:
-                        new_key = key + "_max_+"
-                        # we set the new suffixed key to the then removed item at place key. Essentially renaming the
-                        # key
-                        final_max_positive_deviation_datapackage[new_key] = max_positive_deviation_datapackage[key]
-
-                final_average_datapackage = {}
-                for key in average_datapackage.keys():
-                    if type(average_datapackage[key]) == float:
-                        new_key = key + "_aver"
-                        # we set the new suffixed key to the then removed item at place key. Essentially renaming the
-                        # key
-                        final_average_datapackage[new_key] = average_datapackage[key]
-
-                # Now update the starting_point dict with the now calculated thingies
-                start_datapackage.update(final_max_negative_deviation_datapackage)
-                start_datapackage.update(final_max_positive_deviation_datapackage)
-                start_datapackage.update(final_average_datapackage)
+                # Now update the starting_point dict with the suffixed statistics, eg "K_aver", "K_stddev", "K_max_+"
+                start_datapackage.update(statistics.summary())
 
             # And in every case add the starting data package to the thingy
 
-            main_db.add_point(self.identifier, start_datapackage)
+            self._add_point(start_datapackage)
 
         return
 
     def do(self):
-        self.sub_tasks = Helper.check_for_sub_tasks(self.identifier, self.global_task_list)
+        if self._was_finished_before(self._take_resume_state()):
+            return
+        self.sub_tasks = Helper.check_for_sub_tasks(self.identifier, self.task_tree)
         if len(self.sub_tasks) == 0:
             self.has_sub_tasks = False
         else:
             self.has_sub_tasks = True
-        self.acquire_point()
+        # a DataAcquisition is a single step, skipping it before it starts means not measuring at all
+        if not self._safe_point():
+            self.acquire_point()
+        self._save_cursor({"finished": True})
 
 
 class ParameterController(Thread, Task):
@@ -285,10 +840,30 @@ class ParameterController(Thread, Task):
     ramping method layout in the README to trigger a sweep at specific points. If one wanted to implement different ramping of
     a controlable (eg temperature, moisture or something), one could introduce a new switch and then implement the ramp
     here.
+    The closed_loop_ramp mode doesn't trust the setpoint but watches a measurable (eg the Sample Sensor): sub_tasks fire
+    when the measured value crosses the trigger points and the setpoint runs ahead of the sample as far as needed so
+    the sample itself changes with the requested rate.
+    The adaptive mode sweeps a coarse logarithmic grid first and then adds values in between where the response its
+    sub_tasks measured (eg the phase at the ALPHA) changes the most.
     """
 
+    # seconds it takes the setpoint lead of a closed loop ramp to grow by a lag of the sample that persists
+    closed_loop_integral_time = 60.0
+    # an adaptive sweep doesn't split intervals narrower than this (in decades), eg at a jump in the response
+    adaptive_min_log_spacing = 0.005
+    # Rough time a point takes on a frequency device, used to plan a spec_values sweep with a time budget (and by the
+    # dry run): max(minimum measurement time, periods / frequency) + overhead in seconds. The minimum measurement time
+    # of the device is used instead of the one here if the device knows it (see ALPHA._set_minimum_measurement_time)
+    frequency_point_costs = {"ALPHA": {"periods": 2, "minimum_measurement_time": 0.5, "overhead": 0.3},
+                             "Agilent4980A": {"periods": 2, "minimum_measurement_time": 0.05, "overhead": 0.1}}
+    # how much a single point that took longer or shorter than estimated corrects the estimates of the next ones
+    cost_correction_weight = 0.3
+    # A chunk of a list sweep (see _list_sweep) takes about this many seconds at most. The device is busy with it and
+    # can't be paused or skipped meanwhile
+    list_sweep_chunk_seconds = 60.0
+
     def __init__(self, identifier: [], measurement_setup: MeasurementSetup, meas_setup_controlable,
-                 trigger: {}, global_task_list: []):
+                 trigger: {}, task_tree: TaskTree, database: Database = None):
         """
         :type identifier: [int]
         :param controlable: A dictionary created by the meas_setup to specify device and controlable
@@ -297,22 +872,60 @@ class ParameterController(Thread, Task):
         :param start_value: eg starting temperature (200K)
         :param rate_for_controllable: eg 0.15 [K]
         :param end_value: eg end temperature (300)
+        :param trigger: {"start_value": 300, "end_value": 20, "trigger_separation": 3, "rate_for_controlable": 0.6},
+        for a closed loop ramp additionally {"acquis_triggering_measurable": measurable_dict, "datapoint_key":
+        "Sample Sensor", "poll_interval": 2, "max_setpoint_lead": 10}, everything after the measurable being optional.
+        Or {"specific_values": [1, 10, 100], "time_budget": 30, "list_sweep": False}. time_budget is optional, in
+        minutes. If the values wouldn't all fit into it, the most expensive ones (eg the lowest frequencies) are skipped,
+        see _plan_within_budget. list_sweep (optional, True by default) lets the device sweep the values by itself if it
+        can, see _list_sweep
+        Or {"adaptive": True, "start_value": 0.1, "end_value": 1e7, "coarse_points": 9, "max_points": 40,
+        "tolerance": 2.0, "response_key": "phase", "logarithmic_response": True}. The response is looked up in the
+        datapoints of the sub_tasks. "phase" is calculated from R and X in degrees, other keys are taken as they are or,
+        with logarithmic_response, as log10 of their absolute value. Intervals over which the response changes by more
+        than the tolerance are split until max_points values are measured.
+        :param database: where the datapoints go, main_db if None
         """
 
         # acquis_triggering_measurable, start_value, rate_for_controllable, end_value,
         #         trigger_separation, specific_values: [])
 
         super().__init__()
-        self.should_be_running = True
-        self.should_do_now = False
-        self.global_task_list = global_task_list
+        self._init_task_signalling()
+        self.database = database or main_db
+        self.task_tree = task_tree
         self.sub_tasks = []
         self.identifier = identifier
         self.meas_setup_controlable = meas_setup_controlable
         self.ms = measurement_setup
         self.mode = None
         self.all_values_reached = False
-        if "start_value" in trigger:
+        self.acquis_triggering_measurable = None
+        self.datapoint_key = None
+        self.poll_interval = None
+        self.max_setpoint_lead = None
+        self.coarse_points = None
+        self.max_points = None
+        self.tolerance = None
+        self.response_key = None
+        self.logarithmic_response = None
+        self.time_budget = 0
+        self.list_sweep = True
+        if trigger.get("adaptive", False):
+            self.start_value = trigger["start_value"]
+            self.end_value = trigger["end_value"]
+            # the grid is logarithmic, see create_valuelist_according_to_distribution
+            for value in (self.start_value, self.end_value):
+                if type(value) not in (int, float) or value <= 0:
+                    raise TaskDefinitionError("The adaptive sweep of task {0} needs start and end values above 0, "
+                                              "not {1}".format(str(identifier), repr(value)))
+            self.coarse_points = max(2, int(trigger.get("coarse_points", 9)))
+            self.max_points = max(self.coarse_points, int(trigger.get("max_points", 40)))
+            self.tolerance = abs(float(trigger.get("tolerance", 2.0)))
+            self.response_key = trigger.get("response_key", "phase")
+            self.logarithmic_response = trigger.get("logarithmic_response", True)
+            self.mode = "adaptive"
+        elif "start_value" in trigger:
             self.start_value = trigger["start_value"]
             self.trigger_separation = trigger["trigger_separation"]
             self.rate_for_controllable = trigger["rate_for_controlable"]
@@ -324,11 +937,52 @@ class ParameterController(Thread, Task):
             else:
                 self.end_value_reached_when_below = True
             self.mode = "ramp"
+            if "acquis_triggering_measurable" in trigger:
+                self.acquis_triggering_measurable = trigger["acquis_triggering_measurable"]
+                self.datapoint_key = trigger.get("datapoint_key", self.acquis_triggering_measurable["name"])
+                self.poll_interval = float(trigger.get("poll_interval", 2.0))
+                self.max_setpoint_lead = abs(float(trigger.get("max_setpoint_lead", 10.0)))
+                self.mode = "closed_loop_ramp"
         elif "specific_values" in trigger:
             self.specific_values = trigger["specific_values"]
+            self.time_budget = abs(float(trigger.get("time_budget", 0)))
+            self.list_sweep = trigger.get("list_sweep", True)
+            if not isinstance(self.list_sweep, bool):
+                raise TaskDefinitionError("\"list_sweep\" of task {0} has to be true or false, not {1}".format(
+                    str(identifier), repr(self.list_sweep)))
             self.mode = "spec_values"
 
-        main_db.make_storage(self.identifier, "ParamContr", self.generate_one_line_summary())
+        self.database.make_storage(self.identifier, "ParamContr", self.generate_one_line_summary())
+
+    def used_devices(self):
+        if self.mode == "closed_loop_ramp":
+            return [self.meas_setup_controlable["dev"], self.acquis_triggering_measurable["dev"]]
+        return [self.meas_setup_controlable["dev"]]
+
+    def to_definition(self):
+        if self.mode in ("ramp", "closed_loop_ramp"):
+            trigger = {"start_value": self.start_value, "trigger_separation": self.trigger_separation,
+                       "rate_for_controlable": self.rate_for_controllable, "end_value": self.end_value}
+            if self.mode == "closed_loop_ramp":
+                trigger["acquis_triggering_measurable"] = Helper.reference_to(self.acquis_triggering_measurable)
+                trigger["datapoint_key"] = self.datapoint_key
+                trigger["poll_interval"] = self.poll_interval
+                trigger["max_setpoint_lead"] = self.max_setpoint_lead
+        elif self.mode == "adaptive":
+            trigger = {"adaptive": True, "start_value": self.start_value, "end_value": self.end_value,
+                       "coarse_points": self.coarse_points, "max_points": self.max_points,
+                       "tolerance": self.tolerance, "response_key": self.response_key,
+                       "logarithmic_response": self.logarithmic_response}
+        else:
+            trigger = {"specific_values": list(self.specific_values)}
+            if self.time_budget > 0:
+                trigger["time_budget"] = self.time_budget
+            if not self.list_sweep:
+                trigger["list_sweep"] = False
+        definition = {"type": "ParamContr", "identifier": list(self.identifier),
+                      "controlable": Helper.reference_to(self.meas_setup_controlable), "trigger": trigger}
+        definition.update(self._error_handling_definition())
+        return definition
 
     def generate_one_line_summary(self):
         """
@@ -344,9 +998,24 @@ class ParameterController(Thread, Task):
             summary = str(text) + str(dev_name) + str(controled_param) + "from " + str(self.start_value) + " to " + \
                       str(self.end_value) + " triggering every " + str(self.trigger_separation) + \
                       " and controlling at a rate of " + str(self.rate_for_controllable) + "."
+        elif self.mode == "closed_loop_ramp":
+            summary = "{0}{1}{2}from {3} to {4} triggering every {5} of {6} measured at {7}, changing it at a rate of " \
+                      "{8} per minute (setpoint at most {9} ahead, polling every {10} s).".format(
+                        text, dev_name, controled_param, str(self.start_value), str(self.end_value),
+                        str(self.trigger_separation), self.datapoint_key, self.acquis_triggering_measurable["dev"].name,
+                        str(self.rate_for_controllable), str(self.max_setpoint_lead), str(self.poll_interval))
+        elif self.mode == "adaptive":
+            summary = "{0}{1}{2}from {3} to {4}, {5} values on a log grid refined where {6} changes by more than {7}, " \
+                      "at most {8} values.".format(text, dev_name, controled_param, str(self.start_value),
+                                                   str(self.end_value), str(self.coarse_points), self.response_key,
+                                                   str(self.tolerance), str(self.max_points))
         elif self.mode == "spec_values":
             summary = str(text) + str(dev_name) + str(
                 controled_param) + "setting specified values and triggering sub_tasks then"
+            if self.time_budget > 0:
+                summary += " within " + str(self.time_budget) + " minutes"
+            if not self.list_sweep:
+                summary += ", never as a list sweep"
         return summary
 
     def run(self):
@@ -355,40 +1024,50 @@ class ParameterController(Thread, Task):
         :return:
         """
 
-        while self.should_be_running:
-            if self.should_do_now:
-                self.do()
-                self.should_do_now = False
-            time.sleep(0.01)
+        self._serve_do_requests()
 
         return
 
     def _start_and_stop_sub_tasks(self):
-        # self.sub´_tasks gets updates when the Thread is started with the run method
-        for task in self.sub_tasks:
-            # start the action on the thread. If the property "should_do_now" is changed to False again, it is finished
-            task.should_do_now = True
-            while task.should_do_now:
-                pass
+        # The sub_tasks are looked up again every time as they may have been changed via the ControlChannel while
+        # measuring. We sleep until all sub_tasks tell us they are finished
+        self.sub_tasks = Helper.check_for_sub_tasks(self.identifier, self.task_tree)
+        self._run_sub_tasks(self.sub_tasks)
 
     def do(self):
-        self.sub_tasks = Helper.check_for_sub_tasks(self.identifier, self.global_task_list)
+        resume_state = self._take_resume_state()
+        if self._was_finished_before(resume_state):
+            return
+        self.sub_tasks = Helper.check_for_sub_tasks(self.identifier, self.task_tree)
 
         if self.mode == "ramp": 
-            start_time = time.perf_counter()
+            start_time = self.clock.perf_counter()
             current_value = self.start_value
             most_recent_value = self.start_value
 
-            # The very first temperature should also be sweepin'
-            datapoint = self.ms.change_value_of_controlable_to(self.meas_setup_controlable, current_value)
-            main_db.add_point(self.identifier, datapoint)
-            self._start_and_stop_sub_tasks()
+            if resume_state is None:
+                # The very first temperature should also be sweepin'
+                datapoint = self._call_instrument(self.ms.change_value_of_controlable_to, self.meas_setup_controlable,
+                                                  current_value)
+                if datapoint is not None:
+                    self._add_point(datapoint)
+                    self._start_and_stop_sub_tasks()
+                self._save_cursor({"elapsed": self.clock.perf_counter() - start_time,
+                                   "most_recent_value": most_recent_value})
+            else:
+                # continue the ramp from where it was when the last sweep was finished
+                start_time -= resume_state["elapsed"]
+                most_recent_value = resume_state["most_recent_value"]
 
             while not self.all_values_reached:
+                if self._safe_point():
+                    break
+                # the ramp continues where it was paused
+                start_time += self.paused_seconds
                 sweeped_this_cycle = False
                 # when we get the relative time to the start of this controllable, we can calculate our expected setpoint
                 # according to the rate specified, therefore we first gather the current time
-                current_relative_time = (time.perf_counter() - start_time)  # some float in milliseconds
+                current_relative_time = (self.clock.perf_counter() - start_time)  # some float in milliseconds
 
                 # new setpoint value is start value * relative time in milliseconds * millisecond_rate as this is a linear
                 # function and we want to use the mentioned ramping method.
@@ -401,9 +1080,13 @@ class ParameterController(Thread, Task):
                     if setpoint_value > self.end_value:
                         setpoint_value = self.end_value
 
-                UserInput.post_status(time.strftime("%c") + ": Halting " + self.generate_one_line_summary())
                 # Actually send the temperature controller a new value
-                datapoint = self.ms.change_value_of_controlable_to(self.meas_setup_controlable, setpoint_value)
+                datapoint = self._call_instrument(self.ms.change_value_of_controlable_to,
+                                                  self.meas_setup_controlable, setpoint_value)
+                if datapoint is None:
+                    # try again with the setpoint that is due then
+                    self._sleep(1.0)
+                    continue
 
                 current_value = setpoint_value
 
@@ -412,39 +1095,480 @@ class ParameterController(Thread, Task):
                     most_recent_value = current_value
 
                     # we only add a datapoint if we are triggering sub_tasks:
-                    main_db.add_point(self.identifier, datapoint)
+                    self._post_status("Halting {0}", self.one_line_summary)
+                    self._add_point(datapoint)
                     self._start_and_stop_sub_tasks()
+                    self._save_cursor({"elapsed": self.clock.perf_counter() - start_time,
+                                       "most_recent_value": most_recent_value})
                     sweeped_this_cycle = True
-
-                UserInput.post_status(time.strftime("%c") + ": Resuming: " + self.generate_one_line_summary())
+                    self._post_status("Resuming: {0}", self.one_line_summary)
 
                 if self.end_value_reached_when_below:
                     if current_value <= self.end_value:
                         self.all_values_reached = True
                         # and we sweep when we reach the final value, but only if we didn't already sweep
                         if not sweeped_this_cycle:
-                            main_db.add_point(self.identifier, datapoint)
+                            self._add_point(datapoint)
                             self._start_and_stop_sub_tasks()
-                            UserInput.post_status(time.strftime("%c") + ": Ramp " + self.generate_one_line_summary() + " now done!")
+                            self._post_status("Ramp {0} now done!", self.one_line_summary)
                 elif not self.end_value_reached_when_below:
                     if current_value >= self.end_value:
                         self.all_values_reached = True
                         # and we sweep when we reach the final value, but only if we didn't already sweep
                         if not sweeped_this_cycle:
-                            UserInput.post_status(time.strftime("%c") + ": Ramp " + self.generate_one_line_summary() + " now done!")
-                            main_db.add_point(self.identifier, datapoint)
+                            self._post_status("Ramp {0} now done!", self.one_line_summary)
+                            self._add_point(datapoint)
                             self._start_and_stop_sub_tasks()
 
                 # TODO: Do we need to introduce a time out/sleep because we are setting temperatures to quickly?
-                time.sleep(0.01)
+                self._sleep(0.01)
+
+        elif self.mode == "spec_values" and self._list_sweep_acquisition() is not None:
+            self._list_sweep(resume_state)
 
         elif self.mode == "spec_values":
-            UserInput.post_status(time.strftime("%c") + ": Started " + self.generate_one_line_summary())
-            for specific_controlable_value in self.specific_values:
-                datapoint = self.ms.change_value_of_controlable_to(self.meas_setup_controlable,
-                                                                   specific_controlable_value)
-                main_db.add_point(self.identifier, datapoint)
+            self._post_status("Started {0}", self.one_line_summary)
+            first_index = 0
+            # only needed with a time budget: values that didn't fit, seconds of the budget used, see
+            # _plan_within_budget and _corrected_cost_factor
+            skipped_values = []
+            budget_used = 0.0
+            cost_factor = None
+            if resume_state is not None:
+                first_index = resume_state["next_index"]
+                skipped_values = resume_state.get("skipped_values", [])
+                budget_used = resume_state.get("budget_used", 0.0)
+                cost_factor = resume_state.get("cost_factor")
+            budget_start = self.clock.perf_counter() - budget_used
+            for index in range(first_index, len(self.specific_values)):
+                if self._safe_point():
+                    break
+                # a pause doesn't use up the budget
+                budget_start += self.paused_seconds
+                specific_controlable_value = self.specific_values[index]
+                if self.time_budget > 0:
+                    remaining = self.time_budget * 60 - (self.clock.perf_counter() - budget_start)
+                    if index not in self._plan_within_budget(index, remaining, cost_factor):
+                        skipped_values.append(specific_controlable_value)
+                        continue
+                point_start = self.clock.perf_counter()
+                datapoint = self._call_instrument(self.ms.change_value_of_controlable_to,
+                                                  self.meas_setup_controlable, specific_controlable_value)
+                if datapoint is None:
+                    continue
+                self._add_point(datapoint)
                 self._start_and_stop_sub_tasks()
+                state = {"next_index": index + 1}
+                if self.time_budget > 0:
+                    cost_factor = self._corrected_cost_factor(cost_factor, specific_controlable_value,
+                                                              self.clock.perf_counter() - point_start)
+                    state.update({"skipped_values": skipped_values, "cost_factor": cost_factor,
+                                  "budget_used": self.clock.perf_counter() - budget_start})
+                self._save_cursor(state)
+            if skipped_values:
+                self._record_skipped_values(skipped_values)
+
+        elif self.mode == "closed_loop_ramp":
+            self._closed_loop_ramp(resume_state)
+
+        elif self.mode == "adaptive":
+            self._adaptive_sweep(resume_state)
+
+        self._save_cursor({"finished": True})
+
+    def _list_sweep_acquisition(self):
+        """A spec_values sweep whose only sub_task is a DataAcquisition (without sub_tasks of its own) of the swept
+        device is left to the device if it can sweep by itself, eg the list sweep of the 4980A. Not if the task says so
+        (list_sweep), not with a time budget, as that is planned value by value, and not if the DataAcquisition has a
+        run_timeout, a sweep on the device can't be stopped after a single point
+
+        :return: the DataAcquisition, None if the sweep is done value by value
+        :rtype: DataAcquisition
+        """
+        if not self.list_sweep or self.time_budget > 0 or len(self.sub_tasks) != 1:
+            return None
+        data_acquisition = self.sub_tasks[0]
+        if not isinstance(data_acquisition, DataAcquisition) or data_acquisition.run_timeout > 0:
+            return None
+        if Helper.check_for_sub_tasks(data_acquisition.identifier, self.task_tree):
+            return None
+        if self.ms.sweep_points(self.meas_setup_controlable, data_acquisition.measurable) < 1:
+            return None
+        return data_acquisition
+
+    def _list_sweep(self, resume_state):
+        """The values are handed to the device in chunks of as many as it can sweep at once, but only as many as take
+        about list_sweep_chunk_seconds together, so a pause, a skip or the cursor never wait long for a chunk. Every chunk
+        is set and measured in one go and the points are stored as if the DataAcquisition had measured them value by
+        value. A value that alone would take longer than a chunk or that the device doesn't sweep is done value by
+        value, as is the rest of the sweep if the sub_tasks are changed while measuring.
+
+        The DataAcquisition isn't run for the swept values, but its error policy applies to them like it would have to
+        its measurement: if the device fails on a value, the points before are kept and the value is swept again
+        ("retry") or left out ("skip" and "abort_subtree", the DataAcquisition's run would have been just that value)
+        """
+        data_acquisition = self._list_sweep_acquisition()
+        self._post_status("Started {0} as a list sweep of up to {1} values at a time", self.one_line_summary,
+                          self.ms.sweep_points(self.meas_setup_controlable, data_acquisition.measurable))
+        index = 0
+        if resume_state is not None:
+            index = resume_state["next_index"]
+        # failed attempts at the value at index
+        failures = 0
+        while index < len(self.specific_values):
+            if self._safe_point():
+                break
+            self.sub_tasks = Helper.check_for_sub_tasks(self.identifier, self.task_tree)
+            data_acquisition = self._list_sweep_acquisition()
+            values = []
+            if data_acquisition is not None:
+                values = self.specific_values[index:index + self._list_sweep_chunk_size(index, data_acquisition)]
+            points = []
+            error = None
+            if values:
+                try:
+                    with self._timed("measure_measurable"):
+                        points = self.ms.sweep_measurable(self.meas_setup_controlable, values,
+                                                          data_acquisition.measurable) or []
+                except SweepInterrupted as interrupted:
+                    points = interrupted.points
+                    error = interrupted
+                except InstrumentError as failure:
+                    error = failure
+            for controlable_datapoint, measurable_datapoint in points:
+                self._add_point(controlable_datapoint)
+                self._add_point(measurable_datapoint, data_acquisition)
+            if points:
+                index += len(points)
+                failures = 0
+                self._save_cursor({"next_index": index})
+            elif error is None:
+                datapoint = self._call_instrument(self.ms.change_value_of_controlable_to, self.meas_setup_controlable,
+                                                  self.specific_values[index])
+                if datapoint is not None:
+                    self._add_point(datapoint)
+                    self._start_and_stop_sub_tasks()
+                index += 1
+                self._save_cursor({"next_index": index})
+            if error is None:
+                continue
+            failures += 1
+            attempts = 1
+            if data_acquisition.error_policy == "retry":
+                attempts += data_acquisition.retries
+            self._post_status("{0}: {1} (attempt {2} of {3})", data_acquisition.identifier, error, failures, attempts)
+            if failures >= attempts:
+                self._post_status("{0} skips {1}.", data_acquisition.identifier, self.specific_values[index])
+                index += 1
+                failures = 0
+                self._save_cursor({"next_index": index})
+
+    def _list_sweep_chunk_size(self, first_index: int, data_acquisition):
+        """
+        :return: how many values from first_index on are swept in one go: at most sweep_points of the device and only
+        as many as take list_sweep_chunk_seconds together (see _estimated_point_cost). 0 if the first one alone would
+        take longer
+        :rtype: int
+        """
+        sweep_points = self.ms.sweep_points(self.meas_setup_controlable, data_acquisition.measurable)
+        seconds = 0.0
+        count = 0
+        for value in self.specific_values[first_index:first_index + sweep_points]:
+            seconds += self._estimated_point_cost(value)
+            if seconds > self.list_sweep_chunk_seconds:
+                break
+            count += 1
+        return count
+
+    def _estimated_point_cost(self, value):
+        """Estimates the time one value of the sweep takes. For a frequency device, that's the measurement time at the
+        frequency for every DataAcquisition below that reads the device. For all other controlables, every value is
+        assumed to take the same time, 1 s until the first one was measured.
+
+        :return: seconds, before the correction by the measured points (see _corrected_cost_factor)
+        :rtype: float
+        """
+        mdc = self.meas_setup_controlable["dev"]
+        costs = self.frequency_point_costs.get(type(getattr(mdc, "mes_device", None)).__name__)
+        if costs is None or self.meas_setup_controlable["name"] != "expected_freq":
+            return 1.0
+        minimum_measurement_time = getattr(mdc.mes_device, "minimum_measurement_time",
+                                           costs["minimum_measurement_time"])
+        if type(minimum_measurement_time) not in (int, float):
+            minimum_measurement_time = costs["minimum_measurement_time"]
+        single_reading = max(minimum_measurement_time, costs["periods"] / max(abs(value), 1e-9)) + costs["overhead"]
+        readings = 0
+        for task in self.task_tree.sub_tree_of(self.identifier)[1:]:
+            if isinstance(task, DataAcquisition) and task.measurable["dev"] is mdc:
+                readings += 1
+        return single_reading * max(1, readings)
+
+    def _corrected_cost_factor(self, cost_factor, value, measured_seconds: float):
+        """The estimates are multiplied with a factor that follows how long the points really took. The first point
+        sets it, every further point moves it by cost_correction_weight
+
+        :param cost_factor: the factor so far, None before the first point
+        :return: the new factor
+        :rtype: float
+        """
+        ratio = measured_seconds / self._estimated_point_cost(value)
+        if cost_factor is None:
+            return ratio
+        return (1 - self.cost_correction_weight) * cost_factor + self.cost_correction_weight * ratio
+
+    def _plan_within_budget(self, first_index: int, remaining_seconds: float, cost_factor):
+        """Picks the values from first_index on that fit into the remaining budget, cheapest first, so as many values
+        as possible are measured. The sweep still runs in the original order. As the plan is made again before every
+        value with the newest estimates, a value dropped earlier can come back if the sweep is faster than expected.
+
+        :param cost_factor: see _corrected_cost_factor, None if no point was measured yet
+        :return: the indices into specific_values to measure
+        :rtype: set
+        """
+        if cost_factor is None:
+            cost_factor = 1.0
+        costs = sorted([(self._estimated_point_cost(self.specific_values[index]) * cost_factor, index)
+                        for index in range(first_index, len(self.specific_values))])
+        planned = set()
+        total = 0.0
+        for cost, index in costs:
+            if total + cost > remaining_seconds:
+                break
+            planned.add(index)
+            total += cost
+        return planned
+
+    def _record_skipped_values(self, skipped_values: list):
+        reason = "time budget of {0} minutes used up".format(str(self.time_budget))
+        self._post_status("{0} skipped {1} value(s) to stay within its budget: {2}", self.identifier,
+                          len(skipped_values), skipped_values)
+        if self.committer is not None:
+            self.committer.call(self.database.add_skipped_values, self.identifier, skipped_values, reason)
+        else:
+            self.database.add_skipped_values(self.identifier, skipped_values, reason)
+
+    def _adaptive_sweep(self, resume_state):
+        """Measures the coarse grid, then refines it round by round. Every round splits the intervals (largest change
+        first, as many as the point budget allows) at their logarithmic middle and measures the new values in sweep
+        direction."""
+        self._post_status("Started {0}", self.one_line_summary)
+        # {value: response or None}
+        measured = {}
+        if resume_state is not None:
+            for value, response in resume_state["measured"]:
+                measured[value] = response
+        to_measure = Helper.create_valuelist_according_to_distribution(self.start_value, self.end_value,
+                                                                     self.coarse_points, None, "logarithmic")
+        skipped = False
+        while to_measure:
+            for value in to_measure:
+                if value in measured:
+                    continue
+                if len(measured) >= self.max_points:
+                    break
+                skipped = self._safe_point()
+                if skipped:
+                    break
+                measured[value] = self._measure_adaptive_value(value)
+                self._save_cursor({"measured": [[value, response] for value, response in measured.items()]})
+            if skipped or len(measured) >= self.max_points:
+                break
+            to_measure = self._adaptive_refinement(measured)
+        self._post_status("{0}: measured {1} values, done.", self.identifier, len(measured))
+
+    def _measure_adaptive_value(self, value: float):
+        """Sets the value, runs the sub_tasks and returns the response they measured (None if none of them had it)"""
+        sub_tree = self.task_tree.sub_tree_of(self.identifier)[1:]
+        for task in sub_tree:
+            task.latest_datapoint = None
+        datapoint = self._call_instrument(self.ms.change_value_of_controlable_to, self.meas_setup_controlable, value)
+        if datapoint is None:
+            return None
+        self._add_point(datapoint)
+        self._start_and_stop_sub_tasks()
+        for task in sub_tree:
+            if task.latest_datapoint is not None:
+                response = self._response_of(task.latest_datapoint)
+                if response is not None:
+                    return response
+        return None
+
+    def _response_of(self, datapoint: dict):
+        """
+        :return: the response an adaptive sweep refines on, None if the datapoint doesn't contain it
+        :rtype: float
+        """
+        if self.response_key == "phase":
+            if datapoint.get("R") is None or datapoint.get("X") is None:
+                return None
+            return math.degrees(math.atan2(datapoint["X"], datapoint["R"]))
+        value = datapoint.get(self.response_key)
+        if type(value) not in (int, float):
+            return None
+        if self.logarithmic_response:
+            if value == 0:
+                return None
+            return math.log10(abs(value))
+        return value
+
+    def _adaptive_refinement(self, measured: dict):
+        """
+        :param measured: {value: response}
+        :return: the values to measure next, in sweep direction. Empty if the response is resolved well enough
+        :rtype: list
+        """
+        values = sorted(measured.keys())
+        candidates = []
+        for lower, upper in zip(values, values[1:]):
+            if measured[lower] is None or measured[upper] is None:
+                continue
+            change = abs(measured[upper] - measured[lower])
+            if change <= self.tolerance or math.log10(upper / lower) < 2 * self.adaptive_min_log_spacing:
+                continue
+            candidates.append((change, math.sqrt(lower * upper)))
+        candidates.sort(reverse=True)
+        budget = self.max_points - len(measured)
+        return sorted([middle for change, middle in candidates[:budget]], reverse=self.start_value > self.end_value)
+
+    def _closed_loop_trigger_points(self):
+        """
+        :return: start_value, then every trigger_separation towards the end_value, which is always the last point
+        :rtype: list
+        """
+        direction = -1 if self.end_value_reached_when_below else 1
+        distance = abs(self.end_value - self.start_value)
+        points = [self.start_value]
+        if self.trigger_separation > 0:
+            # the small epsilon keeps floating point noise from adding a point right before the end value
+            amount = int(math.floor(distance / self.trigger_separation + 1e-9))
+            points += [self.start_value + direction * index * self.trigger_separation for index in range(1, amount + 1)]
+        if abs(points[-1] - self.end_value) > 1e-9:
+            points.append(self.end_value)
+        return points
+
+    def _read_closed_loop_value(self):
+        """
+        :return: the current value of the watched measurable, None if the datapoint doesn't contain it
+        :rtype: float
+        """
+        # A reading another task took during the last poll interval is just as good as a new one
+        datapoint = self._call_instrument(self.ms.read_measurable, self.acquis_triggering_measurable,
+                                          max_age=self.poll_interval, clock=self.clock)
+        if datapoint is None:
+            self._post_status("{0} can't read {1}. Stopping the ramp.", self.identifier, self.datapoint_key)
+            return None
+        if self.datapoint_key not in datapoint:
+            self._post_status("{0} can't find '{1}' in the datapoint, available are: {2}. Stopping the ramp.",
+                              self.identifier, self.datapoint_key, list(datapoint.keys()))
+            return None
+        return datapoint[self.datapoint_key]
+
+    def _closed_loop_ramp(self, resume_state):
+        """Ramps so the measured value, not the setpoint, follows the rate and fires the sub_tasks whenever the measured
+        value crosses the next trigger point.
+
+        The setpoint is a reference that moves with the rate from where the sample was after the last sweep, plus a
+        lead. The lead is the current lag of the sample behind the reference plus its integral over time (see
+        closed_loop_integral_time), so a sample that always lags behind gets a setpoint that runs ahead of it further
+        and further, at most max_setpoint_lead. While the sub_tasks run, the setpoint stays where it is.
+        """
+        direction = -1 if self.end_value_reached_when_below else 1
+        rate_per_second = self.rate_for_controllable / 60
+        trigger_points = self._closed_loop_trigger_points()
+        # the sample only creeps towards a setpoint that isn't ahead of it, so start and end are reached "close enough"
+        tolerance = self.trigger_separation / 10 if self.trigger_separation > 0 else 0.1
+        next_index = 0
+        lead = 0.0
+        if resume_state is not None:
+            next_index = resume_state["next_point_index"]
+            lead = resume_state["lead"]
+
+        self._post_status("Started {0}", self.one_line_summary)
+        setpoint_datapoint = {}
+        if next_index == 0:
+            # Bring the sample to the start value first, the first sweep is done there
+            setpoint_datapoint = self._call_instrument(self.ms.change_value_of_controlable_to,
+                                                       self.meas_setup_controlable, self.start_value)
+            if setpoint_datapoint is None:
+                return
+            value = self._read_closed_loop_value()
+            while value is not None and abs(value - self.start_value) > tolerance:
+                if self._safe_point():
+                    return
+                self._sleep(self.poll_interval)
+                value = self._read_closed_loop_value()
+            if value is None:
+                return
+            self._fire_closed_loop_sweep(setpoint_datapoint, value, trigger_points[0])
+            next_index = 1
+            self._save_cursor({"next_point_index": next_index, "lead": lead})
+
+        value = self._read_closed_loop_value()
+        anchor_time = self.clock.perf_counter()
+        anchor_value = value
+        last_time = anchor_time
+        while value is not None and next_index < len(trigger_points):
+            if self._safe_point():
+                break
+            if self.paused_seconds > 0:
+                # the sample drifted towards the last setpoint meanwhile, the rate continues from where it is now
+                value = self._read_closed_loop_value()
+                if value is None:
+                    break
+                anchor_time = self.clock.perf_counter()
+                anchor_value = value
+                last_time = anchor_time
+            last_point = next_index == len(trigger_points) - 1
+            crossed = direction * (value - trigger_points[next_index]) >= 0
+            if crossed or (last_point and abs(value - self.end_value) <= tolerance):
+                # If the sample passed several points within one poll interval, it's only swept once at the measured
+                # value instead of several times at the same real temperature
+                while next_index + 1 < len(trigger_points) and \
+                        direction * (value - trigger_points[next_index + 1]) >= 0:
+                    next_index += 1
+                self._fire_closed_loop_sweep(setpoint_datapoint, value, trigger_points[next_index])
+                next_index += 1
+                self._save_cursor({"next_point_index": next_index, "lead": lead})
+                # the rate continues from where the sample is now
+                value = self._read_closed_loop_value()
+                anchor_time = self.clock.perf_counter()
+                anchor_value = value
+                last_time = anchor_time
+                continue
+
+            now = self.clock.perf_counter()
+            reference = anchor_value + direction * rate_per_second * (now - anchor_time)
+            if direction * (reference - self.end_value) > 0:
+                reference = self.end_value
+            # positive when the sample lags behind the reference
+            lag = direction * (reference - value)
+            lead += lag * (now - last_time) / self.closed_loop_integral_time
+            lead = min(max(lead, -self.max_setpoint_lead), self.max_setpoint_lead)
+            last_time = now
+            setpoint = reference + direction * min(max(lead + lag, -self.max_setpoint_lead), self.max_setpoint_lead)
+            # never drive the sample beyond the end value
+            if direction * (setpoint - self.end_value) > 0:
+                setpoint = self.end_value
+            new_setpoint_datapoint = self._call_instrument(self.ms.change_value_of_controlable_to,
+                                                           self.meas_setup_controlable, setpoint)
+            # if it failed, the old setpoint is still active
+            if new_setpoint_datapoint is not None:
+                setpoint_datapoint = new_setpoint_datapoint
+
+            self._sleep(self.poll_interval)
+            value = self._read_closed_loop_value()
+
+        if value is not None:
+            self._post_status("Ramp {0} now done!", self.one_line_summary)
+
+    def _fire_closed_loop_sweep(self, setpoint_datapoint: dict, value: float, trigger_point: float):
+        datapoint = setpoint_datapoint.copy()
+        datapoint[self.datapoint_key] = value
+        datapoint["trigger_point"] = trigger_point
+        self._post_status("{0} reached {1} (trigger point {2}), starting the sub_tasks.", self.datapoint_key, value,
+                          trigger_point)
+        self._add_point(datapoint)
+        self._start_and_stop_sub_tasks()
 
 
 class Measurement:
@@ -452,10 +1576,31 @@ class Measurement:
         frequencies x,y,z
         """
 
-    def __init__(self):
-        self.tasks = []  # type: [Task]
+    # the autosave policy, see DataStorage.Autosaver
+    autosave_every_points = 500
+    autosave_every_seconds = 300.0
+
+    def __init__(self, meas_setup_name: str = None, meas_setup: MeasurementSetup = None, database: Database = None):
+        """
+        :param meas_setup_name: name of the measurement setup to use, eg when resuming a run. If None, the user is asked
+        :param meas_setup: an already initialized measurement setup, eg of the previous run of a RunQueue. Its devices
+        stay open and calibrated, nothing is asked
+        :param database: where the datapoints go, main_db if None. Measurements running at the same time need their
+        own one
+        """
+        self.tasks = TaskTree()
         self.task_input = [] #User input to questions. Variable helps with setting up a new template
         self.meas_setup = None  # type: MeasurementSetups.MeasurementSetup
+        self.meas_setup_name = meas_setup_name
+        self.database = database or main_db  # type: Database
+        # only set while measuring, tasks appended via the ControlChannel get them as well
+        self._engine = None  # type: TaskEngine
+        self._checkpoint = None  # type: Checkpoint
+        self._committer = None  # type: Committer
+        self._control = None  # type: ControlChannel
+        if meas_setup is not None:
+            self.meas_setup = meas_setup
+            return
         self._choose_meas_setup()
         self.meas_setup.init_after_creation()
         return
@@ -463,13 +1608,15 @@ class Measurement:
     def _choose_meas_setup(self):
         self.meas_setup_chooser = MeasurementSetups.MeasurementSetupHelper()
         self.list_of_setups = self.meas_setup_chooser.list_available_setups()
-        question = {"question_title": "Measurement Setup",
-                    "question_text": "Please choose your current measurement setup",
-                    "default_answer": 0,
-                    "optiontype": "multi_choice", "valid_options": self.list_of_setups}
-        answer = UserInput.ask_user_for_input(question)["answer"]
+        if self.meas_setup_name is None:
+            question = {"question_title": "Measurement Setup",
+                        "question_text": "Please choose your current measurement setup",
+                        "default_answer": 0,
+                        "optiontype": "multi_choice", "valid_options": self.list_of_setups}
+            answer = UserInput.ask_user_for_input(question)["answer"]
+            self.meas_setup_name = self.list_of_setups[answer]
 
-        self.meas_setup = self.meas_setup_chooser.select_setup(self.list_of_setups[answer])
+        self.meas_setup = self.meas_setup_chooser.select_setup(self.meas_setup_name)
 
     def new_task(self,custom_type=True,template=[]):
         # We need measurement setup controlables and measurables
@@ -516,11 +1663,14 @@ class Measurement:
                         "default_answer": 0,
                         "optiontype": "multi_choice",
                         "valid_options": ["ramp-based (eg temperature)",
-                                          "specific values (eg frequencies)"]}
+                                          "specific values (eg frequencies)",
+                                          "closed-loop ramp (sub_tasks fire at measured values, eg sample temperature)",
+                                          "adaptive (eg frequencies, refined where the response changes most)"]}
             answer = self._get_input(custom_type,question,template)
+            param_controller_type = answer["answer"]
 
-            # answer being 0 means ramp-based is wanted
-            if answer["answer"] == 0:
+            # answer being 0 means ramp-based is wanted, 2 is a ramp that follows a measurable
+            if param_controller_type in (0, 2):
 
                 # Get a start value for the controlable
                 # TODO: One could think of imposing more sensible limits on the controlable here
@@ -567,16 +1717,56 @@ class Measurement:
                 answer = self._get_input(custom_type,question,template)
                 rate_for_controlable = answer["answer"]
 
-                identifier = self._get_id_for_task_insert_into_queue(custom_type,template)
                 trigger = {"start_value": start_value,
                            "end_value": end_value,
                            "trigger_separation": trigger_separation,
                            "rate_for_controlable": rate_for_controlable}
+
+                if param_controller_type == 2:
+                    question = {"question_title": "Measurable to follow",
+                                "question_text": "Which measurable shows the real value of the controlable (eg the "
+                                                 "Sample Sensor for the temperature)?",
+                                "default_answer": 0,
+                                "optiontype": "multi_choice",
+                                "valid_options": available_measurables}
+                    answer = self._get_input(custom_type,question,template)
+                    trigger["acquis_triggering_measurable"] = available_raw_measurables[answer["answer"]]
+
+                    question = {"question_title": "Value inside the datapoint",
+                                "question_text": "Which value of the datapoint is the measured one? (eg 'Sample "
+                                                 "Sensor' for the sample temperature)",
+                                "default_answer": trigger["acquis_triggering_measurable"]["name"],
+                                "optiontype": "free_text"}
+                    answer = self._get_input(custom_type,question,template)
+                    trigger["datapoint_key"] = answer["answer"]
+
+                    question = {"question_title": "Poll interval",
+                                "question_text": "How many seconds between two readings (and setpoint updates)?",
+                                "default_answer": 2.0,
+                                "optiontype": "free_choice",
+                                "valid_options_lower_limit": 0.0,
+                                "valid_options_upper_limit": 1e64,
+                                "valid_options_steplength": 1e16}
+                    answer = self._get_input(custom_type,question,template)
+                    trigger["poll_interval"] = answer["answer"]
+
+                    question = {"question_title": "Maximum setpoint lead",
+                                "question_text": "How far may the setpoint run ahead of the measured value to keep "
+                                                 "the rate?",
+                                "default_answer": 10.0,
+                                "optiontype": "free_choice",
+                                "valid_options_lower_limit": 0.0,
+                                "valid_options_upper_limit": 1000.0,
+                                "valid_options_steplength": 1e3}
+                    answer = self._get_input(custom_type,question,template)
+                    trigger["max_setpoint_lead"] = answer["answer"]
+
+                identifier = self._get_id_for_task_insert_into_queue(custom_type,template)
                 param_controller = ParameterController(identifier, self.meas_setup, desired_controlable, trigger,
-                                                       self.tasks)
+                                                       self.tasks, self.database)
 
             # answer being 1 means "specific values" parameter controller should be used
-            elif answer["answer"] == 1:
+            elif param_controller_type == 1:
                 specific_values_list = []
                 UserInput.post_status("We will generate a nice and shiny list for you. But first, I need some "
                                       "answers")
@@ -746,11 +1936,113 @@ class Measurement:
                             for index, value in enumerate(specific_values_list):
                                 UserInput.post_status(str(index) + ": " + str(value))
 
+                question = {"question_title": "Time budget",
+                            "question_text": "How many minutes may one run through the values take at most? If they "
+                                             "don't fit, the most expensive values (eg the lowest frequencies) are "
+                                             "skipped. 0 means no budget.",
+                            "default_answer": 0.0,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 0.0,
+                            "valid_options_upper_limit": 1e16,
+                            "valid_options_steplength": 1e16}
+                answer = self._get_input(custom_type,question,template)
+                time_budget = answer["answer"]
+
+                question = {"question_title": "List sweep",
+                            "question_text": "May the device sweep the values by itself if it can (eg the list sweep "
+                                             "of the 4980A)? That's much faster, but the points of a chunk are measured "
+                                             "in one go and share their timestamps less precisely.",
+                            "default_answer": True,
+                            "optiontype": "yes_no"}
+                answer = self._get_input(custom_type,question,template)
+                list_sweep = answer["answer"]
+
+                identifier = self._get_id_for_task_insert_into_queue(custom_type,template)
+                trigger = {"specific_values": specific_values_list, "time_budget": time_budget,
+                           "list_sweep": list_sweep}
+                param_controller = ParameterController(identifier, self.meas_setup, desired_controlable, trigger,
+                                                       self.tasks, self.database)
+
+            # answer being 3 means an adaptive sweep
+            elif param_controller_type == 3:
+                question = {"question_title": "Start value",
+                            "question_text": "What is the desired start value? (eg 1e-1)",
+                            "default_answer": 1e-1,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 1e-64,
+                            "valid_options_upper_limit": 1e64,
+                            "valid_options_steplength": 1e16}
+                answer = self._get_input(custom_type,question,template)
+                start_value = answer["answer"]
+                question = {"question_title": "End value",
+                            "question_text": "What is the desired end value? (eg 1e7)",
+                            "default_answer": 1e7,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 1e-64,
+                            "valid_options_upper_limit": 1e64,
+                            "valid_options_steplength": 1e16}
+                answer = self._get_input(custom_type,question,template)
+                end_value = answer["answer"]
+                question = {"question_title": "Coarse grid",
+                            "question_text": "How many logarithmically distributed values should be measured first?",
+                            "default_answer": 9,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 2,
+                            "valid_options_upper_limit": 1e6,
+                            "valid_options_steplength": 1}
+                answer = self._get_input(custom_type,question,template)
+                coarse_points = int(answer["answer"])
+                question = {"question_title": "Point budget",
+                            "question_text": "How many values should be measured at most, coarse grid included?",
+                            "default_answer": 40,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": coarse_points,
+                            "valid_options_upper_limit": 1e6,
+                            "valid_options_steplength": 1}
+                answer = self._get_input(custom_type,question,template)
+                max_points = int(answer["answer"])
+                question = {"question_title": "Response",
+                            "question_text": "Which value measured by the sub_tasks should be resolved? 'phase' is "
+                                             "calculated from R and X, anything else is taken from the datapoint "
+                                             "(eg 'X').",
+                            "default_answer": "phase",
+                            "optiontype": "free_text"}
+                answer = self._get_input(custom_type,question,template)
+                response_key = answer["answer"]
+                logarithmic_response = False
+                tolerance_unit = "degrees"
+                if response_key != "phase":
+                    question = {"question_title": "Logarithmic response",
+                                "question_text": "Should the response be compared logarithmically (recommended for "
+                                                 "values spanning decades like X)?",
+                                "default_answer": True,
+                                "optiontype": "yes_no"}
+                    answer = self._get_input(custom_type,question,template)
+                    logarithmic_response = answer["answer"]
+                    tolerance_unit = "decades" if logarithmic_response else "units of the value"
+                question = {"question_title": "Tolerance",
+                            "question_text": "Neighbouring values whose response differs by more than this get a "
+                                             "value in between ({0}).".format(tolerance_unit),
+                            "default_answer": 2.0 if response_key == "phase" else 0.1,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 0.0,
+                            "valid_options_upper_limit": 1e64,
+                            "valid_options_steplength": 1e16}
+                answer = self._get_input(custom_type,question,template)
+                tolerance = answer["answer"]
+
                 identifier = self._get_id_for_task_insert_into_queue(custom_type,template)
-                trigger = {"specific_values": specific_values_list}
+                trigger = {"adaptive": True,
+                           "start_value": start_value,
+                           "end_value": end_value,
+                           "coarse_points": coarse_points,
+                           "max_points": max_points,
+                           "tolerance": tolerance,
+                           "response_key": response_key,
+                           "logarithmic_response": logarithmic_response}
                 param_controller = ParameterController(identifier, self.meas_setup, desired_controlable, trigger,
-                                                       self.tasks)
-            self.tasks.append(param_controller)
+                                                       self.tasks, self.database)
+            self.tasks.add(param_controller)
 
         # 1 = DataAcquisition, code path to create a new Data Acquisition task
         elif answer["answer"] == 1:
@@ -768,17 +2060,42 @@ class Measurement:
                         "optiontype": "yes_no"}
             answer = self._get_input(custom_type,question,template)
             user_wants_max_deviation = answer["answer"]
+            sample_interval = 5.0
+            percentiles = []
+            if user_wants_max_deviation:
+                question = {"question_title": "Sample interval",
+                            "question_text": "How many seconds between two samples while the sub_tasks are run?",
+                            "default_answer": 5.0,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 0.0,
+                            "valid_options_upper_limit": 1e64,
+                            "valid_options_steplength": 1e16}
+                answer = self._get_input(custom_type,question,template)
+                sample_interval = answer["answer"]
+                question = {"question_title": "Percentiles",
+                            "question_text": "Besides average, standard deviation, minimum and maximum, percentiles can "
+                                             "be estimated. Enter them separated by commas (eg 5,50,95) or 'none'.",
+                            "default_answer": "none",
+                            "optiontype": "free_text"}
+                answer = self._get_input(custom_type,question,template)
+                for item in str(answer["answer"]).split(","):
+                    try:
+                        percentile = float(item)
+                    except ValueError:
+                        continue
+                    if 0 < percentile < 100:
+                        percentiles.append(percentile)
             identifier = self._get_id_for_task_insert_into_queue(custom_type,template)
             new_data_acqu = DataAcquisition(identifier, self.meas_setup, measurable_to_measure,
-                                            user_wants_max_deviation, self.tasks)
-            self.tasks.append(new_data_acqu)
+                                            user_wants_max_deviation, self.tasks, sample_interval, percentiles,
+                                            self.database)
+            self.tasks.add(new_data_acqu)
 
         # 2 = Trigger - either measurable triggered or time triggered for now
         elif answer["answer"] == 2:
 
             question = {"question_title": "Time or Measurable triggered",
-                        "question_text": "Do you want to have it triggered by time or a measurable "
-                                         "(not implemented yet)?",
+                        "question_text": "Do you want to have it triggered by time or a measurable?",
                         "default_answer": 0,
                         "optiontype": "multi_choice",
                         "valid_options": ["time", "meausurable"]}
@@ -809,8 +2126,8 @@ class Measurement:
                 trigger = {"total_time_span": total_time, "trigger_separation": trigger_separation}
                 identifier = self._get_id_for_task_insert_into_queue(custom_type,template)
 
-                new_trigger = Trigger(identifier, self.meas_setup, trigger, self.tasks)
-                self.tasks.append(new_trigger)
+                new_trigger = Trigger(identifier, self.meas_setup, trigger, self.tasks, self.database)
+                self.tasks.add(new_trigger)
 
 
             # 1 means measurable triggered acquisition
@@ -819,9 +2136,19 @@ class Measurement:
                             "question_text": "Which measurable do you want to use to trigger a sub task?",
                             "default_answer": 0,
                             "optiontype": "multi_choice",
-                            "valid_options": available_raw_measurables}
+                            "valid_options": available_measurables}
                 answer = self._get_input(custom_type,question,template)
-                measurable_to_use_as_trigger = available_measurables[answer["answer"]]
+                measurable_to_use_as_trigger = available_raw_measurables[answer["answer"]]
+
+                # A datapoint may contain many values (look at ALPHA - it's R,X and freq), so the user has to tell us
+                # which one to compare
+                question = {"question_title": "Value inside the datapoint",
+                            "question_text": "Which value of the datapoint should be compared? (eg 'Sample Sensor' "
+                                             "for the sample temperature or 'R' at the ALPHA)",
+                            "default_answer": measurable_to_use_as_trigger["name"],
+                            "optiontype": "free_text"}
+                answer = self._get_input(custom_type,question,template)
+                datapoint_key = answer["answer"]
 
                 question = {"question_title": "Trigger value",
                             "question_text": "At what value should it trigger?",
@@ -841,51 +2168,87 @@ class Measurement:
                 answer = self._get_input(custom_type,question,template)
                 trigger_when_below = answer["answer"]
 
+                question = {"question_title": "Hysteresis",
+                            "question_text": "After firing, by how much does the value have to go back before the "
+                                             "Trigger can fire again?",
+                            "default_answer": 0.5,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 0.0,
+                            "valid_options_upper_limit": 1e64,
+                            "valid_options_steplength": 1e16}
+                answer = self._get_input(custom_type,question,template)
+                hysteresis = answer["answer"]
+
+                question = {"question_title": "Debounce",
+                            "question_text": "How many readings in a row have to be beyond the value before firing?",
+                            "default_answer": 3,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 1,
+                            "valid_options_upper_limit": 1e6,
+                            "valid_options_steplength": 1}
+                answer = self._get_input(custom_type,question,template)
+                debounce = int(answer["answer"])
+
+                question = {"question_title": "Poll interval",
+                            "question_text": "How many seconds between two readings? A reading another task took "
+                                             "during this time is used instead of asking the device again.",
+                            "default_answer": 2.0,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 0.0,
+                            "valid_options_upper_limit": 1e64,
+                            "valid_options_steplength": 1e16}
+                answer = self._get_input(custom_type,question,template)
+                poll_interval = answer["answer"]
+
+                question = {"question_title": "Time out",
+                            "question_text": "After how many minutes should the Trigger give up? (0 means never)",
+                            "default_answer": 0.0,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 0.0,
+                            "valid_options_upper_limit": 1e64,
+                            "valid_options_steplength": 1e16}
+                answer = self._get_input(custom_type,question,template)
+                timeout = answer["answer"]
+
+                question = {"question_title": "Firings",
+                            "question_text": "How often should the sub_tasks be fired at most?",
+                            "default_answer": 1,
+                            "optiontype": "free_choice",
+                            "valid_options_lower_limit": 1,
+                            "valid_options_upper_limit": 1e6,
+                            "valid_options_steplength": 1}
+                answer = self._get_input(custom_type,question,template)
+                max_firings = int(answer["answer"])
+
                 trigger = {"acquis_triggering_measurable": measurable_to_use_as_trigger,
                            "acquis_triggering_value": triggering_value,
-                           "acquis_triggered_when_below_value": trigger_when_below}
+                           "trigger_when_below": trigger_when_below,
+                           "datapoint_key": datapoint_key,
+                           "poll_interval": poll_interval,
+                           "hysteresis": hysteresis,
+                           "debounce": debounce,
+                           "timeout": timeout,
+                           "max_firings": max_firings}
                 identifier = self._get_id_for_task_insert_into_queue(custom_type,template)
 
-                # new_trigger = Trigger...
-                # self.tasks.append(new_trigger)...
-
-        # a task itself is an object and not the identifier but we need to sort by identifier - lambda is a way to
-        # access the underlying identifier for sorting.
-        # As we have a sort of arbitrary insertion point for tasks into the list, we append and then sort the list. To
-        # never screw up, we directly sort after each insert/append.
-        self.tasks.sort(key=lambda x: x.identifier)
+                new_trigger = Trigger(identifier, self.meas_setup, trigger, self.tasks, self.database)
+                self.tasks.add(new_trigger)
 
     def _get_id_for_task_insert_into_queue(self,custom_type=True,template=[]):
         if len(self.tasks) == 0:
             id_for_task = [0]
         else:
             available_ids = []
-            task_id_list = []
-            for item in self.tasks:
-                current_identifier = item.identifier.copy()
-                task_id_list.append(current_identifier)
-            # After this, we have a nice list containing all the identifiers and also knowledge about
-            # what the deepest level is
-
-            for index, item in enumerate(task_id_list):
-                own_length = len(item)
-                later_own_index_length_exists = False
-                has_sub_identifier = False
-                smaller_list = task_id_list[(index + 1):]
-                for subitem in smaller_list:
-                    if len(subitem) < own_length:
-                        break
-                    elif len(subitem) == own_length:
-                        later_own_index_length_exists = True
-                    elif len(subitem) > own_length:
-                        has_sub_identifier = True
-
-                if not has_sub_identifier:
+            # A task without sub_tasks can get its first one and behind the last sub_task of every parent, a new one
+            # can be appended
+            for task in self.tasks:
+                item = task.identifier.copy()
+                if not self.tasks.sub_tasks_of(item):
                     new_sub_identifier = item.copy()
                     new_sub_identifier.append(0)
                     available_ids.append(new_sub_identifier)
 
-                if not later_own_index_length_exists:
+                if self.tasks.is_last_sub_task(item):
                     new_identifier_one = item.copy()
                     new_identifier_one[len(new_identifier_one) - 1] += 1
                     available_ids.append(new_identifier_one)
@@ -913,40 +2276,217 @@ class Measurement:
         for task in self.tasks:
             UserInput.post_status(str(task.identifier) + "task " + task.generate_one_line_summary())
 
-    def measure(self):
+    def add_task_from_definition(self, definition: dict):
+        """Recreates a task from what Task.to_definition returned and adds it to the task list. See
+        Helper.task_from_definition
+
+        :param definition: dict as returned by Task.to_definition
+        """
+        task = Helper.task_from_definition(definition, self.meas_setup, self.tasks, self.database)
+        self.tasks.add(task)
+        return task
+
+    def measure(self, engine: TaskEngine = None, checkpoint: Checkpoint = None, control: ControlChannel = None,
+                finish_setup=True):
         """
             We start going through all tasks and every task starts sub_tasks accordingly
+
+        :param engine: the engine that executes the task list, by default every task gets its own Thread
+        :param checkpoint: if passed, the tasks keep their cursors in it, so the run can be resumed if it gets
+        interrupted. When resuming, it has to be restored already
+        :param control: if passed, the user can pause, skip and change the task list through it while measuring
+        :param finish_setup: whether the setup is told the measurement is done (eg a Quatro may turn off). Not for a
+        run that is followed by another one of a RunQueue
         """
-        first_temp_file = True
+        if engine is None:
+            engine = ThreadedTaskEngine()
+        engine.check(list(self.tasks))
+        # another measurement of this process may be running on a different setup, but never on the same devices
+        devices = self.meas_setup.devices()
+        reserve_devices(devices, self.database.name)
+        try:
+            self._run_task_list(engine, checkpoint, control)
+        finally:
+            release_devices(devices, self.database.name)
+        # where the tasks had to wait for each other on the bus, eg to speed up the task list
+        contention = bus_arbiter.report()
+        if contention:
+            UserInput.post_status("Waiting for the bus so far (all runs of this JUMP):\n" + "\n".join(contention))
+        if finish_setup:
+            self.meas_setup.measurement_done()
+
+    def _run_task_list(self, engine: TaskEngine, checkpoint: Checkpoint, control: ControlChannel):
         self._prepare_before_measuring()
+        # Points, cursors, autosaves and status messages are handled in the background from now on
+        committer = Committer()
+        committer.start()
+        self._engine = engine
+        self._checkpoint = checkpoint
+        self._committer = committer
+        self._control = control
+        engine_prepared = False
+        autosaver = None
+        # A run that fails (eg a RunQueue continues with the next one on the same devices) mustn't leave its threads
+        # behind, everything that was started is stopped again in the finally
+        try:
+            for task in self.tasks:
+                self._hand_over_run_components(task)
+            if checkpoint is not None:
+                checkpoint.start(self.tasks)
+            engine.prepare(self.tasks)
+            engine_prepared = True
+            if control is not None:
+                control.attach(self, committer)
+                control.start()
+            autosaver = Autosaver(self.database, committer, self.autosave_every_points, self.autosave_every_seconds)
+            # right away, an interrupted run can only be resumed from an autosave
+            autosaver.save()
+            autosaver.start()
+
+            # The top level tasks are looked up one after the other as the task list can change while measuring
+            done_identifiers = set()
+            task = self._next_top_level_task(done_identifiers)
+            while task is not None:
+                task_run = engine.start(task)
+                # Wakes up as soon as the task is done. The short timeout only keeps Ctrl+C working on Windows
+                while not task_run.wait(Autosaver.check_interval):
+                    pass
+                # whatever the task measured since the last autosave is saved now, not only when the next one is due
+                autosaver.save_if_changed()
+                done_identifiers.add(tuple(task.identifier))
+                if control is not None:
+                    control.wait_at_safe_point()
+                # a task that was appended or removed right now has to be in the task list before we look for the next
+                committer.flush()
+                task = self._next_top_level_task(done_identifiers)
+        finally:
+            if autosaver is not None:
+                autosaver.stop()
+            if control is not None:
+                control.stop()
+            if engine_prepared:
+                engine.shutdown()
+            # Everything the tasks queued has to be in the database before anybody looks at it
+            committer.stop()
+            for task in self.tasks:
+                task.committer = None
+                task.control = None
+            self._engine = None
+            self._committer = None
+            self._control = None
+            if checkpoint is not None:
+                checkpoint.close()
+
+        self.database.task_timings = self._collect_task_timings()
+        self._post_timing_report(autosaver)
+
+    def _collect_task_timings(self):
+        """
+        :return: per task where its time went, in seconds: {"identifier", "task", "runs", "total", a key for every
+        Task.timing_phases and "other" for the rest}
+        :rtype: [dict]
+        """
+        task_timings = []
         for task in self.tasks:
-            task.start()
+            timing = {"identifier": task.identifier, "task": task.one_line_summary, "runs": task.timed_runs,
+                      "total": task.timings.get("total", 0.0)}
+            for phase in Task.timing_phases:
+                timing[phase] = task.timings.get(phase, 0.0)
+            timing["other"] = max(0.0, timing["total"] - sum([timing[phase] for phase in Task.timing_phases]))
+            task_timings.append(timing)
+        return task_timings
+
+    def _post_timing_report(self, autosaver: Autosaver):
+        def format_seconds(seconds):
+            # VISA round trips are milliseconds, a whole run is hours
+            if seconds < 60:
+                return "{0:.2f} s".format(seconds)
+            return format_duration(seconds)
+
+        lines = ["Where the time went:"]
+        for timing in self.database.task_timings:
+            if timing["runs"] == 0:
+                continue
+            phases = ["{0} {1} ({2:.0%})".format(phase, format_seconds(timing[phase]), timing[phase] / timing["total"])
+                      for phase in Task.timing_phases + ["other"]
+                      if timing["total"] > 0 and timing[phase] / timing["total"] >= 0.005]
+            lines.append("{0}{1} {2} run(s), {3}: {4}".format("    " * (len(timing["identifier"]) - 1),
+                                                              str(timing["identifier"]), timing["runs"],
+                                                              format_seconds(timing["total"]), ", ".join(phases)))
+        lines.append("{0} autosave(s), {1} of pickling in the background".format(
+            autosaver.amount_of_autosaves, format_seconds(autosaver.seconds_spent)))
+        UserInput.post_status("\n".join(lines))
+
+    def _next_top_level_task(self, done_identifiers: set):
+        """
+        :return: the first top level task that wasn't run yet, None if all are done
+        :rtype: Task
+        """
+        for task in self.tasks.top_level_tasks():
+            if tuple(task.identifier) not in done_identifiers:
+                return task
+        return None
+
+    def _hand_over_run_components(self, task: Task):
+        task.engine = self._engine
+        task.checkpoint = self._checkpoint
+        task.committer = self._committer
+        task.control = self._control
+
+    def append_task_while_measuring(self, definition: dict):
+        """Adds a task to the running measurement. Called on the committer thread (see ControlChannel), so the task list
+        doesn't change in the middle of an autosave. The task is run the next time its parent starts its sub_tasks.
+
+        :param definition: dict as returned by Task.to_definition
+        """
+        try:
+            identifier = list(definition["identifier"])
+        except (KeyError, TypeError):
+            raise ControlCommandError("The task definition has no identifier.")
+        if self.tasks.get(identifier) is not None:
+            raise ControlCommandError("There already is a task {0}, remove it first.".format(str(identifier)))
+        if len(identifier) > 1 and self.tasks.parent_of(identifier) is None:
+            raise ControlCommandError("There is no parent task {0} for {1}".format(str(identifier[:-1]),
+                                                                                   str(identifier)))
+        try:
+            task = Helper.task_from_definition(definition, self.meas_setup, self.tasks, self.database)
+        except (TaskDefinitionError, KeyError, TypeError) as error:
+            raise ControlCommandError("The task definition is incomplete: {0}".format(error))
+        try:
+            # eg a pool of workers can't grow while measuring
+            self._engine.check(list(self.tasks) + [task])
+        except TaskEngineError as error:
+            raise ControlCommandError(str(error))
+        self._hand_over_run_components(task)
+        self.tasks.add(task)
+        self._engine.add_task(task)
+        self._prepare_before_measuring()
+        UserInput.post_status("Control: added {0}task {1}".format(str(task.identifier),
+                                                                  task.generate_one_line_summary()))
 
-        for task in self.tasks:
-            if len(task.identifier) == 1:
-                task.should_do_now = True
-                while task.should_do_now:
-                    if first_temp_file:
-                        main_db.pickle_database("_autosave1")
-                        first_temp_file = False
-                        time.sleep(300)
-                    else:
-                        main_db.pickle_database("_autosave2")
-                        first_temp_file = True
-                        time.sleep(300)
-                task.should_do_now = False
+    def remove_task_while_measuring(self, identifier: []):
+        """Removes a task and its sub_tasks from the running measurement. Tasks that are running are expected to have
+        been asked to skip already, see ControlChannel.remove
 
-        for task in self.tasks:
-            task.should_be_running = False
-            task.join()
-        self.meas_setup.measurement_done()
+        :param identifier: identifier of the task
+        """
+        if self.tasks.get(identifier) is None:
+            raise ControlCommandError("There is no task {0}".format(str(identifier)))
+        for task in self.tasks.remove(identifier):
+            self._engine.remove_task(task)
+        self._prepare_before_measuring()
+        UserInput.post_status("Control: removed task {0} and its sub_tasks".format(str(identifier)))
 
     def _prepare_before_measuring(self):
         # save the current task list in the database. Crucial for later data manipulation
         task_list = []
         for task in self.tasks:
             task_list.append(str(task.identifier) + "task " + task.generate_one_line_summary())
-        main_db.tasks = task_list
+        self.database.tasks = task_list
+        # and everything needed to recreate the tasks, eg to resume the run
+        self.database.task_definitions = [task.to_definition() for task in self.tasks]
+        self.database.measurement_setup_name = self.meas_setup_name
+        self.database.modifications += 1
 
     def remove_task(self):
         """Method to remove a task from the task list
@@ -964,11 +2504,12 @@ class Measurement:
                     "valid_options": one_line_summary_of_tasks}
 
         to_be_removed_index = UserInput.ask_user_for_input(question)["answer"]
+        to_be_removed_identifier = self.tasks[to_be_removed_index].identifier
 
-        sub_tasks = Helper.check_for_sub_tasks(self.tasks[to_be_removed_index].identifier, self.tasks)
+        sub_tasks = Helper.check_for_sub_tasks(to_be_removed_identifier, self.tasks)
 
         if len(sub_tasks) == 0:
-            self.tasks.pop(to_be_removed_index)
+            self.tasks.remove(to_be_removed_identifier)
         else:
             question = {"question_title": "Warning, Sub_tasks detected!",
                         "question_text": "The selected task has sub_tasks. Do you really want to delete it?",
@@ -976,10 +2517,8 @@ class Measurement:
                         "optiontype": "yes_no"}
             user_wants_removal = UserInput.ask_user_for_input(question)["answer"]
             if user_wants_removal:
-                amount_of_subtasks = len(sub_tasks)
-                for index in range(amount_of_subtasks):
-                    self.tasks.pop(to_be_removed_index + 1 + index)
-                self.tasks.pop(to_be_removed_index)
+                # removes the whole sub tree, so no orphaned (sub-)sub_tasks stay behind
+                self.tasks.remove(to_be_removed_identifier)
             else:
                 UserInput.post_status("Didn't remove a thing. Carry on!")
                 
@@ -1012,36 +2551,131 @@ class Measurement:
    
 
 
+class TaskAborted(Exception):
+    """class to indicate that the current run of a task is given up, see Task._call_instrument
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+
+    def __str__(self):
+        return str(self.problem)
+
+
+class TaskDefinitionError(Exception):
+    """class to indicate that a task couldn't be recreated from its definition
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+
+    def __str__(self):
+        return str(self.problem)
+
+
 class Helper:
     """This class bundles static methods helping with general value manipulation and stuff"""
 
     @staticmethod
-    def check_for_sub_tasks(identifier: [], global_task_list: []):
+    def task_from_definition(definition: dict, measurement_setup: MeasurementSetup, task_tree: TaskTree,
+                             database: Database):
+        """Creates a task from what Task.to_definition returned. Controlables and measurables are looked up by their
+        name and the name of their device in the measurement setup. The task isn't added to the task_tree.
+
+        :param definition: dict as returned by Task.to_definition
+        :rtype: Task
+        """
+        identifier = list(definition["identifier"])
+        task_type = definition["type"]
+        if task_type == "Trigger":
+            trigger = dict(definition["trigger"])
+            if isinstance(trigger.get("acquis_triggering_measurable"), dict):
+                trigger["acquis_triggering_measurable"] = Helper.resolve_reference(
+                    trigger["acquis_triggering_measurable"], measurement_setup.get_measurables())
+            task = Trigger(identifier, measurement_setup, trigger, task_tree, database)
+        elif task_type == "DataAcq":
+            measurable = Helper.resolve_reference(definition["measurable"], measurement_setup.get_measurables())
+            task = DataAcquisition(identifier, measurement_setup, measurable, definition["average_through_sub_task"],
+                                   task_tree, definition.get("sample_interval", 5.0),
+                                   definition.get("percentiles", []), database)
+        elif task_type == "ParamContr":
+            controlable = Helper.resolve_reference(definition["controlable"], measurement_setup.get_controlables())
+            trigger = dict(definition["trigger"])
+            if isinstance(trigger.get("acquis_triggering_measurable"), dict):
+                trigger["acquis_triggering_measurable"] = Helper.resolve_reference(
+                    trigger["acquis_triggering_measurable"], measurement_setup.get_measurables())
+            task = ParameterController(identifier, measurement_setup, controlable, trigger, task_tree, database)
+        else:
+            raise TaskDefinitionError("Unknown task type '{0}' for task {1}".format(task_type, str(identifier)))
+        # older definitions don't have these, the task keeps the defaults of its type then
+        task.configure_error_handling(definition.get("error_policy"), definition.get("retries"),
+                                      definition.get("run_timeout"))
+        return task
+
+    @staticmethod
+    def reference_to(controlable_or_measurable: dict):
+        """Turns a controlable or measurable into something that can be stored, see resolve_reference
+
+        :rtype: dict
+        """
+        return {"name": controlable_or_measurable["name"], "dev": controlable_or_measurable["dev"].name}
+
+    @staticmethod
+    def resolve_reference(reference: dict, available: []):
+        """Finds the controlable or measurable a reference made by reference_to points to
+
+        :param reference: {"name": "Sample Sensor", "dev": "Temp_336"}
+        :param available: the controlables or measurables of the measurement setup
+        :rtype: dict
+        """
+        for controlable_or_measurable in available:
+            if controlable_or_measurable["name"] == reference["name"] and \
+                    controlable_or_measurable["dev"].name == reference["dev"]:
+                return controlable_or_measurable
+        raise TaskDefinitionError("'{0}' at device '{1}' isn't available in this measurement setup".format(
+            reference["name"], reference["dev"]))
+
+    @staticmethod
+    def check_for_sub_tasks(identifier: [], task_tree: TaskTree):
         """ This method fills the list of sub_tasks that can then easily be called when running the whole task.
+        The TaskTree stores the direct sub_tasks with every task, so this is a simple lookup.
         """
-        sub_tasks = []
-        own_id = identifier
-        # initialize own position in list (which is really just the index of the item at hand in the global list
-        own_position_in_list = int
-        # ok, we want to find ourselves:
-        for index, item in enumerate(global_task_list):
-            if own_id == item.identifier:
-                own_position_in_list = index
-
-        # now make a copy of the global list, and shorten it so it starts with us. As the global list is sorted, we can
-        # simply check if the next item has a shorter identifier or an identifier of equal length to know whether the
-        # next item is a sub_task or a task on the same level
-        temporary_global_list = global_task_list.copy()
-        temporary_global_list = temporary_global_list[(own_position_in_list + 1):]
-        own_length = len(own_id)
-        for item in temporary_global_list:
-            if len(item.identifier) == own_length + 1:
-                sub_tasks.append(item)
-            elif len(item.identifier) <= own_length:
-                break
+        return task_tree.sub_tasks_of(identifier)
+
+    @staticmethod
+    def devices_of_sub_tree(task: Task, task_tree: TaskTree):
+        """Collects all MeasurementDeviceControllers that a task and all of its (sub-)sub_tasks talk to
+
+        :rtype: set
+        """
+        devices = set(task.used_devices())
+        for sub_task in Helper.check_for_sub_tasks(task.identifier, task_tree):
+            devices |= Helper.devices_of_sub_tree(sub_task, task_tree)
+        return devices
+
+    @staticmethod
+    def group_sub_tasks_by_devices(sub_tasks: [], task_tree: TaskTree):
+        """Groups sibling sub_tasks into batches that can run at the same time. The order of the sub_tasks is kept:
+        a sub_task joins the current batch as long as its sub tree doesn't use any device that is already used by
+        the batch, otherwise a new batch is started. So two sub_tasks sharing eg the ALPHA never run at the same time
+        and a sub_task never overtakes one it shares a device with.
+
+        :param sub_tasks: direct sub_tasks of one task, as returned by check_for_sub_tasks
+        :param task_tree: the TaskTree of the measurement
+        :return: list of batches, every batch being a list of tasks
+        :rtype: [[Task]]
+        """
+        batches = []
+        devices_of_current_batch = set()
+        for task in sub_tasks:
+            devices = Helper.devices_of_sub_tree(task, task_tree)
+            if batches and not (devices & devices_of_current_batch):
+                batches[-1].append(task)
+                devices_of_current_batch |= devices
             else:
-                pass
-        return sub_tasks
+                batches.append([task])
+                devices_of_current_batch = devices
+        return batches
 
     @staticmethod
     def create_valuelist_according_to_distribution(start_value: float, end_value: float, amount_of_values,
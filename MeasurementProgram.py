@@ -7,8 +7,16 @@ import sys, os
 import time
 
 import pickle
+from threading import Thread
+import traceback
+import Checkpoints
+from ControlChannel import ControlChannel
 import DataStorage
+import DryRun
 from MeasurementComponents import Measurement
+import RunQueue
+import TaskEngines
+import TaskTreeFiles
 import UserInput
 
 from _version import __version__
@@ -21,6 +29,10 @@ class MeasurementProgram:
         self.operator = "Tron"
         self.working_directory = "C:\Data\Tron\Run1"
         self.general_info_acquired = False
+        # a task tree file passed on the command line, see TaskTreeFiles
+        self.task_tree_file = None
+        # runs measuring in the background, while the main menu is available for another setup
+        self.background_runs = []  # type: [Thread]
 
     def start(self):
         UserInput.post_status("Welcome to JUMP, Justin's Universal Measurement Program, the savory pill to satisfy your measurement needs!")
@@ -35,6 +47,8 @@ class MeasurementProgram:
                         "optiontype": "multi_choice",
                         "valid_options": ["create a new measurement (eg a sweep or a full-blown measurement)",
                                           "Load a previously generated .JUMP-file and work with the data",
+                                          "resume an interrupted measurement",
+                                          "run a queue of measurements one after another (unattended)",
                                           "exit the program"]}
 
             answer = UserInput.ask_user_for_input(question)["answer"]
@@ -46,6 +60,13 @@ class MeasurementProgram:
             elif answer == 1:
                 self.work_with_db()
             elif answer == 2:
+                self.resume()
+            elif answer == 3:
+                if not self.general_info_acquired:
+                    self._general_info()
+                self.run_queue()
+            elif answer == 4:
+                self._wait_for_background_runs()
                 UserInput.post_status("I say Goodbye and I hope to see you soon!")
                 should_run = False
 
@@ -133,29 +154,35 @@ class MeasurementProgram:
 
         comment = UserInput.ask_user_for_input(question)["answer"]
 
-        # Prepare the database for the run
-        DataStorage.main_db.start_fresh(name_for_run, run_directory, self.operator, self.room, comment,
+        # Every run gets a database of its own, another one may be measuring in the background
+        database = DataStorage.Database(name_for_run, run_directory, self.operator, self.room, comment,
                                         time.strftime("%d.%m.%Y %H:%M:%S"))
-        
-        meas = Measurement()
+
+        meas = Measurement(database=database)
 
         user_wants_something = True
         question = {"question_title": "Choose template",
                     "question_text": "Choose wether you want to start a custom measurement or use a template instead",
-                    "default_answer": "Custom",
+                    "default_answer": 2 if self.task_tree_file else 0,
                     "optiontype": "multi_choice",
-                    "valid_options": ["Custom","S001"]}
+                    "valid_options": ["Custom","S001","Load a task tree file"]}
         
         chosen_template = UserInput.ask_user_for_input(question)["answer"]
         
-        if chosen_template==0:
+        if chosen_template==2:
+            if not self._load_task_tree_file(meas):
+                UserInput.post_status("The measurement wasn't started.")
+                return
+            meas.print_current_task_list()
+        elif chosen_template==0:
             while user_wants_something:
     
                 question = {"question_title": "Task Management",
                             "question_text": "Do you want to add or remove the task or start the measurement?",
                             "default_answer": 0,
                             "optiontype": "multi_choice",
-                            "valid_options": ["+ Add a task", "- remove a task", "|> start the measurement!"]}
+                            "valid_options": ["+ Add a task", "- remove a task", "save the task list to a file",
+                                              "|> start the measurement!"]}
                 user_wants = UserInput.ask_user_for_input(question)["answer"]
     
                 if user_wants == 0:     # User wants to add a task
@@ -165,6 +192,10 @@ class MeasurementProgram:
                 elif user_wants == 1:
                     user_wants_something = True
                     meas.remove_task()
+
+                elif user_wants == 2:
+                    user_wants_something = True
+                    self._save_task_tree_file(meas, run_directory)
     
                 else:
                     user_wants_something = False
@@ -198,10 +229,296 @@ class MeasurementProgram:
             
             
             meas.print_current_task_list()
-    
-        meas.measure()
+
+        engine = self._choose_task_engine(meas.tasks)
+        if not self._dry_run_first(meas, engine):
+            UserInput.post_status("The measurement wasn't started.")
+            return
+
+        checkpoint = Checkpoints.Checkpoint(run_directory, name_for_run, database)
+        control = ControlChannel(os.path.join(run_directory, name_for_run + "_control.txt"))
+        self._measure_run(name_for_run, meas, engine, checkpoint, control)
+
+    def resume(self):
+        """Continues a run that was interrupted (crash, power cut...) from the last point that was finished"""
+        question = {"question_title": "Run directory",
+                    "question_text": "Please enter the path to the folder of the interrupted run (the one containing "
+                                     "the autosaves).",
+                    "default_answer": self.working_directory,
+                    "optiontype": "free_text"}
+        run_directory = UserInput.ask_user_for_input(question)["answer"].replace("\"", "").rstrip(os.sep) + os.sep
+        name_for_run = os.path.basename(os.path.dirname(run_directory))
+
+        if not Checkpoints.Checkpoint.exists(run_directory, name_for_run):
+            UserInput.confirm_warning("There is no checkpoint for a run named '{0}' in {1}. Only runs that were "
+                                      "interrupted can be resumed.".format(name_for_run, run_directory))
+            return
+
+        # the newest autosave is the one to start from, the rest comes from the point journal
+        autosaves = []
+        for suffix in ("_autosave1", "_autosave2"):
+            path = "{0}{1}{2}.JUMP".format(run_directory, name_for_run, suffix)
+            if os.path.isfile(path):
+                autosaves.append(path)
+        if len(autosaves) == 0:
+            UserInput.confirm_warning("Didn't find any autosave of '{0}' in {1}.".format(name_for_run, run_directory))
+            return
+        newest_autosave = max(autosaves, key=os.path.getmtime)
+        with open(newest_autosave, 'rb') as incoming:
+            unpickled_db = pickle.load(incoming)  # type: DataStorage.Database
+        database = DataStorage.Database()
+        database.change_to_passed_db(unpickled_db)
+        database.new_pickle_path(run_directory)
+        if len(database.task_definitions) == 0:
+            UserInput.confirm_warning("The autosave doesn't contain the task definitions, it was made by an older "
+                                      "version. It can't be resumed.")
+            return
+
+        meas = Measurement(database.measurement_setup_name, database=database)
+        for definition in database.task_definitions:
+            meas.add_task_from_definition(definition)
+        meas.print_current_task_list()
+
+        checkpoint = Checkpoints.Checkpoint(run_directory, name_for_run, database)
+        checkpoint.restore(meas.tasks)
+        # From now on, the restored state is the base for the autosaves and a fresh journal
+        database.pickle_database("_autosave1")
+        database.pickle_database("_autosave2")
+
+        control = ControlChannel(os.path.join(run_directory, name_for_run + "_control.txt"))
+        self._measure_run(name_for_run, meas, self._choose_task_engine(meas.tasks), checkpoint, control)
+
+    def _measure_run(self, name_for_run: str, meas: Measurement, engine: TaskEngines.TaskEngine,
+                     checkpoint: Checkpoints.Checkpoint, control: ControlChannel):
+        """Measures right away or, if the user wants to, in the background so another setup can be started meanwhile"""
+        question = {"question_title": "Measure in the background",
+                    "question_text": "Do you want to measure in the background? The main menu stays available, eg to "
+                                     "start a measurement on another setup at the same time.",
+                    "default_answer": False,
+                    "optiontype": "yes_no"}
+        if not UserInput.ask_user_for_input(question)["answer"]:
+            self._finish_run(meas, engine, checkpoint, control)
+            return
+        self._start_in_background(name_for_run, self._finish_run, meas, engine, checkpoint, control)
+
+    @staticmethod
+    def _finish_run(meas: Measurement, engine: TaskEngines.TaskEngine, checkpoint: Checkpoints.Checkpoint,
+                    control: ControlChannel):
+        meas.measure(engine, checkpoint, control)
         # Instruct database to be pickled
-        DataStorage.main_db.measurement_finished()
+        meas.database.measurement_finished()
+        checkpoint.delete_files()
+
+    def _start_in_background(self, name: str, function, *arguments):
+        def run_in_background():
+            try:
+                function(*arguments)
+            except Exception:
+                UserInput.post_status("The background run '{0}' failed:\n{1}".format(name, traceback.format_exc()))
+                return
+            UserInput.post_status("The background run '{0}' is finished.".format(name))
+
+        # not a daemon, the program must not end in the middle of a run
+        run = Thread(target=run_in_background, name="JUMP-run-" + name)
+        self.background_runs.append(run)
+        run.start()
+        UserInput.post_status("'{0}' is measuring in the background.".format(name))
+
+    def _wait_for_background_runs(self):
+        running = [run for run in self.background_runs if run.is_alive()]
+        if running:
+            UserInput.post_status("Waiting for the background runs to finish: {0}".format(
+                ", ".join([run.name[len("JUMP-run-"):] for run in running])))
+        for run in running:
+            run.join()
+
+
+    def run_queue(self):
+        """Measures all runs of a run queue file one after another on the same, once initialized setup. See RunQueue"""
+        question = {"question_title": "Run queue",
+                    "question_text": "Please enter the path to the run queue file (.json).",
+                    "default_answer": self.working_directory + "queue.json",
+                    "optiontype": "free_text"}
+        path = UserInput.ask_user_for_input(question)["answer"].replace("\"", "")
+        try:
+            setup_name, runs = RunQueue.read(path)
+        except RunQueue.RunQueueError as error:
+            UserInput.confirm_warning("The run queue can't be used:\n{0}".format(error))
+            return
+
+        # The setup is initialized once for all runs. Everything it asks (calibration...) is asked now, while somebody
+        # is still around
+        meas_setup = Measurement(setup_name).meas_setup
+        problems = RunQueue.check(runs, meas_setup, self.working_directory)
+        if problems:
+            UserInput.confirm_warning("The run queue can't be started:\n{0}".format("\n".join(problems)))
+            return
+
+        engine = self._choose_task_engine()
+        question = {"question_title": "Start run queue",
+                    "question_text": "Start the {0} runs ({1}) now?".format(
+                        len(runs), ", ".join([run["name"] for run in runs])),
+                    "default_answer": True,
+                    "optiontype": "yes_no"}
+        if not UserInput.ask_user_for_input(question)["answer"]:
+            UserInput.post_status("The run queue wasn't started.")
+            return
+        question = {"question_title": "Measure in the background",
+                    "question_text": "Do you want to run the queue in the background? The main menu stays available, "
+                                     "eg to start a measurement on another setup at the same time.",
+                    "default_answer": False,
+                    "optiontype": "yes_no"}
+        if UserInput.ask_user_for_input(question)["answer"]:
+            self._start_in_background("queue " + os.path.basename(path), self._measure_queue, runs, setup_name,
+                                      meas_setup, engine)
+        else:
+            self._measure_queue(runs, setup_name, meas_setup, engine)
+
+    def _measure_queue(self, runs: [], setup_name: str, meas_setup, engine: TaskEngines.TaskEngine):
+        failed_runs = []
+        for index, run in enumerate(runs):
+            last_run = index == len(runs) - 1
+            UserInput.post_status("Run queue: starting run {0} of {1}, '{2}'".format(index + 1, len(runs), run["name"]))
+            # every run gets a fresh engine of the chosen kind, an engine is shut down at the end of its run
+            run_engine = engine.fresh_copy()
+            try:
+                self._measure_queued_run(run, setup_name, meas_setup, run_engine, last_run)
+            except Exception:
+                # one broken run mustn't cost the rest of the weekend
+                failed_runs.append(run["name"])
+                UserInput.post_status("Run queue: run '{0}' failed, continuing with the next one:\n{1}".format(
+                    run["name"], traceback.format_exc()))
+                if last_run:
+                    # the last run would have finished the setup
+                    meas_setup.measurement_done()
+        if failed_runs:
+            UserInput.confirm_warning("The run queue is done, but these runs failed: {0}. Runs that were "
+                                      "interrupted can be resumed.".format(", ".join(failed_runs)))
+        else:
+            UserInput.post_status("The run queue is done, all {0} runs finished.".format(len(runs)))
+
+    def _measure_queued_run(self, run: dict, setup_name: str, meas_setup, engine: TaskEngines.TaskEngine,
+                            last_run: bool):
+        """Does one run of a run queue like measure() does, but without asking anything"""
+        run_directory = self.working_directory + run["name"] + os.sep
+        database = DataStorage.Database(run["name"], run_directory, self.operator, self.room, run["comment"],
+                                        time.strftime("%d.%m.%Y %H:%M:%S"))
+        meas = Measurement(setup_name, meas_setup, database)
+        TaskTreeFiles.load(run["task_tree"], meas)
+        meas.print_current_task_list()
+
+        checkpoint = Checkpoints.Checkpoint(run_directory, run["name"], database)
+        control = ControlChannel(os.path.join(run_directory, run["name"] + "_control.txt"))
+        # the devices stay as they are until the last run is done
+        meas.measure(engine, checkpoint, control, finish_setup=last_run)
+        database.measurement_finished()
+        checkpoint.delete_files()
+
+    def _load_task_tree_file(self, meas: Measurement):
+        """Asks for a task tree file and adds its tasks to the measurement
+
+        :return: True if the tasks were added
+        :rtype: bool
+        """
+        question = {"question_title": "Task tree file",
+                    "question_text": "Please enter the path to the task tree file (.json).",
+                    "default_answer": self.task_tree_file or self.working_directory + "tasks.json",
+                    "optiontype": "free_text"}
+        path = UserInput.ask_user_for_input(question)["answer"].replace("\"", "")
+        try:
+            TaskTreeFiles.load(path, meas)
+        except TaskTreeFiles.TaskTreeFileError as error:
+            UserInput.confirm_warning("The task tree file can't be used:\n{0}".format(error))
+            return False
+        return True
+
+    @staticmethod
+    def _save_task_tree_file(meas: Measurement, run_directory: str):
+        question = {"question_title": "Task tree file",
+                    "question_text": "Where should the task list be saved to?",
+                    "default_answer": os.path.join(run_directory, "tasks.json"),
+                    "optiontype": "free_text"}
+        path = UserInput.ask_user_for_input(question)["answer"].replace("\"", "")
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        TaskTreeFiles.save(path, meas)
+        UserInput.post_status("Saved the task list to {0}".format(path))
+
+    @staticmethod
+    def _choose_task_engine(tasks: [] = None):
+        """Asks the user how the task list should be executed. Both engines produce the same data, the pooled one
+        just needs a lot less threads for big task lists
+
+        :param tasks: the task list, if it's known already the engine is checked against it and asked again if it
+        can't execute it
+        :rtype: TaskEngines.TaskEngine
+        """
+        while True:
+            engine = MeasurementProgram._ask_for_task_engine()
+            if tasks is None:
+                return engine
+            try:
+                engine.check(list(tasks))
+                return engine
+            except TaskEngines.TaskEngineError as error:
+                UserInput.confirm_warning(str(error))
+
+    @staticmethod
+    def _ask_for_task_engine():
+        """
+        :rtype: TaskEngines.TaskEngine
+        """
+        valid_options = []
+        for engine_class in TaskEngines.available_engines:
+            valid_options.append(engine_class.name)
+        question = {"question_title": "Execution engine",
+                    "question_text": "How should the task list be executed?",
+                    "default_answer": 0,
+                    "optiontype": "multi_choice",
+                    "valid_options": valid_options}
+        engine_class = TaskEngines.available_engines[UserInput.ask_user_for_input(question)["answer"]]
+        question = {"question_title": "Parallel sub_tasks",
+                    "question_text": "Should sub_tasks of the same task run at the same time if they use different "
+                                     "devices (eg a DataAcq on the temperature controller next to a frequency sweep)? "
+                                     "Sub_tasks sharing a device still run one after another.",
+                    "default_answer": False,
+                    "optiontype": "yes_no"}
+        parallel_sub_tasks = UserInput.ask_user_for_input(question)["answer"]
+        if engine_class is not TaskEngines.PooledTaskEngine:
+            return engine_class(parallel_sub_tasks=parallel_sub_tasks)
+        question = {"question_title": "Worker threads",
+                    "question_text": "How many worker threads may the pool have at most? A task list that could have "
+                                     "more tasks running at the same time can't be measured with it.",
+                    "default_answer": TaskEngines.PooledTaskEngine.default_max_workers,
+                    "optiontype": "free_choice",
+                    "valid_options_lower_limit": 1,
+                    "valid_options_upper_limit": 1e4,
+                    "valid_options_steplength": 1}
+        max_workers = int(UserInput.ask_user_for_input(question)["answer"])
+        return engine_class(parallel_sub_tasks=parallel_sub_tasks, max_workers=max_workers)
+
+    @staticmethod
+    def _dry_run_first(meas: Measurement, engine: TaskEngines.TaskEngine):
+        """Offers to run the task list in virtual time first to see how long it will take
+
+        :return: whether the real measurement should be started
+        :rtype: bool
+        """
+        question = {"question_title": "Dry run",
+                    "question_text": "Do you want to simulate the task list first? It runs in virtual time without "
+                                     "talking to the devices and estimates how long the measurement takes.",
+                    "default_answer": False,
+                    "optiontype": "yes_no"}
+        if not UserInput.ask_user_for_input(question)["answer"]:
+            return True
+        UserInput.post_status("Simulating the task list...")
+        DryRun.post_report(DryRun.dry_run(meas, engine.parallel_sub_tasks))
+        question = {"question_title": "Start measurement",
+                    "question_text": "Start the real measurement now?",
+                    "default_answer": True,
+                    "optiontype": "yes_no"}
+        return UserInput.ask_user_for_input(question)["answer"]
 
 
 def version():
@@ -213,4 +530,8 @@ def version():
 if "version" in sys.argv:
     version()
 MP = MeasurementProgram()
+# eg "python MeasurementProgram.py C:\Data\tasks.json" offers that task tree file for the new measurement
+for argument in sys.argv[1:]:
+    if argument.lower().endswith(".json"):
+        MP.task_tree_file = argument
 MP.start()
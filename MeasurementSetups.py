@@ -3,8 +3,10 @@ __copyright__ = "Copyright 2015 - 2017, Justin Scholz"
 __author__ = "Justin Scholz"
 
 from abc import ABCMeta, abstractmethod
-from MeasurementHardware import MeasurementDeviceController
-import visa
+from threading import Lock
+
+from Clocks import RealClock
+from MeasurementHardware import MeasurementDeviceController, shared_resource_manager
 import UserInput
 
 
@@ -15,11 +17,15 @@ class MeasurementSetup(metaclass=ABCMeta):
     # for this, we have a setup thingy.
 
     def __init__(self):
-        self.dev_resource_manager = visa.ResourceManager()
+        # one resource manager for all setups, several of them may be measuring at the same time
+        self.dev_resource_manager = shared_resource_manager()
         self.list_of_setups = []
         self.setup = None
         self.controlables = []
         self.measurables = []
+        # the latest reading of every measurable, see read_measurable
+        self._latest_readings = {}
+        self._latest_readings_lock = Lock()
 
     @abstractmethod
     def list_available_setups(self):
@@ -60,6 +66,62 @@ class MeasurementSetup(metaclass=ABCMeta):
         """
         return
 
+    def read_measurable(self, measurable: dict, max_age=0.0, clock=RealClock):
+        """Measures the measurable like measure_measurable, but remembers the reading. If another task read the same
+        measurable less than max_age seconds ago, that reading is returned instead of asking the device again. This way
+        eg a Trigger polling the sample temperature doesn't double the traffic on a temperature controller that a
+        DataAcq reads anyway. Only one task at a time measures a specific measurable, the others wait for its reading.
+
+        :param measurable: the measurable dict of the setup
+        :param max_age: in seconds. 0 always measures, but the reading is still available for others
+        :param clock: the clock of the calling task (see Task.clock), the age of a reading is told by it
+        :return: the datapoint, for a cached reading a copy of it
+        :rtype: dict
+        """
+        key = (id(measurable["dev"]), measurable["name"])
+        with self._latest_readings_lock:
+            if key not in self._latest_readings:
+                self._latest_readings[key] = {"lock": Lock(), "time": None, "datapoint": None}
+            reading = self._latest_readings[key]
+        with reading["lock"]:
+            if max_age > 0 and reading["time"] is not None and clock.perf_counter() - reading["time"] <= max_age:
+                return reading["datapoint"].copy()
+            datapoint = self.measure_measurable(measurable)
+            reading["time"] = clock.perf_counter()
+            reading["datapoint"] = datapoint.copy()
+        return datapoint
+
+    def sweep_points(self, controlable: dict, measurable: dict):
+        """
+        :return: for how many values of the controlable the measurable can be measured in one go by sweep_measurable,
+        0 if it can't. Only a device that has both can sweep
+        :rtype: int
+        """
+        if controlable["dev"] is not measurable["dev"]:
+            return 0
+        return controlable["dev"].sweep_points(controlable["name"], measurable["name"])
+
+    def sweep_measurable(self, controlable: dict, values: [], measurable: dict):
+        """Sets the controlable to every value and measures the measurable there, in one go on the device. At most
+        sweep_points values
+
+        :return: [(the datapoint of change_value_of_controlable_to, the datapoint of measure_measurable)] per value, only
+        for the leading values if the device stopped early (see MeasurementDevice.sweep)
+        :raises SweepInterrupted: with the points measured before the device failed
+        """
+        return controlable["dev"].sweep(controlable["name"], values, measurable["name"])
+
+    def devices(self):
+        """
+        :return: all MeasurementDeviceControllers the controlables and measurables of this setup belong to
+        :rtype: [MeasurementDeviceController]
+        """
+        devices = []
+        for item in self.controlables + self.measurables:
+            if not any([item["dev"] is device for device in devices]):
+                devices.append(item["dev"])
+        return devices
+
     @abstractmethod
     def _add_measurement_device_controllers(self):
         return
@@ -94,15 +156,14 @@ class GLaDOS(MeasurementSetup):
         {"startTemp": 100, "old_PID": {"old_P": 20, "old_I": 30, "old_D": 0}, "old_HR": 3, "old_HO": 1},
         {"startTemp": 475, "old_PID": {"old_P": 30, "old_I": 20, "old_D": 10}, "old_HR": 3, "old_HO": 1}]
 
-    # If you want to support more than 2 measurement devices at this setup, make sure to make this a list etc.
-
-    mdc_for_temp_controller = None  # type: MeasurementDeviceController
-    mdc_for_meas_device = None  # type: MeasurementDeviceController
-
     heater_output = ""
 
     def __init__(self):
         super().__init__()
+        # If you want to support more than 2 measurement devices at this setup, make sure to make this a list etc.
+        # They belong to the instance, another GLaDOS object must not pick up these devices
+        self.mdc_for_temp_controller = None  # type: MeasurementDeviceController
+        self.mdc_for_meas_device = None  # type: MeasurementDeviceController
         self.current_PID = {}
         self.current_old_PID = {}
 
@@ -266,12 +327,12 @@ class Quatro(MeasurementSetup):
 
     current_start_temp = 0
 
-    mdc_for_temp_controller = None  # type: MeasurementDeviceController
-    mdc_for_meas_device = None  # type: MeasurementDeviceController
-
-    Quatro_should_turn_off_after_measurement = True  # Initializes the value that is important for when the measurement
-
-    # is finished.
+    def __init__(self):
+        super().__init__()
+        self.mdc_for_temp_controller = None  # type: MeasurementDeviceController
+        self.mdc_for_meas_device = None  # type: MeasurementDeviceController
+        # Initializes the value that is important for when the measurement is finished.
+        self.Quatro_should_turn_off_after_measurement = True
 
     def init_after_creation(self):
         self._add_measurement_device_controllers()
@@ -361,8 +422,10 @@ class DUMMY(MeasurementSetup):
 
     current_start_temp = 0
 
-    mdc_for_temp_controller = None
-    mdc_for_meas_device = None
+    def __init__(self):
+        super().__init__()
+        self.mdc_for_temp_controller = None
+        self.mdc_for_meas_device = None
 
     def measurement_done(self):
         pass
@@ -401,11 +464,13 @@ class DUMMY(MeasurementSetup):
 class Generic(MeasurementSetup):
     name_Generic = "Generic"
 
-    mdc1 = None  # type: MeasurementDeviceController
-    mdc2 = None  # type: MeasurementDeviceController
-    mdc3 = None  # type: MeasurementDeviceController
-    mdc4 = None  # type: MeasurementDeviceController
-    mdc5 = None  # type: MeasurementDeviceController
+    def __init__(self):
+        super().__init__()
+        self.mdc1 = None  # type: MeasurementDeviceController
+        self.mdc2 = None  # type: MeasurementDeviceController
+        self.mdc3 = None  # type: MeasurementDeviceController
+        self.mdc4 = None  # type: MeasurementDeviceController
+        self.mdc5 = None  # type: MeasurementDeviceController
 
     def measurement_done(self):
         pass
@@ -0,0 +1,93 @@
+"""A run queue lets the setup measure run after run without anybody answering prompts in between, eg over the weekend.
+The queue is a json file naming the measurement setup and the runs, every run with its own task tree file (see
+TaskTreeFiles):
+
+{"measurement_setup": "TKKG : Transportlaborkaltkopf GLaDOS (GLaDOS)",
+ "runs": [{"name": "Sample1_cooling", "comment": "first cool down", "task_tree": "cooling.json"},
+          {"name": "Sample1_heating", "task_tree": "C:\\Data\\Tron\\heating.json"}]}
+
+Relative paths are relative to the queue file. The setup is initialized once (all questions about calibration etc. are
+asked right at the start) and then used by all runs, the devices stay open in between. Every run gets its own run
+directory and database in the working directory, just like a single measurement. The whole queue is checked before the
+first run starts, so a typo in the last task tree doesn't show up on Sunday morning."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import json
+import os
+
+import TaskTreeFiles
+
+
+class RunQueueError(Exception):
+    """class to indicate that a run queue file can't be used. It holds all problems that were found
+    """
+
+    def __init__(self, problems: []):
+        self.problems = problems
+
+    def __str__(self):
+        return "\n".join(self.problems)
+
+
+def read(path: str):
+    """Reads a run queue file
+
+    :return: the name of the measurement setup, the runs as [{"name", "comment", "task_tree": absolute path}]
+    :rtype: (str, [dict])
+    """
+    try:
+        with open(path, "r") as queue_file:
+            content = json.load(queue_file)
+    except OSError as error:
+        raise RunQueueError(["Couldn't read {0}: {1}".format(path, error)])
+    except ValueError as error:
+        raise RunQueueError(["{0} isn't valid json: {1}".format(path, error)])
+    if not isinstance(content, dict) or not isinstance(content.get("runs"), list) or len(content["runs"]) == 0:
+        raise RunQueueError(["{0} needs a non-empty list of \"runs\"".format(path)])
+    if not isinstance(content.get("measurement_setup"), str):
+        raise RunQueueError(["{0} has to name the \"measurement_setup\" all runs are done with".format(path)])
+
+    problems = []
+    runs = []
+    names = set()
+    queue_directory = os.path.dirname(os.path.abspath(path))
+    for index, run in enumerate(content["runs"]):
+        location = "runs[{0}]".format(index)
+        if not isinstance(run, dict) or not isinstance(run.get("name"), str) or not run["name"]:
+            problems.append("{0}: every run needs a \"name\"".format(location))
+            continue
+        if not isinstance(run.get("task_tree"), str):
+            problems.append("{0} ({1}): every run needs a \"task_tree\" file".format(location, run["name"]))
+            continue
+        if run["name"] in names:
+            problems.append("{0}: there already is a run named '{1}'".format(location, run["name"]))
+        names.add(run["name"])
+        runs.append({"name": run["name"], "comment": str(run.get("comment", "I fight for the User!")),
+                     "task_tree": os.path.join(queue_directory, run["task_tree"])})
+    if problems:
+        raise RunQueueError(problems)
+    return content["measurement_setup"], runs
+
+
+def check(runs: [], measurement_setup, working_directory: str):
+    """Checks the task trees of all runs against the initialized setup and makes sure no run overwrites an old one
+
+    :param runs: as returned by read
+    :param measurement_setup: the initialized MeasurementSetups.MeasurementSetup
+    :return: all problems found, empty if the queue can be run
+    :rtype: [str]
+    """
+    problems = []
+    for run in runs:
+        if os.path.isfile(os.path.join(working_directory, run["name"], run["name"] + ".JUMP")):
+            problems.append("{0}: there already is a finished run with that name in {1}".format(run["name"],
+                                                                                                 working_directory))
+        try:
+            setup_name, definitions = TaskTreeFiles.read_definitions(run["task_tree"])
+        except TaskTreeFiles.TaskTreeFileError as error:
+            problems += ["{0}: {1}".format(run["name"], problem) for problem in error.problems]
+            continue
+        problems += ["{0}: {1}".format(run["name"], problem)
+                     for problem in TaskTreeFiles.check_definitions(definitions, measurement_setup)]
+    return problems
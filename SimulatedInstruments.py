@@ -0,0 +1,493 @@
+"""Simulated instruments, so JUMP can run (eg for benchmarks and regression tests) on a machine without any hardware.
+The SimulatedResourceManager stands in for the VISA resource manager: it lists a bus with an ALPHA, a Temp_336, a
+Quatro, an Agilent 4980A, an Agilent 3458A and a Keysight MSO-X 3014T, and its resources understand the commands
+MeasurementHardware sends them. All of them are connected to the same SimulatedBench: a sample (an RC element with a
+thermally activated resistance) mounted on a thermal mass, which the temperature controllers heat to their setpoint.
+
+Simulation is switched on by starting JUMP with "simulate" as an argument (python MeasurementProgram.py simulate) or by
+setting the environment variable JUMP_SIMULATE=1. The environment variables JUMP_SIMULATE_LATENCY (seconds per VISA
+call), JUMP_SIMULATE_NOISE (relative standard deviation of the measured values), JUMP_SIMULATE_TIME_SCALE (simulated
+seconds per real second, eg 100 to let a 1 mHz point and the temperature steps go by 100 times faster) and
+JUMP_SIMULATE_SEED (to get the same noise in every run) tune it."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import cmath
+import math
+import os
+import random
+import sys
+import time
+from threading import Lock
+
+import visa
+from pyvisa import constants
+
+enabled = "simulate" in sys.argv or os.environ.get("JUMP_SIMULATE", "") not in ("", "0")
+
+# What the simulated instruments answer to *IDN? (or ID?). In simulation, the device classes recognize these instead of
+# the ones in their serial files, see MeasurementHardware.importer
+idns = {"ALPHA": "NOVOCONTROL ALPHA-AN SIMULATED",
+        "Temp_336": "LSCI,MODEL336,SIMULATED,1.0",
+        "Quatro": "NOVOCONTROL QUATRO SIMULATED",
+        "Agilent4980A": "Agilent Technologies,E4980A,SIMULATED,A.02.10",
+        "Agilent3458A": "HP3458A SIMULATED",
+        "Keysight_MSO_X_3014T": "KEYSIGHT TECHNOLOGIES,MSO-X 3014T,SIMULATED,07.20"}
+
+
+class SimulationSettings:
+    """Tuning knobs of the simulation, they can be changed by the environment variables (see the module docstring) or
+    directly, before the SimulatedResourceManager is created"""
+    latency = 0.002  # seconds every write and read takes, like a GPIB transfer
+    noise = 1e-3  # relative standard deviation of every measured value
+    temperature_noise = 0.005  # standard deviation of a temperature reading in K
+    time_scale = 1.0  # simulated seconds per real second
+    seed = None  # for the random numbers, None is different in every run
+
+
+def _configure_from_environment():
+    for setting, environment_variable, converter in [("latency", "JUMP_SIMULATE_LATENCY", float),
+                                                     ("noise", "JUMP_SIMULATE_NOISE", float),
+                                                     ("time_scale", "JUMP_SIMULATE_TIME_SCALE", float),
+                                                     ("seed", "JUMP_SIMULATE_SEED", int)]:
+        if environment_variable in os.environ:
+            setattr(SimulationSettings, setting, converter(os.environ[environment_variable]))
+
+
+_configure_from_environment()
+
+
+class SimulatedBench:
+    """The physics behind all simulated instruments: a thermal mass that relaxes towards the setpoint of whichever
+    temperature controller heats it (or towards the room temperature if none does) and an RC sample on it, whose
+    resistance follows an Arrhenius law"""
+
+    room_temperature = 293.15  # K
+    thermal_time_constant = 120.0  # simulated seconds until 63 % of a temperature step are done
+    sample_resistance = 1e7  # Ohm at the room temperature
+    sample_capacitance = 100e-12  # F
+    activation_energy = 0.3  # eV
+    boltzmann_constant = 8.617333e-5  # eV/K
+
+    def __init__(self, settings=SimulationSettings):
+        self.settings = settings
+        self.random = random.Random(settings.seed)
+        self.temperature = self.room_temperature
+        self.setpoint = None  # K, None when no heater is on
+        self._last_update = time.perf_counter()
+        self._lock = Lock()
+
+    def simulated_seconds(self, real_seconds: float):
+        return real_seconds * self.settings.time_scale
+
+    def real_seconds(self, simulated_seconds: float):
+        return simulated_seconds / self.settings.time_scale
+
+    def _update(self):
+        now = time.perf_counter()
+        elapsed = self.simulated_seconds(now - self._last_update)
+        self._last_update = now
+        target = self.room_temperature if self.setpoint is None else self.setpoint
+        self.temperature = target + (self.temperature - target) * math.exp(-elapsed / self.thermal_time_constant)
+
+    def heat_to(self, setpoint):
+        """
+        :param setpoint: in K, None switches the heater off
+        """
+        with self._lock:
+            self._update()
+            self.setpoint = setpoint
+
+    def read_temperature(self, offset=0.0):
+        """
+        :param offset: in K, a sensor that isn't exactly at the sample
+        """
+        with self._lock:
+            self._update()
+            return self.temperature + offset + self.random.gauss(0, self.settings.temperature_noise)
+
+    def noisy(self, value: float):
+        with self._lock:
+            return value * (1 + self.random.gauss(0, self.settings.noise))
+
+    def sample_impedance(self, frequency: float):
+        """
+        :return: the complex impedance of the sample at the current temperature, with noise
+        :rtype: complex
+        """
+        with self._lock:
+            self._update()
+            resistance = self.sample_resistance * math.exp(
+                self.activation_energy / self.boltzmann_constant * (1 / self.temperature - 1 / self.room_temperature))
+        omega = 2 * math.pi * frequency
+        impedance = resistance / complex(1, omega * resistance * self.sample_capacitance)
+        return complex(self.noisy(impedance.real), self.noisy(impedance.imag))
+
+    def sample_dc_resistance(self):
+        return self.sample_impedance(0.0).real
+
+
+class SimulatedDevice:
+    """Base of the instruments: every command written produces an answer (or none) that can be read once it's ready.
+    Subclasses implement handle(command)"""
+
+    idn_key = None
+    termination = "\n"
+
+    def __init__(self, bench: SimulatedBench):
+        self.bench = bench
+        self.idn = idns[self.idn_key]
+        self.srq_at = None  # when the service request of the running operation is raised, in perf_counter seconds
+        self.answer_ready_at = None  # when the answer of the last command can be read, None if right away
+
+    def handle(self, command: str):
+        """
+        :return: the answer, without termination. None if the device doesn't answer
+        :rtype: str
+        """
+        if command == "*IDN?":
+            return self.idn
+        return None
+
+    def busy_for(self, simulated_seconds: float):
+        """An operation that raises a service request when it's done
+        :return: when it's done, in perf_counter seconds
+        """
+        self.srq_at = time.perf_counter() + self.bench.real_seconds(simulated_seconds)
+        return self.srq_at
+
+
+class SimulatedALPHA(SimulatedDevice):
+    """Novocontrol ALPHA analyzer: every command is answered, settings with OK and measurements via the SRQ"""
+
+    idn_key = "ALPHA"
+    termination = "\r\n"
+    calibration_time = 5.0  # simulated seconds of a ZRUNCAL
+
+    def __init__(self, bench: SimulatedBench):
+        super().__init__(bench)
+        self.frequency = 1e3
+        self.minimum_measurement_time = 0.5
+        self.result = "ZRE=0.0 0.0 0.0 0 0"
+        self.measurement_done_at = None
+
+    def handle(self, command: str):
+        if command == "*RST":
+            self.__init__(self.bench)
+            return None
+        if command == "*IDN?":
+            return self.idn
+        if command == "MST":
+            impedance = self.bench.sample_impedance(self.frequency)
+            self.result = "ZRE={0:E} {1:E} {2:E} 2 0".format(impedance.real, impedance.imag, self.frequency)
+            self.measurement_done_at = self.busy_for(max(self.minimum_measurement_time, 2 / self.frequency))
+            return None
+        if command == "ZRE?":
+            if self.measurement_done_at is not None and time.perf_counter() < self.measurement_done_at:
+                return "ZRE=0.0 0.0 0.0 1 0"
+            return self.result
+        if command == "GFR?":
+            return "GFR={0:E}".format(self.frequency)
+        if command == "ZCON_TO_CHECK?":
+            return "ZCON_TO_CHECK=0"
+        if "=" not in command:
+            return "UC"
+        name, value = command.split("=", 1)
+        try:
+            if name == "GFR":
+                self.frequency = min(max(float(value), 3e-6), 20e6)
+            elif name == "MTM":
+                self.minimum_measurement_time = float(value)
+        except ValueError:
+            return "IP"
+        if name == "ZRUNCAL" and not value.endswith("_INIT"):
+            # a calibration or connection check, the OK is there when the SRQ is
+            self.answer_ready_at = self.busy_for(self.calibration_time)
+        return "OK"
+
+
+class SimulatedTemp336(SimulatedDevice):
+    """LakeShore 336: heats the bench to the setpoint of an output whose heater range isn't off"""
+
+    idn_key = "Temp_336"
+    termination = "\r\n"
+    # the control sensor sits at the heater, the others a little away from it
+    sensor_offsets = {"A": 0.0, "B": 0.15, "C": 0.3, "D": 0.5}
+
+    def __init__(self, bench: SimulatedBench):
+        super().__init__(bench)
+        self.setpoints = {}
+        self.heater_ranges = {}
+
+    def handle(self, command: str):
+        upper_command = command.upper()
+        if upper_command.startswith("KRDG?"):
+            sensor = upper_command[5:].strip() or "A"
+            return "{0:+.3f}".format(self.bench.read_temperature(self.sensor_offsets.get(sensor, 0.0)))
+        if upper_command.startswith("SETP "):
+            output, setpoint = upper_command[5:].split(",")
+            self.setpoints[output.strip()] = float(setpoint)
+        elif upper_command.startswith("RANGE "):
+            output, heater_range = upper_command[6:].split(",")
+            self.heater_ranges[output.strip()] = int(heater_range)
+        elif upper_command.startswith("SETP?"):
+            return "{0:+.3f}".format(self.setpoints.get(upper_command[5:].strip() or "1", 0.0))
+        else:
+            # ramp, PID etc. don't change the simulation
+            return super().handle(command)
+        heating = [self.setpoints[output] for output in self.setpoints if self.heater_ranges.get(output, 0) > 0]
+        self.bench.heat_to(heating[0] if heating else None)
+        return None
+
+
+class SimulatedQuatro(SimulatedDevice):
+    """Novocontrol Quatro cryosystem, which talks in Celsius"""
+
+    idn_key = "Quatro"
+    termination = "\x00\r"
+
+    def handle(self, command: str):
+        if command == "QPVCT?":
+            return "PVCT={0:.2f}".format(self.bench.read_temperature() - 273.15)
+        if command.startswith("QSPT="):
+            self.bench.heat_to(float(command[5:]) + 273.15)
+        elif command in ("QSHD=0", "QSHG=0"):
+            self.bench.heat_to(None)
+        else:
+            return super().handle(command)
+        return None
+
+
+class SimulatedAgilent4980A(SimulatedDevice):
+    """Agilent E4980A LCR meter, triggered by the bus and read out with FETC?. While the list sweep page is displayed,
+    a trigger measures all frequencies of the list table"""
+
+    idn_key = "Agilent4980A"
+    # seconds per measurement for the integration times of APER, at 1 kHz
+    aperture_times = {"SHORT": 0.0056, "MED": 0.088, "LONG": 0.22}
+    list_sweep_points = 201
+
+    def __init__(self, bench: SimulatedBench):
+        super().__init__(bench)
+        self.frequency = 1e3
+        self.function = "CPD"
+        self.aperture = "MED"
+        self.averaged = 1
+        self.result = None
+        self.result_ready_at = None
+        self.page = "MEAS"
+        self.list_frequencies = []
+
+    def handle(self, command: str):
+        upper_command = command.upper()
+        if upper_command == "*RST":
+            self.__init__(self.bench)
+        elif upper_command.startswith(":DISP:PAGE "):
+            self.page = upper_command.split()[-1]
+        elif upper_command.startswith(":LIST:FREQ?"):
+            return ",".join(["{0:+.6E}".format(frequency) for frequency in self.list_frequencies])
+        elif upper_command.startswith(":LIST:FREQ "):
+            frequencies = [min(max(float(value), 20.0), 2e6) for value in upper_command[11:].split(",")]
+            # a list that is too long is refused, the old one stays
+            if len(frequencies) <= self.list_sweep_points:
+                self.list_frequencies = frequencies
+        elif upper_command.startswith("FREQ?"):
+            return "{0:+.6E}".format(self.frequency)
+        elif upper_command.startswith("FREQ "):
+            self.frequency = min(max(float(upper_command[5:].split()[0]), 20.0), 2e6)
+        elif upper_command.startswith(":FUNC:IMP ") or upper_command.startswith("FUNC:IMP "):
+            self.function = upper_command.split()[-1]
+        elif upper_command.startswith("APER "):
+            aperture, averaged = upper_command[5:].split(",")
+            self.aperture = aperture.strip()
+            self.averaged = int(float(averaged))
+        elif upper_command.startswith("FETC?"):
+            self.answer_ready_at = self.result_ready_at
+            return self.result
+        else:
+            return super().handle(command)
+        return None
+
+    def trigger(self):
+        if self.page == "LIST" and self.list_frequencies:
+            # sequential list sweep: every frequency is measured once, the results come with a comparator result each
+            measurement_time = 0.0
+            results = []
+            for frequency in self.list_frequencies:
+                measurement_time += self._measurement_time(frequency)
+                first, second = self._components(self.bench.sample_impedance(frequency), frequency)
+                results.append("{0:+.9E},{1:+.9E},+0,+0".format(first, second))
+            self.result = ",".join(results)
+        else:
+            measurement_time = self._measurement_time(self.frequency)
+            first, second = self._components(self.bench.sample_impedance(self.frequency), self.frequency)
+            self.result = "{0:+.9E},{1:+.9E},+0".format(first, second)
+        self.result_ready_at = self.busy_for(measurement_time)
+
+    def _measurement_time(self, frequency: float):
+        return self.aperture_times.get(self.aperture, 0.088) * self.averaged + 1 / frequency
+
+    def _components(self, impedance: complex, frequency: float):
+        """
+        :return: the two values of the measurement function, eg Cp and D for CPD
+        """
+        omega = 2 * math.pi * frequency
+        admittance = 1 / impedance
+        resistance, reactance = impedance.real, impedance.imag
+        conductance, susceptance = admittance.real, admittance.imag
+        components = {"CP": susceptance / omega, "CS": -1 / (omega * reactance),
+                      "LP": -1 / (omega * susceptance), "LS": reactance / omega,
+                      "D": resistance / abs(reactance), "Q": abs(reactance) / resistance,
+                      "G": conductance, "RP": 1 / conductance, "RS": resistance}
+        function = self.function
+        if function in ("RX", "GB"):
+            return (resistance, reactance) if function == "RX" else (conductance, susceptance)
+        if function in ("ZTD", "ZTR"):
+            phase = cmath.phase(impedance)
+            return abs(impedance), math.degrees(phase) if function == "ZTD" else phase
+        if function in ("YTD", "YTR"):
+            phase = cmath.phase(admittance)
+            return abs(admittance), math.degrees(phase) if function == "YTD" else phase
+        first, second = function[:2], function[2:]
+        return components[first], components[second]
+
+
+class SimulatedAgilent3458A(SimulatedDevice):
+    """Agilent/HP 3458A multimeter: it doesn't know *IDN?, only ID?"""
+
+    idn_key = "Agilent3458A"
+
+    def handle(self, command: str):
+        upper_command = command.upper()
+        if upper_command == "ID?":
+            return self.idn
+        if upper_command == "OHMF?":
+            return "{0:E}".format(self.bench.sample_dc_resistance())
+        return None
+
+
+class SimulatedMSO(SimulatedDevice):
+    """Keysight MSO-X 3014T: channel 1 sees a 1 kHz source, channel 2 the shunt in series with the sample"""
+
+    idn_key = "Keysight_MSO_X_3014T"
+    source_amplitude = 1.0  # V
+    source_frequency = 1e3  # Hz
+    shunt_resistance = 1e3  # Ohm
+
+    def handle(self, command: str):
+        upper_command = command.upper()
+        if upper_command == ":MEAS:VMAX? CHAN1":
+            return "{0:E}".format(self.bench.noisy(self.source_amplitude))
+        if upper_command == ":MEAS:VMAX? CHAN2":
+            impedance = self.bench.sample_impedance(self.source_frequency)
+            return "{0:E}".format(self.source_amplitude * self.shunt_resistance /
+                                  abs(impedance + self.shunt_resistance))
+        return super().handle(command)
+
+
+class SimulatedResource:
+    """Stands in for a pyvisa message based resource"""
+
+    def __init__(self, resource_name: str, device: SimulatedDevice, settings=SimulationSettings):
+        self.resource_name = resource_name
+        self.device = device
+        self.settings = settings
+        self.timeout = 2000  # ms, like pyvisa
+        self._answer = None
+        self._answer_ready_at = None
+
+    def _transfer(self):
+        if self.settings.latency > 0:
+            time.sleep(self.settings.latency)
+
+    def write(self, message: str):
+        self._transfer()
+        # a new command discards an answer that wasn't read
+        self.device.answer_ready_at = None
+        self._answer = self.device.handle(message.strip())
+        self._answer_ready_at = self.device.answer_ready_at
+        return len(message)
+
+    def read(self):
+        self._transfer()
+        if self._answer_ready_at is not None:
+            waiting = self._answer_ready_at - time.perf_counter()
+            if self.timeout is not None and waiting > self.timeout / 1000:
+                time.sleep(self.timeout / 1000)
+                raise visa.VisaIOError(constants.VI_ERROR_TMO)
+            if waiting > 0:
+                time.sleep(waiting)
+        if self._answer is None:
+            # nothing to say, the read times out like with a real device
+            time.sleep(self.timeout / 1000 if self.timeout is not None else 0)
+            raise visa.VisaIOError(constants.VI_ERROR_TMO)
+        answer = self._answer + self.device.termination
+        self._answer = None
+        return answer
+
+    def query(self, message: str, delay=None):
+        self.write(message)
+        return self.read()
+
+    def query_ascii_values(self, message: str, converter="f", separator=",", container=list, delay=None):
+        answer = self.query(message, delay).strip("\r\n\x00 ")
+        return container(float(value) for value in answer.split(separator))
+
+    def assert_trigger(self):
+        self._transfer()
+        if hasattr(self.device, "trigger"):
+            self.device.trigger()
+
+    def wait_for_srq(self, timeout=25000):
+        """
+        :param timeout: in ms, None waits forever
+        """
+        srq_at = self.device.srq_at
+        waiting = float("inf") if srq_at is None else srq_at - time.perf_counter()
+        if timeout is not None and waiting > timeout / 1000:
+            time.sleep(timeout / 1000)
+            raise visa.VisaIOError(constants.VI_ERROR_TMO)
+        if waiting == float("inf"):
+            raise visa.VisaIOError(constants.VI_ERROR_TMO)
+        if waiting > 0:
+            time.sleep(waiting)
+        self.device.srq_at = None
+
+    def clear(self):
+        self._answer = None
+        self._answer_ready_at = None
+
+    def close(self):
+        pass
+
+
+class SimulatedResourceManager:
+    """Stands in for the visa.ResourceManager, with one of each supported instrument on the bus"""
+
+    # resource name: the class simulating the instrument there
+    bus = {"GPIB0::6::INSTR": SimulatedALPHA,
+           "GPIB0::12::INSTR": SimulatedTemp336,
+           "GPIB0::17::INSTR": SimulatedAgilent4980A,
+           "GPIB0::22::INSTR": SimulatedAgilent3458A,
+           "ASRL1::INSTR": SimulatedQuatro,
+           "USB0::0x2A8D::0x1766::MY00000001::INSTR": SimulatedMSO}
+
+    def __init__(self, settings=SimulationSettings):
+        self.settings = settings
+        self.bench = SimulatedBench(settings)
+        # every resource is one instrument, no matter how often it's opened
+        self.devices = {resource_name: device_class(self.bench) for resource_name, device_class in self.bus.items()}
+
+    def list_resources(self, query="?*::INSTR"):
+        return tuple(self.devices)
+
+    def list_resources_info(self, query="?*::INSTR"):
+        return {resource_name: None for resource_name in self.devices}
+
+    def open_resource(self, resource_name: str, **kwargs):
+        if resource_name not in self.devices:
+            raise visa.VisaIOError(constants.VI_ERROR_RSRC_NFOUND)
+        return SimulatedResource(resource_name, self.devices[resource_name], self.settings)
+
+    def close(self):
+        pass
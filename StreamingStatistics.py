@@ -0,0 +1,171 @@
+"""Statistics that are updated one value at a time and never keep the values themselves. A DataAcquisition that samples
+its measurable in the background during a sweep of several days therefore needs the same memory after the first
+sample as after the millionth."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import math
+
+
+class P2Quantile:
+    """Estimates a quantile with the P-square algorithm (Jain and Chlamtac, 1985). It only keeps five markers, whose
+    heights are adjusted with a parabolic formula every time a value comes in. Until five values arrived, the exact
+    quantile of them is returned."""
+
+    def __init__(self, quantile: float):
+        """
+        :param quantile: between 0 and 1, eg 0.5 for the median
+        """
+        self.quantile = quantile
+        self._first_values = []
+        self._heights = []
+        self._positions = []
+        self._desired_positions = []
+        self._increments = []
+
+    def add(self, value: float):
+        if len(self._first_values) < 5:
+            self._first_values.append(value)
+            if len(self._first_values) == 5:
+                p = self.quantile
+                self._heights = sorted(self._first_values)
+                self._positions = [0, 1, 2, 3, 4]
+                self._desired_positions = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+                self._increments = [0, p / 2, p, (1 + p) / 2, 1]
+            return
+
+        heights = self._heights
+        positions = self._positions
+        # find the cell the value falls into, extending the outer markers if needed
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+
+        for index in range(cell + 1, 5):
+            positions[index] += 1
+        for index in range(5):
+            self._desired_positions[index] += self._increments[index]
+
+        # move the three middle markers if they are off their desired position by more than one
+        for index in range(1, 4):
+            offset = self._desired_positions[index] - positions[index]
+            if (offset >= 1 and positions[index + 1] - positions[index] > 1) or \
+                    (offset <= -1 and positions[index - 1] - positions[index] < -1):
+                step = int(math.copysign(1, offset))
+                new_height = self._parabolic(index, step)
+                if not heights[index - 1] < new_height < heights[index + 1]:
+                    new_height = self._linear(index, step)
+                heights[index] = new_height
+                positions[index] += step
+
+    def _parabolic(self, index: int, step: int):
+        heights = self._heights
+        positions = self._positions
+        return heights[index] + step / (positions[index + 1] - positions[index - 1]) * (
+            (positions[index] - positions[index - 1] + step) * (heights[index + 1] - heights[index]) /
+            (positions[index + 1] - positions[index]) +
+            (positions[index + 1] - positions[index] - step) * (heights[index] - heights[index - 1]) /
+            (positions[index] - positions[index - 1]))
+
+    def _linear(self, index: int, step: int):
+        heights = self._heights
+        positions = self._positions
+        return heights[index] + step * (heights[index + step] - heights[index]) / (
+            positions[index + step] - positions[index])
+
+    @property
+    def value(self):
+        """
+        :return: the current estimate or None if there were no values yet
+        """
+        if len(self._first_values) < 5:
+            if not self._first_values:
+                return None
+            # exact quantile with linear interpolation between the closest ranks
+            ordered = sorted(self._first_values)
+            rank = self.quantile * (len(ordered) - 1)
+            lower = int(math.floor(rank))
+            upper = min(lower + 1, len(ordered) - 1)
+            return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+        return self._heights[2]
+
+
+class RunningStatistics:
+    """Count, minimum, maximum, mean and variance (Welford's algorithm) and optionally quantiles of a stream of values"""
+
+    def __init__(self, quantiles: [] = None):
+        """
+        :param quantiles: quantiles to estimate, eg [0.05, 0.5, 0.95]. None or [] for none
+        """
+        self.count = 0
+        self.mean = 0.0
+        self._sum_of_squared_deviations = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.quantiles = []
+        if quantiles:
+            self.quantiles = [P2Quantile(quantile) for quantile in quantiles]
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._sum_of_squared_deviations += delta * (value - self.mean)
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        for quantile in self.quantiles:
+            quantile.add(value)
+
+    @property
+    def variance(self):
+        """Sample variance, 0 for less than two values"""
+        if self.count < 2:
+            return 0.0
+        return self._sum_of_squared_deviations / (self.count - 1)
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+
+class DatapointStatistics:
+    """Keeps RunningStatistics for every float value of datapoints, eg for "Sample Sensor" of a temperature reading.
+    Other values like time stamps are ignored."""
+
+    def __init__(self, quantiles: [] = None):
+        self.quantiles = quantiles
+        self.statistics_by_key = {}  # type: {str: RunningStatistics}
+
+    def add_datapoint(self, datapoint: dict):
+        for key, value in datapoint.items():
+            # if it's the time key, it's a str, we can't really calculate with strings
+            if type(value) == float:
+                if key not in self.statistics_by_key:
+                    self.statistics_by_key[key] = RunningStatistics(self.quantiles)
+                self.statistics_by_key[key].add(value)
+
+    def summary(self):
+        """The statistics as datapoint values with the key suffixed, eg for "K": "K_aver", "K_stddev", "K_max_+" (the
+        maximum), "K_max_-" (the minimum), "K_count" and for the quantile 0.95 "K_p95"
+
+        :rtype: dict
+        """
+        summary = {}
+        for key, statistics in self.statistics_by_key.items():
+            summary[key + "_max_-"] = statistics.minimum
+            summary[key + "_max_+"] = statistics.maximum
+            summary[key + "_aver"] = statistics.mean
+            summary[key + "_stddev"] = statistics.stddev
+            summary[key + "_count"] = statistics.count
+            for quantile in statistics.quantiles:
+                summary["{0}_p{1:g}".format(key, quantile.quantile * 100)] = quantile.value
+        return summary
@@ -0,0 +1,306 @@
+"""Engines that execute a task list. The classic engine gives every task its own Thread, the pooled engine runs the
+same task list in a fixed pool of worker threads, so the thread count only depends on how many tasks can run at the
+same time. Tasks themselves don't care which engine runs them, they only ever ask their engine to start or run their
+sub_tasks."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+import traceback
+
+from Clocks import RealClock
+import UserInput
+
+
+class TaskRun:
+    """Handle for one started do() of a task. It's what an engine returns when a task is started without waiting for
+    it, eg so a DataAcquisition can keep measuring while its sub_tasks run"""
+
+    # the clock timeouts are measured with
+    clock = RealClock()
+
+    def __init__(self, done_event: Event):
+        self._done_event = done_event
+
+    @property
+    def done(self):
+        return self._done_event.is_set()
+
+    def wait(self, timeout=None):
+        """Blocks until the task is done
+
+        :param timeout: seconds to wait at most, None waits as long as it takes
+        :return: True if the task is done, False if the timeout was reached first
+        :rtype: bool
+        """
+        return self._done_event.wait(timeout)
+
+
+def wait_for_all(task_runs: [], timeout=None):
+    """Blocks until all of the passed TaskRuns are done
+
+    :param task_runs: list of TaskRun
+    :param timeout: seconds to wait at most for all of them together, None waits as long as it takes
+    :return: True if all are done, False if the timeout was reached first
+    :rtype: bool
+    """
+    if not task_runs:
+        return True
+    clock = task_runs[0].clock
+    deadline = None
+    if timeout is not None:
+        deadline = clock.perf_counter() + timeout
+    for task_run in task_runs:
+        remaining = None
+        if deadline is not None:
+            remaining = max(0.0, deadline - clock.perf_counter())
+        if not task_run.wait(remaining):
+            return False
+    return True
+
+
+class CancellationToken:
+    """Tells a task whether it should stop its current run. Every run of a task gets its own token as a child of the
+    token of its parent's run, so cancelling a task (or the whole measurement) also stops all of its sub_tasks. A token
+    can have a deadline, once it passed the token counts as cancelled as well. Tasks look at their token at their safe
+    points, see Task._safe_point in MeasurementComponents."""
+
+    def __init__(self, clock, parent=None, timeout: float = None):
+        """
+        :param clock: the clock of the engine, see Clocks
+        :param parent: the CancellationToken of the parent, None for the measurement itself
+        :param timeout: seconds from now after which the token is cancelled, None for no deadline
+        """
+        self.clock = clock
+        self.parent = parent  # type: CancellationToken
+        self.deadline = None
+        if timeout:
+            self.deadline = clock.perf_counter() + timeout
+        self._reason = None
+
+    def cancel(self, reason: str):
+        """The first reason sticks, cancelling twice doesn't change it"""
+        if self._reason is None:
+            self._reason = reason
+
+    def postpone(self, seconds: float):
+        """Moves the deadline, eg by the time the run was paused"""
+        if self.deadline is not None:
+            self.deadline += seconds
+
+    @property
+    def reason(self):
+        """
+        :return: why the token is cancelled, None if it isn't
+        :rtype: str
+        """
+        if self._reason is not None:
+            return self._reason
+        if self.deadline is not None and self.clock.perf_counter() > self.deadline:
+            return "its deadline passed"
+        if self.parent is not None:
+            return self.parent.reason
+        return None
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+
+class TaskEngine(metaclass=ABCMeta):
+    """The general layout of an engine. An engine is prepared once with the whole task list before the measurement,
+    then top level tasks are started via start() and at the end, shutdown() is called.
+
+    If parallel_sub_tasks is set, tasks run those of their sub_tasks at the same time that talk to different
+    MeasurementDeviceControllers (see Helper.group_sub_tasks_by_devices in MeasurementComponents)."""
+
+    name = "Something should be here"
+
+    def __init__(self, parallel_sub_tasks=False):
+        self.tasks = []
+        self.parallel_sub_tasks = parallel_sub_tasks
+        # tasks use this clock to sleep and tell the time, see Clocks
+        self.clock = RealClock()
+
+    def check(self, tasks: []):
+        """Raises a TaskEngineError if the engine can't execute the task list. Called before measuring and before a task
+        is added while measuring, so nothing has started yet when it fails"""
+        return
+
+    @abstractmethod
+    def prepare(self, tasks: []):
+        """Readies the engine to execute the passed task list"""
+        return
+
+    @abstractmethod
+    def start(self, task):
+        """Starts the task without waiting for it to finish
+
+        :rtype: TaskRun
+        """
+        return
+
+    def run_and_wait(self, task):
+        """Runs the task and only returns after it is finished"""
+        self.start(task).wait()
+
+    def add_task(self, task):
+        """Called when a task was added to the task list while measuring, see ControlChannel"""
+        return
+
+    def fresh_copy(self):
+        """An engine is shut down at the end of its run. The next run of a RunQueue gets a new one with the same settings
+
+        :rtype: TaskEngine
+        """
+        return type(self)(self.parallel_sub_tasks)
+
+    def remove_task(self, task):
+        """Called when a task was removed from the task list while measuring"""
+        return
+
+    @abstractmethod
+    def shutdown(self):
+        """Frees everything the engine needed once the measurement is done"""
+        return
+
+
+class ThreadedTaskEngine(TaskEngine):
+    """The classic way: every task is its own Thread that sleeps until its parent wakes it up"""
+
+    name = "one thread per task (classic)"
+
+    def prepare(self, tasks: []):
+        self.tasks = tasks
+        for task in tasks:
+            task.start()
+
+    def start(self, task):
+        return task.request_do_now()
+
+    def add_task(self, task):
+        task.start()
+
+    def remove_task(self, task):
+        task.stop()
+
+    # a task that is stuck in a device call can't be stopped, the program mustn't wait for it forever when it ends
+    join_timeout = 10.0
+
+    def shutdown(self):
+        for task in self.tasks:
+            task.stop()
+        for task in self.tasks:
+            task.join(self.join_timeout)
+            if task.is_alive():
+                UserInput.post_status("Task {0} is still stuck, leaving it behind.".format(str(task.identifier)))
+
+
+class PooledTaskEngine(TaskEngine):
+    """Runs every started task in a worker of one fixed thread pool instead of giving each task its own Thread.
+    Sub_tasks that are run sequentially don't even go through the pool, they simply run in the worker of their parent.
+    This way a task list with hundreds of tasks only needs as many threads as there are tasks running at the same time.
+
+    It's not an asyncio event loop: the tasks block in their device calls and sleeps all the way down, so coroutines
+    could only ever hand them on to threads again. The pool does that directly.
+
+    The pool is created once in prepare() and never grows: max_workers is a hard cap. A task list (or a task added while
+    measuring) that could need more workers at the same time would deadlock the pool, it is refused right away instead.
+    """
+
+    name = "pool of worker threads (large task lists)"
+
+    # the cap if none is passed. Enough for deep task lists with averaging DataAcqs, a wide one with parallel_sub_tasks
+    # needs more or the threaded engine
+    default_max_workers = 8
+
+    def __init__(self, parallel_sub_tasks=False, max_workers: int = None):
+        """
+        :param max_workers: the most threads the pool may have, default_max_workers if None
+        """
+        super().__init__(parallel_sub_tasks)
+        self.max_workers = max_workers or self.default_max_workers
+        self._executor = None  # type: ThreadPoolExecutor
+
+    def fresh_copy(self):
+        return type(self)(self.parallel_sub_tasks, self.max_workers)
+
+    def prepare(self, tasks: []):
+        self.tasks = tasks
+        # A worker that is waiting on concurrently started sub_tasks is still occupied. If the pool were smaller than
+        # the number of tasks that can be running at the same time, the measurement would deadlock
+        self.check(tasks)
+        # the threads are only started when they are needed, a small task list doesn't get all of them
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="JUMP-task")
+
+    def check(self, tasks: []):
+        needed = self.required_workers(tasks)
+        if needed > self.max_workers:
+            raise TaskEngineError("The task list can have {0} tasks running at the same time, but the pool only has "
+                                  "{1} workers. It would deadlock, use more workers or the threaded engine."
+                                  .format(needed, self.max_workers))
+
+    def start(self, task):
+        done_event = Event()
+        future = self._executor.submit(task.run_do)
+
+        def on_done(finished_future):
+            # Nobody collects the result of the future, so we at least tell the user when a task crashed
+            exception = finished_future.exception()
+            if exception:
+                UserInput.post_status("Task {0} crashed:\n{1}".format(str(task.identifier), "".join(
+                    traceback.format_exception(type(exception), exception, exception.__traceback__))))
+            done_event.set()
+
+        future.add_done_callback(on_done)
+        return TaskRun(done_event)
+
+    def run_and_wait(self, task):
+        # We are already inside a worker (or the main thread for top level tasks), no need to hop through the pool
+        task.run_do()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        # the engine may be prepared again for the next run of a RunQueue
+        self._executor = None
+
+    def required_workers(self, tasks: []):
+        """Calculates how many workers can be busy at the same time for the task list. A task that runs its sub_tasks
+        sequentially shares its worker with them, a task that starts them concurrently (eg a DataAcquisition averaging
+        through its sub_tasks) keeps its own worker while they run in another one. With parallel_sub_tasks, we assume
+        the worst case of all siblings running at the same time.
+
+        :param tasks: the sorted task list
+        :return: number of workers needed
+        :rtype: int
+        """
+        children = {}
+        for task in tasks:
+            children.setdefault(tuple(task.identifier[:-1]), []).append(task)
+
+        def workers_for(task):
+            sub_tasks = children.get(tuple(task.identifier), [])
+            if self.parallel_sub_tasks and len(sub_tasks) > 1:
+                return 1 + sum([workers_for(sub_task) for sub_task in sub_tasks])
+            needed_by_sub_tasks = max([workers_for(sub_task) for sub_task in sub_tasks], default=0)
+            if getattr(task, "starts_sub_tasks_concurrently", False):
+                return 1 + needed_by_sub_tasks
+            return max(1, needed_by_sub_tasks)
+
+        return max([workers_for(task) for task in children.get((), [])], default=1)
+
+
+available_engines = [ThreadedTaskEngine, PooledTaskEngine]
+
+
+class TaskEngineError(Exception):
+    """class to indicate that an engine can't execute a task list, eg because its pool is too small for it
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+
+    def __str__(self):
+        return str(self.problem)
@@ -0,0 +1,173 @@
+"""Task lists can be stored in and loaded from task tree files instead of answering all the questions again. A task tree
+file is json: every task is written like Task.to_definition returns it, but without the identifier. The sub_tasks of a
+task are nested in it, so the identifiers follow from where a task is in the file. Controlables and measurables are
+referenced by their name and the name of their device. An example:
+
+{"measurement_setup": "TKKG : Transportlaborkaltkopf GLaDOS (GLaDOS)",
+ "tasks": [{"type": "ParamContr", "controlable": {"name": "Setpoint", "dev": "Temp_336"},
+            "trigger": {"specific_values": [300, 250, 200]},
+            "sub_tasks": [{"type": "DataAcq", "measurable": {"name": "Sample Sensor", "dev": "Temp_336"},
+                           "average_through_sub_task": true,
+                           "sub_tasks": [{"type": "ParamContr", "controlable": {"name": "expected_freq", "dev": "ALPHA"},
+                                          "trigger": {"specific_values": [1e6, 1e4, 1e2, 1]},
+                                          "sub_tasks": [{"type": "DataAcq",
+                                                         "measurable": {"name": "RX", "dev": "ALPHA"}}]}]}]}]}
+
+Optional settings are only written if they differ from the default, eg "time_budget" or "list_sweep": false in the
+trigger of a "specific_values" ParamContr that mustn't be swept by the device itself.
+
+Before anything is added to the measurement, the whole file is checked: every task has to be valid and the values of a
+"Setpoint" have to be within the limits of the measurement setup (see MeasurementSetup.get_limits)."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import json
+
+from DataStorage import Database
+from MeasurementComponents import Helper, TaskTree, TaskDefinitionError, ParameterController
+import UserInput
+
+
+class TaskTreeFileError(Exception):
+    """class to indicate that a task tree file can't be used. It holds all problems that were found, not only the first
+    """
+
+    def __init__(self, problems: []):
+        self.problems = problems
+
+    def __str__(self):
+        return "\n".join(self.problems)
+
+
+def read_definitions(path: str):
+    """Reads a task tree file and turns it into a flat list of task definitions with identifiers
+
+    :return: the name of the measurement setup the file was written for (None if it doesn't say), the definitions
+    sorted by identifier
+    :rtype: (str, [dict])
+    """
+    try:
+        with open(path, "r") as task_tree_file:
+            content = json.load(task_tree_file)
+    except OSError as error:
+        raise TaskTreeFileError(["Couldn't read {0}: {1}".format(path, error)])
+    except ValueError as error:
+        raise TaskTreeFileError(["{0} isn't valid json: {1}".format(path, error)])
+    if not isinstance(content, dict) or not isinstance(content.get("tasks"), list) or len(content["tasks"]) == 0:
+        raise TaskTreeFileError(["{0} needs a non-empty list of \"tasks\"".format(path)])
+
+    problems = []
+    definitions = []
+
+    def flatten(tasks, parent_identifier, location):
+        for index, task in enumerate(tasks):
+            task_location = "{0}[{1}]".format(location, index)
+            if not isinstance(task, dict):
+                problems.append("{0}: a task has to be a json object".format(task_location))
+                continue
+            definition = {key: value for key, value in task.items() if key != "sub_tasks"}
+            definition["identifier"] = parent_identifier + [index]
+            definition["location"] = task_location
+            definitions.append(definition)
+            sub_tasks = task.get("sub_tasks", [])
+            if not isinstance(sub_tasks, list):
+                problems.append("{0}: \"sub_tasks\" has to be a list".format(task_location))
+                continue
+            flatten(sub_tasks, definition["identifier"], task_location + ".sub_tasks")
+
+    flatten(content["tasks"], [], "tasks")
+    if problems:
+        raise TaskTreeFileError(problems)
+    return content.get("measurement_setup"), definitions
+
+
+def check_definitions(definitions: [], measurement_setup):
+    """Builds every task on a scratch database to see whether it can be created in this measurement setup and checks
+    the values of setpoints against the limits of the setup
+
+    :param definitions: as returned by read_definitions
+    :param measurement_setup: the initialized MeasurementSetups.MeasurementSetup
+    :return: all problems found, empty if the definitions are fine
+    :rtype: [str]
+    """
+    problems = []
+    scratch_tree = TaskTree()
+    scratch_database = Database()
+    limits = measurement_setup.get_limits()
+    for definition in definitions:
+        location = definition["location"]
+        if definition.get("type") == "DataAcq":
+            definition.setdefault("average_through_sub_task", False)
+        try:
+            task = Helper.task_from_definition(definition, measurement_setup, scratch_tree, scratch_database)
+        except TaskDefinitionError as error:
+            problems.append("{0}: {1}".format(location, error))
+            continue
+        except (KeyError, TypeError, ValueError) as error:
+            problems.append("{0}: the {1} task is incomplete or has a wrong value ({2})".format(
+                location, definition.get("type"), repr(error)))
+            continue
+        scratch_tree.add(task)
+        if isinstance(task, ParameterController):
+            if task.mode is None:
+                problems.append("{0}: the trigger of a ParamContr needs \"specific_values\", \"start_value\" or "
+                                "\"adaptive\"".format(location))
+                continue
+            problems += _check_limits(task, limits, location)
+    return problems
+
+
+def _check_limits(task: ParameterController, limits, location: str):
+    """Only setpoints have limits, and only if the setup has numeric ones ([lowest, highest])"""
+    if task.meas_setup_controlable["name"] != "Setpoint":
+        return []
+    if not isinstance(limits, (list, tuple)) or len(limits) != 2 or \
+            not all([type(limit) in (int, float) for limit in limits]):
+        return []
+    if task.mode == "spec_values":
+        values = list(task.specific_values)
+    else:
+        values = [task.start_value, task.end_value]
+    problems = []
+    for value in values:
+        if type(value) not in (int, float):
+            problems.append("{0}: the setpoint {1} isn't a number".format(location, repr(value)))
+        elif not limits[0] <= value <= limits[1]:
+            problems.append("{0}: the setpoint {1} is outside of the limits {2} to {3} of the measurement setup".format(
+                location, value, limits[0], limits[1]))
+    return problems
+
+
+def load(path: str, measurement):
+    """Adds the tasks of a task tree file to a measurement. Nothing is added if there is any problem with the file
+
+    :param measurement: a MeasurementComponents.Measurement without tasks
+    :raises TaskTreeFileError: with all problems found
+    """
+    setup_name, definitions = read_definitions(path)
+    if setup_name is not None and setup_name != measurement.meas_setup_name:
+        UserInput.post_status("The task tree file was written for the measurement setup '{0}', checking whether it "
+                              "fits this one anyway.".format(setup_name))
+    problems = check_definitions(definitions, measurement.meas_setup)
+    if problems:
+        raise TaskTreeFileError(problems)
+    for definition in definitions:
+        del definition["location"]
+        measurement.add_task_from_definition(definition)
+
+
+def save(path: str, measurement):
+    """Writes the task list of a measurement into a task tree file"""
+
+    def nest(task):
+        definition = task.to_definition()
+        del definition["identifier"]
+        sub_tasks = measurement.tasks.sub_tasks_of(task.identifier)
+        if sub_tasks:
+            definition["sub_tasks"] = [nest(sub_task) for sub_task in sub_tasks]
+        return definition
+
+    content = {"measurement_setup": measurement.meas_setup_name,
+               "tasks": [nest(task) for task in measurement.tasks.top_level_tasks()]}
+    with open(path, "w") as task_tree_file:
+        json.dump(content, task_tree_file, indent=2)
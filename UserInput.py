@@ -274,6 +274,11 @@ def confirm_warning(warning_text: str,custom:bool=True):
         input("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
 
 
+# While True, post_status doesn't show anything. Used by the dry run so its tasks don't flood the screen
+status_muted = False
+
+
 def post_status(new_status: str):
     # GUI code to show log messages that don't need confirmation!
-    print(str(new_status))
+    if not status_muted:
+        print(str(new_status))
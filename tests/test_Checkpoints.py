@@ -0,0 +1,150 @@
+"""Resuming an interrupted run: the database comes from the last autosave, the journal brings back the points measured
+after it and everything measured after the last cursor of its task is dropped, so no point is missing or there twice.
+The interrupted run here is a temperature step with two DataAcqs below it, which died in the second step: the first
+DataAcq had finished there, the second one had measured but not yet saved its cursor."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Checkpoints import Checkpoint
+from DataStorage import Database
+import MeasurementComponents
+import TaskEngines
+import UserInput
+
+
+class Device:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class TemperatureSetup:
+    """Only what the tasks and the Measurement ask of a setup. Both sensors read twice the setpoint"""
+
+    def __init__(self):
+        self.temp = Device("Temp_336")
+        self.setpoint = 0.0
+
+    def change_value_of_controlable_to(self, controlable, new_value):
+        self.setpoint = new_value
+        return {"Setpoint": new_value}
+
+    def read_measurable(self, measurable: dict, max_age=0.0, clock=None):
+        return {measurable["name"]: self.setpoint * 2}
+
+    def sweep_points(self, controlable: dict, measurable: dict):
+        return 0
+
+    def devices(self):
+        return []
+
+    def measurement_done(self):
+        return
+
+
+class Measurement(MeasurementComponents.Measurement):
+    """A Measurement without the questions for the setup"""
+
+    def __init__(self, setup: TemperatureSetup, database: Database):
+        self.meas_setup = setup
+        self.meas_setup_name = "test"
+        self.database = database
+        self.tasks = MeasurementComponents.TaskTree()
+        controlable = {"dev": setup.temp, "name": "Setpoint"}
+        self.tasks.add(MeasurementComponents.ParameterController([0], setup, controlable,
+                                                                 {"specific_values": [300, 250, 200]}, self.tasks,
+                                                                 database))
+        for index, sensor in enumerate(["Sample Sensor", "Heater Sensor"]):
+            self.tasks.add(MeasurementComponents.DataAcquisition([0, index], setup, {"dev": setup.temp, "name": sensor},
+                                                                 False, self.tasks, database=database))
+
+
+def values(database: Database, identifier: [], key: str):
+    return [datapoint[key] for datapoint in database._get_datapoint_list_at_identifier(identifier)]
+
+
+class TestCheckpointRestore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        UserInput.status_muted = True
+
+    def tearDown(self):
+        UserInput.status_muted = False
+        shutil.rmtree(self.directory)
+
+    def _interrupted_run(self):
+        """Records the run up to where it died, the way the tasks would have
+
+        :return: the database as it was autosaved after the first temperature
+        :rtype: Database
+        """
+        database = Database(pickle_path=self.directory + os.sep)
+        tasks = Measurement(TemperatureSetup(), database).tasks
+        checkpoint = Checkpoint(self.directory, database.name, database)
+        checkpoint.start(tasks)
+        database.add_point([0], {"Setpoint": 300})
+        database.add_point([0, 0], {"Sample Sensor": 600})
+        checkpoint.save([0, 0], {"finished": True})
+        database.add_point([0, 1], {"Heater Sensor": 600})
+        checkpoint.save([0, 1], {"finished": True})
+        checkpoint.save([0], {"next_index": 1})
+        autosave = pickle.loads(pickle.dumps(database, -1))
+        database.add_point([0], {"Setpoint": 250})
+        database.add_point([0, 0], {"Sample Sensor": 500})
+        checkpoint.save([0, 0], {"finished": True})
+        database.add_point([0, 1], {"Heater Sensor": 500})
+        # died here, before [0, 1] saved its cursor
+        checkpoint.journal.close()
+        return autosave
+
+    def _restore(self, autosave: Database):
+        measurement = Measurement(TemperatureSetup(), autosave)
+        checkpoint = Checkpoint(self.directory, autosave.name, autosave)
+        checkpoint.restore(measurement.tasks)
+        return measurement, checkpoint
+
+    def _assert_restored(self, database: Database, checkpoint: Checkpoint):
+        # the second temperature is set again, as its ParamContr only got to save the first one
+        self.assertEqual([300], values(database, [0], "Setpoint"))
+        # the journal brought back the point of the finished DataAcq, the one without a cursor is measured again
+        self.assertEqual([600, 500], values(database, [0, 0], "Sample Sensor"))
+        self.assertEqual([600], values(database, [0, 1], "Heater Sensor"))
+        self.assertEqual({"next_index": 1}, checkpoint.take_resume_state([0]))
+        self.assertEqual({"finished": True}, checkpoint.take_resume_state([0, 0]))
+        self.assertIsNone(checkpoint.take_resume_state([0, 1]))
+
+    def test_journal_is_replayed_and_truncated_to_the_deepest_cursor(self):
+        autosave = self._interrupted_run()
+        self.assertEqual(1, autosave.amount_of_points([0, 0]))
+        measurement, checkpoint = self._restore(autosave)
+        self._assert_restored(measurement.database, checkpoint)
+
+    def test_half_written_last_journal_record_is_ignored(self):
+        autosave = self._interrupted_run()
+        record = pickle.dumps(((0, 0), {"Sample Sensor": 400}), -1)
+        with open(os.path.join(self.directory, "{0}_points.journal".format(autosave.name)), "ab") as journal_file:
+            journal_file.write(record[:len(record) // 2])
+        measurement, checkpoint = self._restore(autosave)
+        self._assert_restored(measurement.database, checkpoint)
+
+    def test_finished_sub_task_is_not_measured_again(self):
+        autosave = self._interrupted_run()
+        measurement, checkpoint = self._restore(autosave)
+        measurement.measure(TaskEngines.ThreadedTaskEngine(), checkpoint, finish_setup=False)
+        database = measurement.database
+        self.assertEqual([300, 250, 200], values(database, [0], "Setpoint"))
+        self.assertEqual([600, 500, 400], values(database, [0, 0], "Sample Sensor"))
+        self.assertEqual([600, 500, 400], values(database, [0, 1], "Heater Sensor"))
+
+
+if __name__ == "__main__":
+    unittest.main()
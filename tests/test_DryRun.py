@@ -0,0 +1,95 @@
+"""The dry run must never talk to a device, not even for a sweep the device would do by itself (eg the list sweep of the
+4980A). The devices here only pretend to be a 4980A and a temperature controller and fail loudly if they are used."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import DryRun
+import MeasurementComponents
+
+
+class Agilent4980A:
+    """Named like the real device class, so the dry run estimates it as a frequency device"""
+    minimum_measurement_time = 0.05
+
+
+class Temp_336:
+    pass
+
+
+class UntouchableDeviceController:
+    """Stands in for a MeasurementDeviceController that can list sweep, but must not be used in a dry run"""
+
+    def __init__(self, mes_device, name: str):
+        self.mes_device = mes_device
+        self.name = name
+
+    def sweep_points(self, controlable: str, measurable_to_measure):
+        return 201
+
+    def sweep(self, controlable: str, values: [], measurable_to_measure):
+        raise AssertionError("The dry run swept {0} on {1}".format(controlable, self.name))
+
+    def set_controlable(self, controlable_dict: {}):
+        raise AssertionError("The dry run set {0} on {1}".format(controlable_dict, self.name))
+
+    def measure_measurable(self, measurable_to_measure):
+        raise AssertionError("The dry run measured {0} on {1}".format(measurable_to_measure, self.name))
+
+
+class RealSetup:
+    def __init__(self):
+        self.lcr = UntouchableDeviceController(Agilent4980A(), "4980A")
+        self.temp = UntouchableDeviceController(Temp_336(), "Temp_336")
+
+    def get_controlables(self):
+        return [{"dev": self.temp, "name": "Setpoint"}, {"dev": self.lcr, "name": "expected_freq"}]
+
+    def get_measurables(self):
+        return [{"dev": self.temp, "name": "Sample Sensor"}, {"dev": self.lcr, "name": "CpD"}]
+
+    def get_limits(self):
+        return [0, 500]
+
+
+class Measurement:
+    """Only what dry_run looks at"""
+
+    def __init__(self):
+        self.meas_setup = RealSetup()
+        self.tasks = MeasurementComponents.TaskTree()
+
+
+class TestDryRun(unittest.TestCase):
+
+    def test_list_sweepable_tree_stays_in_virtual_time(self):
+        measurement = Measurement()
+        setup = measurement.meas_setup
+        tasks = measurement.tasks
+        controlables = setup.get_controlables()
+        measurables = setup.get_measurables()
+        frequencies = [10.0 ** exponent for exponent in range(1, 7)]
+        # a temperature step with a frequency sweep of the 4980A whose only sub_task reads the 4980A: a list sweep
+        tasks.add(MeasurementComponents.ParameterController([0], setup, controlables[0],
+                                                            {"specific_values": [300, 290]}, tasks))
+        tasks.add(MeasurementComponents.ParameterController([0, 0], setup, controlables[1],
+                                                            {"specific_values": frequencies}, tasks))
+        tasks.add(MeasurementComponents.DataAcquisition([0, 0, 0], setup, measurables[1], False, tasks))
+
+        report = DryRun.dry_run(measurement)
+
+        self.assertEqual([], report["crashes"])
+        points = {tuple(task["identifier"]): task["points"] for task in report["tasks"]}
+        self.assertEqual(2, points[(0,)])
+        self.assertEqual(2 * len(frequencies), points[(0, 0)])
+        self.assertEqual(2 * len(frequencies), points[(0, 0, 0)])
+        self.assertGreater(report["duration"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+"""Whole measurements against the simulated instruments: a frequency sweep of the 4980A measured by both engines, the
+list sweep of the 4980A and the batch of the ALPHA, which have to give the same points as measuring value by value.
+Without noise and with the time scaled away, the simulated sample answers the same at every frequency in every run."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataStorage import Database
+import MeasurementComponents
+import MeasurementHardware
+import MeasurementSetups
+import SimulatedInstruments
+import TaskEngines
+import UserInput
+
+
+class DeterministicSettings(SimulatedInstruments.SimulationSettings):
+    latency = 0.0
+    noise = 0.0
+    temperature_noise = 0.0
+    time_scale = 1e5
+    seed = 1
+
+
+class CountingResourceManager(SimulatedInstruments.SimulatedResourceManager):
+    """Counts the bus transfers (every write, read and trigger) of all its resources"""
+
+    def __init__(self, settings=DeterministicSettings):
+        super().__init__(settings)
+        self.transfers = 0
+
+    def open_resource(self, resource_name: str, **kwargs):
+        resource = super().open_resource(resource_name, **kwargs)
+        transfer = resource._transfer
+
+        def counting_transfer():
+            self.transfers += 1
+            transfer()
+
+        resource._transfer = counting_transfer
+        return resource
+
+
+def simulated_controller(device_class, resource_name: str, resource_manager):
+    """A MeasurementDeviceController for the simulated instrument, without the questions of initialize_instrument"""
+    device = device_class()
+    device.set_visa_dev(resource_name, resource_manager)
+    device.measurables = device_class.measurables
+    device.controlables = device_class.controlables
+    device.idn_alias = "simulated " + device_class.__name__
+    controller = object.__new__(MeasurementHardware.MeasurementDeviceController)
+    controller.dev_resource_manager = resource_manager
+    controller.mes_device = device
+    controller.name = device.idn_alias
+    return controller
+
+
+class Measurement(MeasurementComponents.Measurement):
+    """A Measurement without the questions for the setup"""
+
+    def __init__(self, setup: MeasurementSetups.MeasurementSetup):
+        self.meas_setup = setup
+        self.meas_setup_name = "simulation"
+        self.database = None
+        self.tasks = MeasurementComponents.TaskTree()
+
+
+def points_without_times(database: Database):
+    """The points of the ParamContr and its DataAcq, the human readable tasks tell whether the list sweep was allowed"""
+    return [without_times(database._get_datapoint_list_at_identifier(identifier)) for identifier in [[0], [0, 0]]]
+
+
+def without_times(content):
+    """The Database contents without the wall clock times, which differ from run to run"""
+    if isinstance(content, dict):
+        return {key: without_times(value) for key, value in content.items() if "time" not in str(key)}
+    if isinstance(content, list):
+        return [without_times(value) for value in content]
+    return content
+
+
+class TestSimulatedMeasurements(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        UserInput.status_muted = True
+        self.resource_manager = CountingResourceManager()
+        # the setups get the simulated bus, no matter whether JUMP was started with simulation or not
+        self._previous_resource_manager = MeasurementHardware._shared_resource_manager
+        MeasurementHardware._shared_resource_manager = self.resource_manager
+        self.lcr = simulated_controller(MeasurementHardware.Agilent4980A, "GPIB0::17::INSTR", self.resource_manager)
+        self.lcr.mes_device.ids_for_measurables = {"CpD": {"first_result_sepcifier": "C_prime",
+                                                           "second_result_sepcifier": "D"}}
+        self.alpha = simulated_controller(MeasurementHardware.ALPHA, "GPIB0::6::INSTR", self.resource_manager)
+        self.alpha.mes_device.minimum_measurement_time = 0.5
+
+    def tearDown(self):
+        MeasurementHardware._shared_resource_manager = self._previous_resource_manager
+        UserInput.status_muted = False
+        shutil.rmtree(self.directory)
+
+    def _measure(self, controller, measurable: str, frequencies: [], engine=None, list_sweep=True):
+        """A frequency sweep of the controller with a DataAcq of the measurable at every frequency
+
+        :return: the Database and how many bus transfers the run took
+        """
+        setup = MeasurementSetups.Generic()
+        controlable = {"dev": controller, "name": "expected_freq"}
+        measurable = {"dev": controller, "name": measurable}
+        setup.controlables = [controlable]
+        setup.measurables = [measurable]
+        measurement = Measurement(setup)
+        measurement.database = Database(pickle_path=self.directory + os.sep)
+        tasks = measurement.tasks
+        database = measurement.database
+        tasks.add(MeasurementComponents.ParameterController([0], setup, controlable,
+                                                            {"specific_values": frequencies,
+                                                             "list_sweep": list_sweep}, tasks, database))
+        tasks.add(MeasurementComponents.DataAcquisition([0, 0], setup, measurable, False, tasks, database=database))
+        transfers_before = self.resource_manager.transfers
+        measurement.measure(engine or TaskEngines.ThreadedTaskEngine(), finish_setup=False)
+        return database, self.resource_manager.transfers - transfers_before
+
+    def test_engines_measure_the_same_4980a_sweep(self):
+        frequencies = [1e6, 1e5, 1e4, 1e3, 1e2]
+        reference, _ = self._measure(self.lcr, "CpD", frequencies)
+        self.assertEqual(len(frequencies), reference.amount_of_points([0, 0]))
+        for engine in [TaskEngines.PooledTaskEngine(), TaskEngines.PooledTaskEngine(parallel_sub_tasks=True)]:
+            database, _ = self._measure(self.lcr, "CpD", frequencies, engine)
+            self.assertEqual(without_times(reference.db), without_times(database.db), engine.name)
+
+    def test_4980a_list_sweep_measures_like_value_by_value(self):
+        frequencies = [20.0 * 1.5 ** exponent for exponent in range(30)]
+        swept, swept_transfers = self._measure(self.lcr, "CpD", frequencies)
+        stepped, stepped_transfers = self._measure(self.lcr, "CpD", frequencies, list_sweep=False)
+        self.assertEqual(len(frequencies), swept.amount_of_points([0, 0]))
+        self.assertEqual(points_without_times(stepped), points_without_times(swept))
+        self.assertLess(swept_transfers, stepped_transfers)
+
+    def test_alpha_batch_measures_like_value_by_value(self):
+        frequencies = [1e6, 1e5, 1e4, 1e3, 1e2, 10.0, 1.0]
+        batched, batched_transfers = self._measure(self.alpha, "RX", frequencies)
+        stepped, stepped_transfers = self._measure(self.alpha, "RX", frequencies, list_sweep=False)
+        self.assertEqual(len(frequencies), batched.amount_of_points([0, 0]))
+        self.assertEqual(points_without_times(stepped), points_without_times(batched))
+        self.assertLess(batched_transfers, stepped_transfers)
+
+
+if __name__ == "__main__":
+    unittest.main()
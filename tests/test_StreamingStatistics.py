@@ -0,0 +1,101 @@
+"""The streaming statistics have to agree with the ones calculated from all values at once, which a DataAcquisition
+sampling for days can't keep."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import os
+import random
+import statistics
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from StreamingStatistics import DatapointStatistics, P2Quantile, RunningStatistics
+
+
+def exact_quantile(values: [], quantile: float):
+    """Linear interpolation between the closest ranks, like P2Quantile before it has five values"""
+    ordered = sorted(values)
+    rank = quantile * (len(ordered) - 1)
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+class TestRunningStatistics(unittest.TestCase):
+
+    def test_welford_agrees_with_statistics(self):
+        generator = random.Random(4)
+        # a large offset with small deviations, like a temperature reading, is where a naive sum of squares fails
+        values = [300.0 + generator.gauss(0, 0.01) for _ in range(10000)]
+        running = RunningStatistics()
+        for value in values:
+            running.add(value)
+        self.assertEqual(len(values), running.count)
+        self.assertAlmostEqual(statistics.mean(values), running.mean, places=9)
+        self.assertAlmostEqual(1.0, running.variance / statistics.variance(values), places=9)
+        self.assertAlmostEqual(statistics.stdev(values), running.stddev, places=9)
+        self.assertEqual(min(values), running.minimum)
+        self.assertEqual(max(values), running.maximum)
+
+    def test_variance_of_a_single_value(self):
+        running = RunningStatistics()
+        running.add(3.0)
+        self.assertEqual(3.0, running.mean)
+        self.assertEqual(0.0, running.variance)
+
+
+class TestP2Quantile(unittest.TestCase):
+
+    def test_exact_quantiles_with_less_than_five_values(self):
+        values = [4.0, 1.0, 3.0, 2.0]
+        for quantile in [0.0, 0.25, 0.5, 0.9, 1.0]:
+            estimator = P2Quantile(quantile)
+            self.assertIsNone(estimator.value)
+            for count, value in enumerate(values, 1):
+                estimator.add(value)
+                self.assertAlmostEqual(exact_quantile(values[:count], quantile), estimator.value)
+        median = P2Quantile(0.5)
+        for value in values:
+            median.add(value)
+        self.assertAlmostEqual(2.5, median.value)
+
+    def test_quantiles_of_a_known_sample(self):
+        # every value from 0 to 10000 exactly once, in random order: the p-quantile is 10000 * p
+        values = list(range(10001))
+        random.Random(7).shuffle(values)
+        for quantile in [0.05, 0.5, 0.95]:
+            estimator = P2Quantile(quantile)
+            for value in values:
+                estimator.add(float(value))
+            self.assertAlmostEqual(10000 * quantile, estimator.value, delta=100)
+
+    def test_quantiles_of_a_normal_distribution(self):
+        generator = random.Random(11)
+        values = [generator.gauss(10.0, 2.0) for _ in range(20000)]
+        for quantile in [0.05, 0.5, 0.95]:
+            estimator = P2Quantile(quantile)
+            for value in values:
+                estimator.add(value)
+            self.assertAlmostEqual(exact_quantile(values, quantile), estimator.value, delta=0.02)
+
+
+class TestDatapointStatistics(unittest.TestCase):
+
+    def test_summary_of_float_values_only(self):
+        datapoint_statistics = DatapointStatistics([0.5])
+        for kelvin in [300.0, 302.0, 301.0]:
+            datapoint_statistics.add_datapoint({"K": kelvin, "time": "01.01.2017 12:00:00", "successful": True})
+        summary = datapoint_statistics.summary()
+        self.assertEqual({"K_max_-", "K_max_+", "K_aver", "K_stddev", "K_count", "K_p50"}, set(summary))
+        self.assertEqual(300.0, summary["K_max_-"])
+        self.assertEqual(302.0, summary["K_max_+"])
+        self.assertAlmostEqual(301.0, summary["K_aver"])
+        self.assertAlmostEqual(1.0, summary["K_stddev"])
+        self.assertEqual(3, summary["K_count"])
+        self.assertAlmostEqual(301.0, summary["K_p50"])
+
+
+if __name__ == "__main__":
+    unittest.main()
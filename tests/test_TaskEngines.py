@@ -0,0 +1,129 @@
+"""Both engines have to produce the same Database contents for the same task list, only the threads differ. The setup
+here answers with values that only depend on what was set, so the contents don't depend on timing."""
+__copyright__ = "Copyright 2015 - 2017, Justin Scholz"
+__author__ = "Justin Scholz"
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataStorage import Database
+import MeasurementComponents
+import TaskEngines
+import UserInput
+
+
+class Device:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class DeterministicSetup:
+    """Only what the tasks and the Measurement ask of a setup. Every measurable reads back what its device was set to"""
+
+    def __init__(self):
+        self.temp = Device("Temp_336")
+        self.alpha = Device("ALPHA")
+        self.values = {}
+
+    def change_value_of_controlable_to(self, controlable, new_value):
+        self.values[controlable["dev"].name] = new_value
+        return {controlable["name"]: new_value}
+
+    def read_measurable(self, measurable: dict, max_age=0.0, clock=None):
+        value = self.values.get(measurable["dev"].name, 0.0)
+        return {measurable["name"]: value * 2, "set": value}
+
+    def sweep_points(self, controlable: dict, measurable: dict):
+        return 0
+
+    def devices(self):
+        return []
+
+    def measurement_done(self):
+        return
+
+
+class Measurement(MeasurementComponents.Measurement):
+    """A Measurement without the questions for the setup"""
+
+    def __init__(self, setup: DeterministicSetup, database: Database):
+        self.meas_setup = setup
+        self.meas_setup_name = "test"
+        self.database = database
+        self.tasks = MeasurementComponents.TaskTree()
+
+
+def without_times(content):
+    """The Database contents without the wall clock times, which differ from run to run"""
+    if isinstance(content, dict):
+        return {key: without_times(value) for key, value in content.items() if "time" not in str(key)}
+    if isinstance(content, list):
+        return [without_times(value) for value in content]
+    return content
+
+
+class TestTaskEngines(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        UserInput.status_muted = True
+
+    def tearDown(self):
+        UserInput.status_muted = False
+        shutil.rmtree(self.directory)
+
+    def _measure(self, engine: TaskEngines.TaskEngine):
+        """A temperature step with a DataAcq of the temperature and a frequency sweep below it"""
+        setup = DeterministicSetup()
+        measurement = Measurement(setup, Database(pickle_path=self.directory + os.sep))
+        tasks = measurement.tasks
+        database = measurement.database
+        temperature = {"dev": setup.temp, "name": "Setpoint"}
+        frequency = {"dev": setup.alpha, "name": "expected_freq"}
+        tasks.add(MeasurementComponents.ParameterController([0], setup, temperature,
+                                                            {"specific_values": [300, 250, 200]}, tasks, database))
+        tasks.add(MeasurementComponents.DataAcquisition([0, 0], setup, {"dev": setup.temp, "name": "Sample Sensor"},
+                                                        False, tasks, database=database))
+        tasks.add(MeasurementComponents.ParameterController([0, 1], setup, frequency,
+                                                            {"specific_values": [1e6, 1e3, 1.0]}, tasks, database))
+        tasks.add(MeasurementComponents.DataAcquisition([0, 1, 0], setup, {"dev": setup.alpha, "name": "RX"},
+                                                        False, tasks, database=database))
+        measurement.measure(engine, finish_setup=False)
+        return database
+
+    def test_engines_produce_the_same_database(self):
+        reference = self._measure(TaskEngines.ThreadedTaskEngine())
+        self.assertEqual(3 * 3, reference.amount_of_points([0, 1, 0]))
+        for engine in [TaskEngines.PooledTaskEngine(), TaskEngines.ThreadedTaskEngine(parallel_sub_tasks=True),
+                       TaskEngines.PooledTaskEngine(parallel_sub_tasks=True, max_workers=3)]:
+            database = self._measure(engine)
+            self.assertEqual(without_times(reference.db), without_times(database.db), engine.name)
+
+    def test_pool_refuses_a_task_list_that_needs_more_workers(self):
+        setup = DeterministicSetup()
+        tasks = MeasurementComponents.TaskTree()
+        database = Database(pickle_path=self.directory + os.sep)
+        # an averaging DataAcq keeps its worker while its sub_task runs in another one
+        tasks.add(MeasurementComponents.DataAcquisition([0], setup, {"dev": setup.temp, "name": "Sample Sensor"},
+                                                        True, tasks, database=database))
+        tasks.add(MeasurementComponents.DataAcquisition([0, 0], setup, {"dev": setup.alpha, "name": "RX"},
+                                                        False, tasks, database=database))
+        with self.assertRaises(TaskEngines.TaskEngineError):
+            TaskEngines.PooledTaskEngine(max_workers=1).check(list(tasks))
+        TaskEngines.PooledTaskEngine(max_workers=2).check(list(tasks))
+
+    def test_pool_keeps_its_cap(self):
+        engine = TaskEngines.PooledTaskEngine(parallel_sub_tasks=True)
+        self.assertEqual(TaskEngines.PooledTaskEngine.default_max_workers, engine.max_workers)
+        copy = TaskEngines.PooledTaskEngine(max_workers=3).fresh_copy()
+        self.assertEqual(3, copy.max_workers)
+        self.assertIsInstance(copy, TaskEngines.PooledTaskEngine)
+
+
+if __name__ == "__main__":
+    unittest.main()